@@ -0,0 +1,371 @@
+import asyncio
+import hashlib
+import json
+import math
+import sqlite3
+import time
+import logging
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from config import config
+from storage import WriteBehindMixin
+
+logger = logging.getLogger(__name__)
+
+
+def _hash64(value: str) -> int:
+
+    """Стабильный между процессами 64-битный хэш"""
+
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+
+    """Оценка числа уникальных значений в фиксированной памяти (2^p байт)
+
+    Погрешность около 1.04 / sqrt(2^p), для p=12 — примерно 1.6%.
+    Два счётчика объединяются поэлементным максимумом, поэтому дневные
+    значения складываются в недельные и месячные без потерь.
+    """
+
+    __slots__ = ("p", "m", "registers")
+
+    def __init__(self, p: int = 12, registers: Optional[bytes] = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers else bytearray(self.m)
+
+    def add(self, value):
+        h = _hash64(str(value))
+        index = h & (self.m - 1)
+        rest = h >> self.p
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Малые значения точнее считает linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class CountMinSketch:
+
+    """Приблизительные частоты: depth строк по width счётчиков
+
+    Оценка никогда не занижает реальную частоту, завышение ограничено
+    долей e/width от общего числа событий.
+    """
+
+    __slots__ = ("width", "depth", "table")
+
+    def __init__(self, width: int = 2048, depth: int = 4, table: Optional[bytes] = None):
+        self.width = width
+        self.depth = depth
+        self.table = array("I")
+        if table:
+            self.table.frombytes(table)
+        else:
+            self.table.extend(bytes(width * depth))
+
+    def _indexes(self, key: str):
+        h = _hash64(key)
+        h1, h2 = h & 0xFFFFFFFF, h >> 32
+        for row in range(self.depth):
+            yield row * self.width + (h1 + row * h2) % self.width
+
+    def add(self, key: str, count: int = 1) -> int:
+
+        """Добавляет count и возвращает новую оценку частоты"""
+
+        estimate = None
+        for index in self._indexes(key):
+            value = self.table[index] + count
+            self.table[index] = value
+            estimate = value if estimate is None else min(estimate, value)
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        return min(self.table[index] for index in self._indexes(key))
+
+    def merge(self, other: "CountMinSketch"):
+        for index, value in enumerate(other.table):
+            if value:
+                self.table[index] += value
+
+
+class HeavyHitters:
+
+    """Top-K частых значений: count-min sketch и не больше k кандидатов"""
+
+    __slots__ = ("k", "sketch", "candidates")
+
+    def __init__(self, k: int = 10, sketch: Optional[CountMinSketch] = None,
+                 candidates: Optional[Dict[str, int]] = None):
+        self.k = k
+        self.sketch = sketch or CountMinSketch()
+        self.candidates: Dict[str, int] = candidates or {}
+
+    def add(self, key: str, count: int = 1):
+        estimate = self.sketch.add(key, count)
+        if key in self.candidates or len(self.candidates) < self.k:
+            self.candidates[key] = estimate
+            return
+        weakest = min(self.candidates, key=self.candidates.__getitem__)
+        if estimate > self.candidates[weakest]:
+            del self.candidates[weakest]
+            self.candidates[key] = estimate
+
+    def merge(self, other: "HeavyHitters"):
+        self.sketch.merge(other.sketch)
+        keys = set(self.candidates) | set(other.candidates)
+        estimates = {key: self.sketch.estimate(key) for key in keys}
+        self.candidates = dict(sorted(estimates.items(), key=lambda item: -item[1])[:self.k])
+
+    def top(self, limit: int) -> List[Tuple[str, int]]:
+        return sorted(self.candidates.items(), key=lambda item: -item[1])[:limit]
+
+
+class DayRollup:
+
+    """Агрегаты одного дня (UTC); размер не зависит от числа пользователей"""
+
+    def __init__(self, day: str, top_k: int = 10):
+        self.day = day
+        self.messages = 0
+        self.users = HyperLogLog()
+        self.commands: Counter = Counter()
+        self.queries = HeavyHitters(top_k)
+        self.songs = HeavyHitters(top_k)
+
+    def merge(self, other: "DayRollup"):
+        self.messages += other.messages
+        self.users.merge(other.users)
+        self.commands.update(other.commands)
+        self.queries.merge(other.queries)
+        self.songs.merge(other.songs)
+
+    def to_row(self) -> tuple:
+        return (
+            self.day,
+            self.messages,
+            bytes(self.users.registers),
+            json.dumps(self.commands, ensure_ascii=False),
+            self.queries.sketch.table.tobytes(),
+            json.dumps(self.queries.candidates, ensure_ascii=False),
+            self.songs.sketch.table.tobytes(),
+            json.dumps(self.songs.candidates, ensure_ascii=False),
+        )
+
+    @classmethod
+    def from_row(cls, row: tuple, top_k: int = 10) -> "DayRollup":
+        rollup = cls(row[0], top_k)
+        rollup.messages = row[1]
+        rollup.users = HyperLogLog(registers=row[2])
+        rollup.commands = Counter(json.loads(row[3]))
+        rollup.queries = HeavyHitters(top_k, CountMinSketch(table=row[4]), json.loads(row[5]))
+        rollup.songs = HeavyHitters(top_k, CountMinSketch(table=row[6]), json.loads(row[7]))
+        return rollup
+
+
+def today() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def _days_back(count: int) -> List[str]:
+    now = time.time()
+    return [time.strftime("%Y-%m-%d", time.gmtime(now - i * 86400)) for i in range(count)]
+
+
+class Analytics(WriteBehindMixin):
+
+    """Потоковая статистика активности
+
+    Каждый процесс копит приращения за день в памяти, а сброс вливает их
+    в строку дня в SQLite (HLL — максимумом, счётчики — сложением), так
+    что несколько воркеров пишут в одну базу. /stats читает не больше
+    30 строк дней, независимо от числа пользователей.
+    """
+
+    COLUMNS = "day, messages, users, commands, queries, queries_top, songs, songs_top"
+
+    def __init__(
+            self,
+            filename: str = "analytics.db",
+            retention_days: int = 90,
+            top_k: int = 10,
+            flush_interval: float = 5.0,
+            flush_threshold: int = 100
+    ):
+        self.filename = filename
+        self.retention_days = retention_days
+        self.top_k = top_k
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Dict[str, DayRollup] = {}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analytics-writer")
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._init_write_behind(flush_interval, flush_threshold)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.filename, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS daily_stats (
+                day TEXT PRIMARY KEY,
+                messages INTEGER NOT NULL,
+                users BLOB NOT NULL,
+                commands TEXT NOT NULL,
+                queries BLOB NOT NULL,
+                queries_top TEXT NOT NULL,
+                songs BLOB NOT NULL,
+                songs_top TEXT NOT NULL
+            )"""
+        )
+        conn.commit()
+        return conn
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _rollup(self) -> DayRollup:
+        day = today()
+        rollup = self._pending.get(day)
+        if rollup is None:
+            rollup = self._pending[day] = DayRollup(day, self.top_k)
+        return rollup
+
+    def record_activity(self, user_id: int, command: Optional[str] = None):
+
+        """Сообщение или нажатие кнопки пользователя"""
+
+        rollup = self._rollup()
+        rollup.messages += 1
+        rollup.users.add(user_id)
+        if command:
+            rollup.commands[command] += 1
+        self._mark_dirty()
+
+    def record_query(self, query: str):
+        key = " ".join(query.casefold().split())[:64]
+        if key:
+            self._rollup().queries.add(key)
+            self._mark_dirty()
+
+    def record_song(self, title: str):
+        self._rollup().songs.add(title[:96])
+        self._mark_dirty()
+
+    def _merge_batch(self, rollups: List[DayRollup]):
+        if self._writer_conn is None:
+            self._writer_conn = self._connect()
+        conn = self._writer_conn
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for rollup in rollups:
+                row = conn.execute(
+                    f"SELECT {self.COLUMNS} FROM daily_stats WHERE day = ?", (rollup.day,)
+                ).fetchone()
+                if row is not None:
+                    stored = DayRollup.from_row(row, self.top_k)
+                    stored.merge(rollup)
+                    rollup = stored
+                conn.execute(
+                    f"INSERT OR REPLACE INTO daily_stats ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rollup.to_row()
+                )
+            oldest = _days_back(self.retention_days)[-1]
+            conn.execute("DELETE FROM daily_stats WHERE day < ?", (oldest,))
+
+    async def _flush_batch(self):
+        rollups = list(self._pending.values())
+        self._pending = {}
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._writer, self._merge_batch, rollups)
+        except Exception:
+            # Вернём приращения, чтобы не потерять их до следующего сброса
+            for rollup in rollups:
+                pending = self._pending.get(rollup.day)
+                if pending is not None:
+                    rollup.merge(pending)
+                self._pending[rollup.day] = rollup
+            raise
+
+    def _load_days(self, days: List[str]) -> Dict[str, DayRollup]:
+        placeholders = ", ".join("?" * len(days))
+        rows = self._get_conn().execute(
+            f"SELECT {self.COLUMNS} FROM daily_stats WHERE day IN ({placeholders})", days
+        ).fetchall()
+        loaded = {row[0]: DayRollup.from_row(row, self.top_k) for row in rows}
+        # Добавляем ещё не сброшенные приращения этого процесса
+        for day, pending in self._pending.items():
+            if day in days:
+                loaded.setdefault(day, DayRollup(day, self.top_k)).merge(pending)
+        return loaded
+
+    def summary(self, top: int = 5) -> Dict:
+
+        """DAU/WAU/MAU, команды за сегодня и top-N за неделю"""
+
+        days = _days_back(30)
+        loaded = self._load_days(days)
+
+        def unique_users(period: int) -> int:
+            hll = HyperLogLog()
+            for day in days[:period]:
+                if day in loaded:
+                    hll.merge(loaded[day].users)
+            return hll.count()
+
+        week = DayRollup(days[0], self.top_k)
+        for day in days[:7]:
+            if day in loaded:
+                week.merge(loaded[day])
+        current = loaded.get(days[0]) or DayRollup(days[0], self.top_k)
+
+        return {
+            "dau": unique_users(1),
+            "wau": unique_users(7),
+            "mau": unique_users(30),
+            "messages_today": current.messages,
+            "commands_today": current.commands.most_common(top),
+            "top_queries": week.queries.top(top),
+            "top_songs": week.songs.top(top),
+        }
+
+    def close(self):
+
+        """Сбрасывает отложенные приращения и закрывает соединения"""
+
+        if self._pending:
+            rollups = list(self._pending.values())
+            self._pending = {}
+            self._writer.submit(self._merge_batch, rollups).result()
+            self._dirty_count = 0
+        self._writer.shutdown(wait=True)
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+        if self._conn is not None:
+            self._conn.close()
+
+
+analytics = Analytics(
+    config.ANALYTICS_DB_FILE,
+    config.ANALYTICS_RETENTION_DAYS,
+    config.ANALYTICS_TOP_K,
+    flush_interval=config.STORAGE_FLUSH_INTERVAL,
+    flush_threshold=config.STORAGE_FLUSH_THRESHOLD
+)
@@ -0,0 +1,303 @@
+"""Сквозной бенчмарк: апдейты через настоящие router/admin_router без сети
+
+Поднимает заглушки Genius и Telegram Bot API (benchmarks/fake_servers.py),
+прогоняет синтетический поток апдейтов или поток из bot.log через
+диспетчер бота и печатает апдейты/с, перцентили задержки, число запросов
+к заглушкам и пиковый RSS. Запуск из каталога music_genius_bot:
+
+    python benchmarks/e2e.py --users 200 --updates-per-user 20
+    python benchmarks/e2e.py --from-log bot.log
+    python benchmarks/e2e.py --save-baseline baseline.json
+    python benchmarks/e2e.py --baseline baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_servers import FakeGenius, FakeTelegram, fake_song_ids  # noqa: E402
+
+BOT_TOKEN = "123456:BENCHMARK"
+LOG_LINE_RE = re.compile(r"User (\d+) (sent|pressed): (.*)$")
+
+
+class ServerThread:
+
+    """Заглушки в отдельном потоке со своим event loop, чтобы не мешать боту"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.genius = FakeGenius(args.genius_latency, args.genius_error_rate)
+        self.telegram = FakeTelegram(args.telegram_latency)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake-servers", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        for server in (self.genius, self.telegram):
+            asyncio.run_coroutine_threadsafe(server.start(), self._loop).result()
+
+    def stop(self):
+        for server in (self.genius, self.telegram):
+            asyncio.run_coroutine_threadsafe(server.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def synthetic_streams(users: int, updates_per_user: int, queries: int, seed: int) -> Dict[int, List[tuple]]:
+
+    """Типичный сценарий: /start, поиск, текст песни, иногда избранное
+
+    Запросы выбираются по закону Ципфа, поэтому часть из них повторяется
+    и попадает в кэши, как в жизни.
+    """
+
+    rng = random.Random(seed)
+    query_pool = [f"song query {i}" for i in range(queries)]
+    weights = [1 / (rank + 1) for rank in range(queries)]
+    streams: Dict[int, List[tuple]] = {}
+    for user_id in range(100001, 100001 + users):
+        stream = [("text", "/start")]
+        while len(stream) < updates_per_user:
+            query = rng.choices(query_pool, weights)[0]
+            song_id = rng.choice(fake_song_ids(query)[:5])
+            stream += [("text", "🎵 Найти песню"), ("text", query), ("callback", f"lyrics_{song_id}")]
+            roll = rng.random()
+            if roll < 0.3:
+                stream.append(("callback", f"fav_song_{song_id}"))
+            elif roll < 0.45:
+                stream.append(("text", "⭐ Избранное"))
+            elif roll < 0.5:
+                stream.append(("text", "/help"))
+        streams[user_id] = stream[:updates_per_user]
+    return streams
+
+
+def log_streams(filename: str, limit: Optional[int] = None) -> Dict[int, List[tuple]]:
+
+    """Поток апдейтов из строк LoggingMiddleware в bot.log"""
+
+    streams: Dict[int, List[tuple]] = {}
+    total = 0
+    with open(filename, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            match = LOG_LINE_RE.search(line.rstrip("\n"))
+            if match is None:
+                continue
+            user_id, kind, payload = int(match.group(1)), match.group(2), match.group(3)
+            if payload == "None":
+                continue
+            streams.setdefault(user_id, []).append(("text" if kind == "sent" else "callback", payload))
+            total += 1
+            if limit and total >= limit:
+                break
+    return streams
+
+
+def configure_environment(args: argparse.Namespace, servers: ServerThread, workdir: str):
+
+    """Переменные окружения до импорта config: заглушки и файлы во временном каталоге"""
+
+    env = {
+        "BOT_TOKEN": BOT_TOKEN,
+        "GENIUS_TOKEN": "benchmark",
+        "GENIUS_BASE_URL": f"http://127.0.0.1:{servers.genius.port}",
+        "STORAGE_BACKEND": args.storage,
+        "STORAGE_DB_FILE": os.path.join(workdir, "user_data.db"),
+        "STORAGE_JSON_FILE": os.path.join(workdir, "user_data.json"),
+        "SONG_STORE_FILE": os.path.join(workdir, "songs.db"),
+        "ANALYTICS_DB_FILE": os.path.join(workdir, "analytics.db"),
+        "BROADCAST_STATE_FILE": os.path.join(workdir, "broadcast_state.json"),
+        "SEARCH_SNAPSHOT_FILE": os.path.join(workdir, "search_index.json"),
+        "FSM_STORAGE": "memory",
+        "METRICS_PORT": "0",
+        "LOG_FILE": os.path.join(workdir, "bot.log"),
+        "LOG_LEVEL": "WARNING",
+    }
+    if not args.telegram_limits:
+        # Лимиты Telegram и защита от флуда ограничили бы пропускную способность, а не код
+        env.update({
+            "SEND_GLOBAL_RATE": "1000000", "SEND_CHAT_RATE": "1000000", "SEND_CHAT_BURST": "1000",
+            "THROTTLE_LIMITS": "",
+        })
+    os.environ.update(env)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+async def replay(streams: Dict[int, List[tuple]], servers: ServerThread, concurrency: int) -> Dict:
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.types import Update
+    from bot import create_dispatcher, start_stores, close_stores
+    from logging_setup import setup_logging
+
+    setup_logging()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{servers.telegram.port}"))
+    bot = Bot(token=BOT_TOKEN, session=session)
+    dp = create_dispatcher(metrics_port=0)
+    start_stores()
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot])
+
+    counter = {"update_id": 0, "message_id": 0}
+    latencies: List[float] = []
+    failures = 0
+
+    def build_update(user_id: int, kind: str, payload: str) -> Update:
+        counter["update_id"] += 1
+        counter["message_id"] += 1
+        user = {"id": user_id, "is_bot": False, "first_name": "Bench"}
+        message = {
+            "message_id": counter["message_id"],
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": payload,
+        }
+        if kind == "text":
+            data = {"update_id": counter["update_id"], "message": message}
+        else:
+            data = {"update_id": counter["update_id"], "callback_query": {
+                "id": str(counter["update_id"]),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": payload,
+                "message": message,
+            }}
+        return Update.model_validate(data, context={"bot": bot})
+
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run_user(user_id: int, stream: List[tuple]):
+        nonlocal failures
+        # Апдейты одного чата — строго по порядку, как в продакшене
+        async with limit:
+            for kind, payload in stream:
+                update = build_update(user_id, kind, payload)
+                started = time.perf_counter()
+                try:
+                    await dp.feed_update(bot, update)
+                except Exception:
+                    failures += 1
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(user_id, stream) for user_id, stream in streams.items()))
+    elapsed = time.perf_counter() - started
+
+    from services import get_genius
+    cache = get_genius().cache_stats()
+
+    await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot])
+    await dp.storage.close()
+    await bot.session.close()
+    await close_stores()
+
+    return {
+        "updates": len(latencies),
+        "failures": failures,
+        "elapsed_sec": round(elapsed, 3),
+        "updates_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "latency_max_ms": round(max(latencies, default=0.0) * 1000, 2),
+        "genius_requests": dict(servers.genius.requests),
+        "genius_requests_total": sum(servers.genius.requests.values()),
+        "genius_errors_injected": servers.genius.errors,
+        "genius_cache_hits": cache["hits"] + cache["stale_hits"],
+        "telegram_requests": dict(servers.telegram.requests),
+        # ru_maxrss в КБ (Linux); заглушки работают в этом же процессе
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+COMPARED = (
+    ("updates_per_sec", True),
+    ("latency_p50_ms", False),
+    ("latency_p95_ms", False),
+    ("latency_p99_ms", False),
+    ("genius_requests_total", False),
+    ("peak_rss_mb", False),
+)
+
+
+def print_report(report: Dict, baseline: Optional[Dict]):
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if not baseline:
+        return
+    print("\nСравнение с базовой линией:")
+    for key, higher_is_better in COMPARED:
+        old, new = baseline.get(key), report.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        better = change > 0 if higher_is_better else change < 0
+        mark = "✓" if better or abs(change) < 1 else "✗"
+        print(f"  {mark} {key}: {old} -> {new} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк бота с заглушками Genius и Telegram")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates-per-user", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=500, help="размер словаря запросов")
+    parser.add_argument("--from-log", help="воспроизвести сообщения из bot.log вместо синтетики")
+    parser.add_argument("--log-limit", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременно активных чатов")
+    parser.add_argument("--genius-latency", type=float, default=0.05)
+    parser.add_argument("--genius-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.01)
+    parser.add_argument("--telegram-limits", action="store_true", help="оставить лимиты отправки и защиту от флуда как в продакшене")
+    parser.add_argument("--storage", choices=("sqlite", "json"), default="sqlite")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="JSON-отчёт для сравнения")
+    parser.add_argument("--save-baseline", help="сохранить отчёт как базовую линию")
+    args = parser.parse_args()
+
+    if args.from_log:
+        streams = log_streams(args.from_log, args.log_limit)
+    else:
+        streams = synthetic_streams(args.users, args.updates_per_user, args.queries, args.seed)
+    if not streams:
+        sys.exit("Нет апдейтов для воспроизведения")
+
+    servers = ServerThread(args)
+    servers.start()
+    workdir = tempfile.mkdtemp(prefix="music-bot-bench-")
+    configure_environment(args, servers, workdir)
+    try:
+        report = asyncio.run(replay(streams, servers, args.concurrency))
+    finally:
+        servers.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
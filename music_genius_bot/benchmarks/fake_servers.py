@@ -0,0 +1,137 @@
+"""Локальные заглушки api.genius.com и Telegram Bot API для бенчмарков"""
+
+import abc
+import asyncio
+import hashlib
+import random
+import time
+from collections import Counter
+from typing import List, Optional
+from aiohttp import web
+
+# Сколько разных песен «знает» заглушка Genius
+SONG_SPACE = 5000
+
+
+def fake_song_ids(query: str, count: int = 10) -> List[int]:
+
+    """Детерминированные id песен для запроса (их же использует генератор апдейтов)"""
+
+    seed = int.from_bytes(hashlib.blake2b(query.casefold().encode("utf-8"), digest_size=8).digest(), "little")
+    return [(seed + i * 7919) % SONG_SPACE + 1 for i in range(count)]
+
+
+def fake_song(song_id: int) -> dict:
+    artist_id = song_id % 500 + 1
+    return {
+        "id": song_id,
+        "title": f"Song {song_id}",
+        "url": f"https://genius.com/fake-song-{song_id}-lyrics",
+        "primary_artist": {"id": artist_id, "name": f"Artist {artist_id}"},
+    }
+
+
+class FakeServer(abc.ABC):
+
+    """aiohttp-приложение на 127.0.0.1 с задержкой и долей ошибок"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests: Counter = Counter()
+        self.errors = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    @abc.abstractmethod
+    def build_app(self) -> web.Application:
+
+        """Приложение с маршрутами конкретного API"""
+
+    async def _delay(self):
+        if self.latency:
+            # Разброс ±50%, чтобы ответы не приходили строем
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def _should_fail(self) -> bool:
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+    async def start(self, port: int = 0) -> int:
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class FakeGenius(FakeServer):
+
+    """Заглушка Genius: /search и /songs/{id}"""
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/search", self._search)
+        app.router.add_get("/songs/{song_id}", self._song)
+        return app
+
+    async def _search(self, request: web.Request) -> web.Response:
+        self.requests["/search"] += 1
+        await self._delay()
+        if self._should_fail():
+            return web.json_response({"error": "fake"}, status=500)
+        hits = [{"type": "song", "result": fake_song(song_id)} for song_id in fake_song_ids(request.query.get("q", ""))]
+        return web.json_response({"meta": {"status": 200}, "response": {"hits": hits}})
+
+    async def _song(self, request: web.Request) -> web.Response:
+        self.requests["/songs/{id}"] += 1
+        await self._delay()
+        if self._should_fail():
+            return web.json_response({"error": "fake"}, status=500)
+        song = fake_song(int(request.match_info["song_id"]))
+        return web.json_response({"meta": {"status": 200}, "response": {"song": song}})
+
+
+class FakeTelegram(FakeServer):
+
+    """Заглушка Bot API: отвечает ok на любой метод, sendMessage возвращает Message"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        super().__init__(latency, error_rate)
+        self._message_id = 0
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._method)
+        return app
+
+    async def _method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.requests[method] += 1
+        params = await request.post()
+        await self._delay()
+        if self._should_fail():
+            return web.json_response({"ok": False, "error_code": 500, "description": "fake"}, status=500)
+
+        if method in ("sendMessage", "editMessageText"):
+            self._message_id += 1
+            chat_id = int(params.get("chat_id", 0))
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
@@ -0,0 +1,86 @@
+"""Память и скорость чтения записей пользователей
+
+Сравнивает прежние записи-словари (язык + два списка) с UserTable на
+заданном числе пользователей. Запуск из каталога music_genius_bot:
+
+    python benchmarks/user_memory.py --users 1000000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_model import UserTable  # noqa: E402
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def build_dicts(users: int, favorites_every: int):
+    data = {}
+    for user_id in range(users):
+        record = {"language": "ru", "favorite_songs": [], "favorite_artists": []}
+        if user_id % favorites_every == 0:
+            record["favorite_songs"].append({
+                "id": user_id % 1000,
+                "title": f"Song {user_id % 1000}",
+                "primary_artist": {"name": "Artist", "id": 1}
+            })
+        data[user_id] = record
+    return data
+
+
+def build_table(users: int, favorites_every: int):
+    table = UserTable()
+    songs = {}
+    for user_id in range(users):
+        table.ensure(user_id)
+        if user_id % favorites_every == 0:
+            song_id = user_id % 1000
+            song = songs.get(song_id)
+            if song is None:
+                song = songs[song_id] = {
+                    "id": song_id,
+                    "title": f"Song {song_id}",
+                    "primary_artist": {"name": "Artist", "id": 1}
+                }
+            table.add_song(user_id, song)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--favorites-every", type=int, default=10,
+                        help="у каждого N-го пользователя одна песня в избранном")
+    args = parser.parse_args()
+
+    _, dict_bytes, dict_time = measure(lambda: build_dicts(args.users, args.favorites_every))
+    table, table_bytes, table_time = measure(lambda: build_table(args.users, args.favorites_every))
+
+    started = time.perf_counter()
+    for user_id in range(args.users, args.users * 2):
+        table.get_language(user_id)
+    miss_time = time.perf_counter() - started
+
+    print(f"Пользователей: {args.users}")
+    print(f"dict-записи: {dict_bytes / 2 ** 20:8.1f} МБ, {dict_bytes / args.users:6.1f} Б/польз., {dict_time:.2f} с")
+    print(f"UserTable:   {table_bytes / 2 ** 20:8.1f} МБ, {table_bytes / args.users:6.1f} Б/польз., {table_time:.2f} с")
+    print(f"get_language для неизвестных: {miss_time / args.users * 1e9:.0f} нс, новых записей: {len(table) - args.users}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,24 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.types import Message
+from aiogram.types import Message, CallbackQuery, InlineQuery
 from typing import Callable, Dict, Any, Awaitable
 from config import config
 from handlers import router, admin_router
+from services import on_startup, on_shutdown
+from webhook import run_webhook
+from workers import run_supervisor
+from fsm_storage import create_fsm_storage
+from storage import storage
+from song_store import song_store
+from analytics import analytics
+from favorites_refresh import get_favorites_refresher
+from metrics import metrics, MetricsServer
+from logging_setup import setup_logging
+from middlewares.access import AccessMiddleware
+
+# Каждое сообщение логируется в отдельный логгер, его можно сэмплировать
+message_logger = logging.getLogger("bot.messages")
 
 
 # Классы middleware
@@ -15,57 +29,108 @@ class LoggingMiddleware:
             event: Message,
             data: Dict[str, Any]
     ) -> Any:
-        logging.info(f"User {event.from_user.id} sent: {event.text}")
-        return await handler(event, data)
+        # Inner middleware: фильтры уже отработали, известен обработчик
+        handler_object = data.get("handler")
+        handler_name = handler_object.callback.__name__ if handler_object else "unhandled"
+        analytics.record_activity(event.from_user.id, handler_name)
+        if isinstance(event, CallbackQuery):
+            message_logger.info(f"User {event.from_user.id} pressed: {event.data}")
+        elif isinstance(event, InlineQuery):
+            message_logger.info(f"User {event.from_user.id} inline: {event.query}")
+        else:
+            message_logger.info(f"User {event.from_user.id} sent: {event.text}")
+        with metrics.track("bot_handler_seconds", handler=handler_name):
+            return await handler(event, data)
 
 
-class AdminMiddleware:
-    async def __call__(
-            self,
-            handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
-            event: Message,
-            data: Dict[str, Any]
-    ) -> Any:
-        if event.from_user.id not in config.ADMIN_IDS:
-            await event.answer("🚫 Доступ запрещён!")
-            return
-        return await handler(event, data)
+def create_dispatcher(
+        metrics_port: int = config.METRICS_PORT,
+        search_snapshot_file: str = config.SEARCH_SNAPSHOT_FILE
+) -> Dispatcher:
+
+    """Диспетчер с middleware, роутерами и хуками (по одному на процесс)"""
+
+    dp = Dispatcher(storage=create_fsm_storage())
+    # Попадает в on_startup/on_shutdown через workflow_data
+    dp["search_snapshot_file"] = search_snapshot_file
+
+    # Регистрация middleware: отказ банам и флуду — раньше всего остального,
+    # проверка админов висит на admin_router (handlers.py)
+    access = AccessMiddleware()
+    dp.message.outer_middleware.register(access)
+    dp.callback_query.outer_middleware.register(access)
+    dp.inline_query.outer_middleware.register(access)
+    dp.message.middleware.register(LoggingMiddleware())
+    dp.callback_query.middleware.register(LoggingMiddleware())
+    dp.inline_query.middleware.register(LoggingMiddleware())
+
+    dp.include_router(admin_router)
+    dp.include_router(router)
 
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
+    if metrics_port:
+        metrics_server = MetricsServer(metrics, config.METRICS_HOST, metrics_port)
+        dp.startup.register(metrics_server.start)
+        dp.shutdown.register(metrics_server.stop)
+    return dp
+
+
+def start_stores():
+
+    """Запуск фонового сброса хранилищ (внутри работающего event loop)"""
+
+    for store in (storage, song_store, analytics):
+        store.start_flusher()
+
+
+async def close_stores():
+
+    """Финальный сброс и закрытие хранилищ"""
+
+    logger = logging.getLogger(__name__)
+    # Фоновое обновление избранного пишет в storage — останавливаем до сброса
+    await get_favorites_refresher().stop_scheduler()
+    for store in (storage, song_store, analytics):
+        try:
+            await store.stop_flusher()
+        except Exception as e:
+            logger.error(f"Ошибка сохранения данных: {e}", exc_info=True)
+        await asyncio.to_thread(store.close)
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("bot.log"),
-        logging.StreamHandler()
-    ]
-)
 
 async def main():
+    # Не при импорте: воркеры импортируют этот модуль и настраивают свой файл логов
+    setup_logging()
     logger = logging.getLogger(__name__)
     try:
         logger.info("Запуск бота...")
         bot = Bot(token=config.BOT_TOKEN)
-        dp = Dispatcher()
+        dp = create_dispatcher()
 
-        # Регистрация middleware
-        dp.message.middleware.register(LoggingMiddleware())
-        dp.message.middleware.register(AdminMiddleware())
-        dp.callback_query.middleware.register(AdminMiddleware())
+        if config.WORKERS > 1:
+            # Апдейты обрабатывают дочерние процессы, здесь только приём
+            await run_supervisor(bot, dp, config.WORKERS)
+            return
 
-        dp.include_router(admin_router)
-        dp.include_router(router)
+        start_stores()
+        get_favorites_refresher().start_scheduler()
 
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("Бот начал поллинг...")
-        await dp.start_polling(bot)
+        if config.RUN_MODE == "webhook":
+            logger.info("Бот запущен в режиме webhook...")
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            logger.info("Бот начал поллинг...")
+            await dp.start_polling(bot)
 
     except Exception as e:
         logger.error(f"Ошибка: {e}", exc_info=True)
     finally:
         if 'bot' in locals():
             await bot.session.close()
+        await close_stores()
         logger.info("Бот остановлен")
 
 
@@ -0,0 +1,272 @@
+import asyncio
+import json
+import os
+import time
+import logging
+from typing import Dict, List, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from config import config
+from storage import storage
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+
+    """Асинхронный token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+
+        """Заморозка выдачи токенов (например, по retry_after от Telegram)"""
+
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    def is_idle(self) -> bool:
+
+        """Бакет не на паузе и успел бы наполниться до capacity"""
+
+        now = time.monotonic()
+        refilled = self._tokens + (now - self._updated) * self.rate
+        return now >= self._paused_until and refilled >= self.capacity
+
+    def try_acquire(self) -> bool:
+
+        """Взять токен без ожидания; False — если токенов нет"""
+
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Общий лимит Telegram на бота: его делят ответы пользователям (sender.py)
+# и рассылка. Воркеры отправляют независимо, поэтому у каждого своя доля
+global_send_limiter = TokenBucket(config.SEND_GLOBAL_RATE / config.WORKERS)
+
+
+class BroadcastJob:
+
+    """Состояние рассылки, которое переживает перезапуск"""
+
+    def __init__(self, text: str, admin_chat_id: int, cursor: Optional[int] = None,
+                 counters: Optional[Dict[str, int]] = None, started_at: Optional[float] = None):
+        self.text = text
+        self.admin_chat_id = admin_chat_id
+        # id последнего пользователя полностью обработанной пачки
+        self.cursor = cursor
+        self.counters = counters or {"sent": 0, "blocked": 0, "failed": 0, "skipped": 0}
+        self.started_at = started_at or time.time()
+
+    def to_dict(self) -> Dict:
+        return {
+            "text": self.text,
+            "admin_chat_id": self.admin_chat_id,
+            "cursor": self.cursor,
+            "counters": self.counters,
+            "started_at": self.started_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "BroadcastJob":
+        return cls(data["text"], data["admin_chat_id"], data.get("cursor"),
+                   data.get("counters"), data.get("started_at"))
+
+
+class Broadcaster:
+
+    """Рассылка пулом воркеров с ограничением скорости
+
+    Пользователи обрабатываются пачками; после каждой пачки курсор
+    сохраняется на диск, поэтому прерванная рассылка продолжается с места
+    остановки (в худшем случае повторится одна пачка). Кроме своего
+    лимита rate рассылка берёт токены из общего лимита бота, чтобы вместе
+    с ответами пользователям не превысить его.
+    """
+
+    CHUNK_SIZE = 100
+    PROGRESS_INTERVAL = 5.0
+
+    def __init__(self, storage, state_file: str, rate: float, workers: int,
+                 global_limiter: Optional[TokenBucket] = None):
+        self.storage = storage
+        self.state_file = state_file
+        self.workers = workers
+        self.limiter = TokenBucket(rate)
+        self.global_limiter = global_limiter or global_send_limiter
+        self.job: Optional[BroadcastJob] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def load_unfinished(self) -> Optional[BroadcastJob]:
+
+        """Незавершённая рассылка с прошлого запуска, если есть"""
+
+        if not os.path.exists(self.state_file):
+            return None
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                return BroadcastJob.from_dict(json.load(f))
+        except (json.JSONDecodeError, KeyError) as e:
+            logger.error(f"Повреждён файл состояния рассылки: {e}")
+            return None
+
+    def _save_state(self):
+        tmp_filename = f"{self.state_file}.tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            json.dump(self.job.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_filename, self.state_file)
+
+    def _clear_state(self):
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+    def start(self, bot: Bot, job: BroadcastJob, progress_message_id: int) -> asyncio.Task:
+        self.job = job
+        self._task = asyncio.create_task(self._run(bot, progress_message_id))
+        self._task.add_done_callback(self._on_done)
+        return self._task
+
+    @staticmethod
+    def _on_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Рассылка прервана: {task.exception()}")
+
+    def _chunks(self, user_ids: List[int]):
+        chunk: List[int] = []
+        for user_id in user_ids:
+            if self.job.cursor is not None and user_id <= self.job.cursor:
+                continue
+            chunk.append(user_id)
+            if len(chunk) >= self.CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def _run(self, bot: Bot, progress_message_id: int):
+        job = self.job
+        banned = self.storage.get_banned_ids()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.create_task(self._worker(bot, queue)) for _ in range(self.workers)]
+        progress = asyncio.create_task(self._report_progress(bot, progress_message_id))
+        try:
+            await asyncio.to_thread(self._save_state)
+            for chunk in self._chunks(await self.storage.get_user_ids()):
+                for user_id in chunk:
+                    if user_id in banned:
+                        job.counters["skipped"] += 1
+                        continue
+                    await queue.put(user_id)
+                await queue.join()
+                job.cursor = chunk[-1]
+                await asyncio.to_thread(self._save_state)
+            await asyncio.to_thread(self._clear_state)
+        finally:
+            for task in workers + [progress]:
+                task.cancel()
+            await asyncio.gather(*workers, progress, return_exceptions=True)
+
+        await self._edit_progress(bot, progress_message_id, finished=True)
+        logger.info(f"Рассылка завершена: {job.counters}")
+
+    async def _worker(self, bot: Bot, queue: asyncio.Queue):
+        while True:
+            user_id = await queue.get()
+            try:
+                status = await self._send(bot, user_id)
+                self.job.counters[status] += 1
+            finally:
+                queue.task_done()
+
+    async def _send(self, bot: Bot, user_id: int, attempts: int = 3) -> str:
+        for _ in range(attempts):
+            await self.limiter.acquire()
+            await self.global_limiter.acquire()
+            try:
+                await bot.send_message(user_id, f"📢 Рассылка:\n{self.job.text}")
+                return "sent"
+            except TelegramRetryAfter as e:
+                logger.warning(f"Флуд-контроль рассылки, ждём {e.retry_after} с")
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return "blocked"
+            except TelegramBadRequest as e:
+                logger.error(f"Ошибка отправки для {user_id}: {e}")
+                return "failed"
+            except Exception as e:
+                logger.error(f"Ошибка отправки для {user_id}: {e}")
+                return "failed"
+        return "failed"
+
+    def format_progress(self, finished: bool = False) -> str:
+        counters = self.job.counters
+        elapsed = max(time.time() - self.job.started_at, 1)
+        processed = counters["sent"] + counters["blocked"] + counters["failed"]
+        header = "✅ Рассылка завершена" if finished else "📤 Рассылка идёт"
+        return (
+            f"{header}\n"
+            f"• Отправлено: {counters['sent']}\n"
+            f"• Заблокировали бота: {counters['blocked']}\n"
+            f"• Ошибки: {counters['failed']}\n"
+            f"• Пропущено (бан): {counters['skipped']}\n"
+            f"• Скорость: {processed / elapsed:.1f} сообщ./с"
+        )
+
+    async def _edit_progress(self, bot: Bot, message_id: int, finished: bool = False):
+        try:
+            await bot.edit_message_text(
+                self.format_progress(finished),
+                chat_id=self.job.admin_chat_id,
+                message_id=message_id
+            )
+        except TelegramBadRequest:
+            # "message is not modified" — прогресс не изменился
+            pass
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки: {e}")
+
+    async def _report_progress(self, bot: Bot, message_id: int):
+        while True:
+            await asyncio.sleep(self.PROGRESS_INTERVAL)
+            await self._edit_progress(bot, message_id)
+
+
+def get_broadcaster() -> Broadcaster:
+    return Broadcaster(
+        storage,
+        config.BROADCAST_STATE_FILE,
+        config.BROADCAST_RATE,
+        config.BROADCAST_WORKERS
+    )
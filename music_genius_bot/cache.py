@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class CacheEntry:
+
+    """Запись кэша: значение, время устаревания и примерный размер"""
+
+    __slots__ = ("value", "expires_at", "size")
+
+    def __init__(self, value: Any, expires_at: float, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+
+class TTLCache:
+
+    """LRU-кэш с TTL и ограничением по числу записей и объёму
+
+    Просроченная запись не удаляется сразу: в течение stale_ttl секунд
+    её можно отдать как устаревшую (stale-while-revalidate), пока её
+    обновляет фоновая задача.
+    """
+
+    def __init__(self, max_entries: int = 5000, max_bytes: int = 50 * 1024 * 1024, stale_ttl: float = 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_ttl = stale_ttl
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Tuple[Optional[Any], bool]:
+
+        """Возвращает (значение, устарело ли оно); (None, False) при промахе"""
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, False
+
+        now = time.monotonic()
+        if now >= entry.expires_at + self.stale_ttl:
+            self._remove(key)
+            self.misses += 1
+            return None, False
+
+        self._entries.move_to_end(key)
+        if now >= entry.expires_at:
+            self.stale_hits += 1
+            return entry.value, True
+        self.hits += 1
+        return entry.value, False
+
+    def set(self, key: str, value: Any, ttl: float, size: int = 0):
+
+        """Сохранение значения с вытеснением самых старых записей"""
+
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = CacheEntry(value, time.monotonic() + ttl, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+
+        """Счётчики попаданий и промахов"""
+
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -7,7 +7,86 @@ load_dotenv()
 class Config:
     BOT_TOKEN: str = os.getenv('BOT_TOKEN')
     GENIUS_TOKEN: str = os.getenv('GENIUS_TOKEN')
+    GENIUS_BASE_URL: str = os.getenv('GENIUS_BASE_URL', 'https://api.genius.com').rstrip('/')
     ADMIN_IDS: list[int] = [int(id) for id in os.getenv('ADMIN_IDS').split(',')] if os.getenv('ADMIN_IDS') else []
+    STORAGE_BACKEND: str = os.getenv('STORAGE_BACKEND', 'sqlite')
+    STORAGE_DB_FILE: str = os.getenv('STORAGE_DB_FILE', 'user_data.db')
+    STORAGE_JSON_FILE: str = os.getenv('STORAGE_JSON_FILE', 'user_data.json')
+    STORAGE_FLUSH_INTERVAL: float = float(os.getenv('STORAGE_FLUSH_INTERVAL', '5'))
+    STORAGE_FLUSH_THRESHOLD: int = int(os.getenv('STORAGE_FLUSH_THRESHOLD', '100'))
+    # Сколько секунд процесс верит своему кэшу пользователей и банов при WORKERS > 1
+    STORAGE_CACHE_TTL: float = float(os.getenv('STORAGE_CACHE_TTL', '10'))
+    GENIUS_CACHE_MAX_ENTRIES: int = int(os.getenv('GENIUS_CACHE_MAX_ENTRIES', '5000'))
+    GENIUS_CACHE_MAX_BYTES: int = int(os.getenv('GENIUS_CACHE_MAX_BYTES', str(50 * 1024 * 1024)))
+    GENIUS_CACHE_STALE_TTL: float = float(os.getenv('GENIUS_CACHE_STALE_TTL', '3600'))
+    GENIUS_MAX_CONCURRENCY: int = int(os.getenv('GENIUS_MAX_CONCURRENCY', '10'))
+    GENIUS_POOL_LIMIT: int = int(os.getenv('GENIUS_POOL_LIMIT', '20'))
+    GENIUS_KEEPALIVE_TIMEOUT: float = float(os.getenv('GENIUS_KEEPALIVE_TIMEOUT', '30'))
+    GENIUS_DNS_CACHE_TTL: int = int(os.getenv('GENIUS_DNS_CACHE_TTL', '300'))
+    GENIUS_MAX_RETRIES: int = int(os.getenv('GENIUS_MAX_RETRIES', '2'))
+    GENIUS_BREAKER_THRESHOLD: int = int(os.getenv('GENIUS_BREAKER_THRESHOLD', '5'))
+    GENIUS_BREAKER_RESET: float = float(os.getenv('GENIUS_BREAKER_RESET', '30'))
+    GENIUS_PREFETCH_CONCURRENCY: int = int(os.getenv('GENIUS_PREFETCH_CONCURRENCY', '2'))
+    GENIUS_PREFETCH_MAX_PENDING: int = int(os.getenv('GENIUS_PREFETCH_MAX_PENDING', '50'))
+    SONG_STORE_FILE: str = os.getenv('SONG_STORE_FILE', 'songs.db')
+    BROADCAST_STATE_FILE: str = os.getenv('BROADCAST_STATE_FILE', 'broadcast_state.json')
+    BROADCAST_RATE: float = float(os.getenv('BROADCAST_RATE', '25'))
+    BROADCAST_WORKERS: int = int(os.getenv('BROADCAST_WORKERS', '10'))
+    FAVORITES_REFRESH_STATE_FILE: str = os.getenv('FAVORITES_REFRESH_STATE_FILE', 'favorites_refresh_state.json')
+    FAVORITES_REFRESH_RATE: float = float(os.getenv('FAVORITES_REFRESH_RATE', '2'))
+    FAVORITES_REFRESH_WORKERS: int = int(os.getenv('FAVORITES_REFRESH_WORKERS', '4'))
+    # Часы (локальное время) фонового обновления, например "3-6"; пусто — только по /refresh_favorites
+    FAVORITES_REFRESH_HOURS: str = os.getenv('FAVORITES_REFRESH_HOURS', '')
+    SONG_STORE_MAX_AGE: float = float(os.getenv('SONG_STORE_MAX_AGE', str(7 * 24 * 60 * 60)))
+    RUN_MODE: str = os.getenv('RUN_MODE', 'polling')
+    WEBHOOK_URL: str = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_PATH: str = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_SECRET: str = os.getenv('WEBHOOK_SECRET', '')
+    WEBHOOK_HOST: str = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT: int = int(os.getenv('WEBHOOK_PORT', '8080'))
+    WEBHOOK_QUEUE_SIZE: int = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+    WEBHOOK_WORKERS: int = int(os.getenv('WEBHOOK_WORKERS', '8'))
+    WEBHOOK_MAX_IN_FLIGHT: int = int(os.getenv('WEBHOOK_MAX_IN_FLIGHT', '100'))
+    WORKERS: int = int(os.getenv('WORKERS', '1'))
+    WORKER_QUEUE_SIZE: int = int(os.getenv('WORKER_QUEUE_SIZE', '1000'))
+    WORKER_MAX_IN_FLIGHT: int = int(os.getenv('WORKER_MAX_IN_FLIGHT', '100'))
+    FSM_STORAGE: str = os.getenv('FSM_STORAGE', 'sqlite')
+    FSM_DB_FILE: str = os.getenv('FSM_DB_FILE', 'fsm.db')
+    SEARCH_INDEX_MAX_SONGS: int = int(os.getenv('SEARCH_INDEX_MAX_SONGS', '50000'))
+    SEARCH_SNAPSHOT_FILE: str = os.getenv('SEARCH_SNAPSHOT_FILE', 'search_index.json')
+    SEARCH_LOCAL_MIN_SCORE: float = float(os.getenv('SEARCH_LOCAL_MIN_SCORE', '0.75'))
+    INLINE_CACHE_TIME: int = int(os.getenv('INLINE_CACHE_TIME', '300'))
+    INLINE_MIN_LOCAL_HITS: int = int(os.getenv('INLINE_MIN_LOCAL_HITS', '3'))
+    INLINE_DEBOUNCE: float = float(os.getenv('INLINE_DEBOUNCE', '0.4'))
+    # Пауза перед поиском и обработкой кнопок: быстрые повторы схлопываются в один запрос (0 — без паузы)
+    SUPERSEDE_DEBOUNCE: float = float(os.getenv('SUPERSEDE_DEBOUNCE', '0'))
+    # Лимиты на пользователя по классам обработчиков: класс=токенов_в_секунду/ёмкость
+    THROTTLE_LIMITS: str = os.getenv('THROTTLE_LIMITS', 'search=0.2/3,callback=1/5,message=1/5')
+    FAVORITES_PAGE_SIZE: int = int(os.getenv('FAVORITES_PAGE_SIZE', '10'))
+    FAVORITES_PAGE_CACHE_SIZE: int = int(os.getenv('FAVORITES_PAGE_CACHE_SIZE', '10000'))
+    SEND_GLOBAL_RATE: float = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+    SEND_CHAT_RATE: float = float(os.getenv('SEND_CHAT_RATE', '1'))
+    SEND_CHAT_BURST: int = int(os.getenv('SEND_CHAT_BURST', '3'))
+    ANALYTICS_DB_FILE: str = os.getenv('ANALYTICS_DB_FILE', 'analytics.db')
+    ANALYTICS_RETENTION_DAYS: int = int(os.getenv('ANALYTICS_RETENTION_DAYS', '90'))
+    ANALYTICS_TOP_K: int = int(os.getenv('ANALYTICS_TOP_K', '10'))
+    METRICS_HOST: str = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT: int = int(os.getenv('METRICS_PORT', '0'))
+    LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FILE: str = os.getenv('LOG_FILE', 'bot.log')
+    LOG_FORMAT: str = os.getenv('LOG_FORMAT', 'text')
+    LOG_ROTATION: str = os.getenv('LOG_ROTATION', 'size')
+    LOG_MAX_BYTES: int = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_ROTATE_WHEN: str = os.getenv('LOG_ROTATE_WHEN', 'midnight')
+    LOG_BACKUP_COUNT: int = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    # Доля записей ниже WARNING, которая попадает в лог: логгер=доля через запятую
+    LOG_SAMPLE_RATES: str = os.getenv('LOG_SAMPLE_RATES', 'bot.messages=0.1,aiogram.event=0.1')
+    LOG_RATE_LIMIT: int = int(os.getenv('LOG_RATE_LIMIT', '20'))
+    LOG_RATE_INTERVAL: float = float(os.getenv('LOG_RATE_INTERVAL', '60'))
+    PROFILE_DIR: str = os.getenv('PROFILE_DIR', 'profiles')
+    PROFILE_MAX_SECONDS: int = int(os.getenv('PROFILE_MAX_SECONDS', '120'))
+    PROFILE_SAMPLE_INTERVAL: float = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))
+    PROFILE_SLOW_CALLBACK: float = float(os.getenv('PROFILE_SLOW_CALLBACK', '0.1'))
 
     @classmethod
     def validate(cls):
@@ -17,6 +96,20 @@ class Config:
             raise ValueError("Не указан GENIUS_TOKEN в .env файле")
         if not cls.ADMIN_IDS:
             logging.warning("Не указаны ADMIN_IDS в .env файле")
+        if cls.RUN_MODE not in ("polling", "webhook"):
+            raise ValueError(f"Неизвестный RUN_MODE: {cls.RUN_MODE}")
+        if cls.RUN_MODE == "webhook" and not cls.WEBHOOK_URL:
+            raise ValueError("Для RUN_MODE=webhook нужно указать WEBHOOK_URL")
+        if cls.WORKERS > 1 and (cls.STORAGE_BACKEND != "sqlite" or cls.FSM_STORAGE != "sqlite"):
+            raise ValueError("Для WORKERS > 1 нужны STORAGE_BACKEND=sqlite и FSM_STORAGE=sqlite")
+        if cls.WORKERS > 1 and cls.RUN_MODE != "polling":
+            raise ValueError("WORKERS > 1 поддерживается только в режиме polling")
+        if cls.LOG_FORMAT not in ("text", "json"):
+            raise ValueError(f"Неизвестный LOG_FORMAT: {cls.LOG_FORMAT}")
+        if cls.LOG_ROTATION not in ("size", "time"):
+            raise ValueError(f"Неизвестный LOG_ROTATION: {cls.LOG_ROTATION}")
+        if cls.RUN_MODE == "webhook" and not cls.WEBHOOK_SECRET:
+            logging.warning("WEBHOOK_SECRET не задан, webhook принимает запросы без проверки")
 
 config = Config()
 config.validate()
\ No newline at end of file
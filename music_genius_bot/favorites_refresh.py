@@ -0,0 +1,248 @@
+import asyncio
+import json
+import os
+import time
+import logging
+from datetime import datetime
+from typing import Coroutine, Dict, List, Optional, Tuple
+from config import config
+from storage import storage
+from song_store import song_store
+from services import get_genius, GeniusAPIError, GeniusUnavailableError
+from broadcast import TokenBucket
+from user_model import favorite_song_record
+
+logger = logging.getLogger(__name__)
+
+
+def parse_hours(value: str) -> Optional[Tuple[int, int]]:
+
+    """Окно часов «3-6» -> (3, 6); пустая строка — окна нет"""
+
+    if not value.strip():
+        return None
+    start, _, end = value.partition("-")
+    return int(start) % 24, int(end or start) % 24
+
+
+def in_window(hour: int, window: Tuple[int, int]) -> bool:
+    start, end = window
+    if start <= end:
+        return start <= hour < end
+    # Окно через полночь, например 23-5
+    return hour >= start or hour < end
+
+
+def seconds_until_end(now: datetime, window: Tuple[int, int]) -> float:
+
+    """Сколько секунд осталось до конца окна, внутри которого now"""
+
+    hours_left = (window[1] - now.hour) % 24 or 24
+    return hours_left * 3600 - now.minute * 60 - now.second
+
+
+class RefreshJob:
+
+    """Проход по избранному, который переживает перезапуск"""
+
+    def __init__(self, cursor: Optional[int] = None, counters: Optional[Dict[str, int]] = None,
+                 started_at: Optional[float] = None):
+        # id последней полностью обработанной песни
+        self.cursor = cursor
+        self.counters = counters or {"checked": 0, "fetched": 0, "updated": 0, "failed": 0}
+        self.started_at = started_at or time.time()
+
+    def to_dict(self) -> Dict:
+        return {"cursor": self.cursor, "counters": self.counters, "started_at": self.started_at}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RefreshJob":
+        return cls(data.get("cursor"), data.get("counters"), data.get("started_at"))
+
+
+class FavoritesRefresher:
+
+    """Фоновое обновление снимков песен в избранном
+
+    Песни перебираются пачками по возрастанию id, уникальными по всем
+    пользователям, поэтому каждая песня запрашивается один раз, сколько бы
+    пользователей её ни добавили. Свежие записи берутся из постоянного
+    кэша песен без сети, остальные — через /songs/{id} пулом воркеров с
+    ограничением скорости. Изменившиеся снимки пишутся пачкой, курсор
+    сохраняется на диск после каждой пачки: прерванный или ограниченный
+    по времени проход продолжается со следующей песни.
+    """
+
+    CHUNK_SIZE = 200
+    SCHEDULE_CHECK_INTERVAL = 300.0
+
+    def __init__(self, storage, state_file: str, rate: float, workers: int):
+        self.storage = storage
+        self.state_file = state_file
+        self.workers = workers
+        self.limiter = TokenBucket(rate)
+        self.genius = get_genius()
+        self.job: Optional[RefreshJob] = None
+        self._lock = asyncio.Lock()
+        self._scheduler: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked() or (self._task is not None and not self._task.done())
+
+    def start(self, work: Coroutine) -> asyncio.Task:
+
+        """Внеочередной проход: work (run() и отчёт) фоновой задачей
+
+        Задача запоминается сразу, поэтому running верен ещё до её старта.
+        """
+
+        self._task = asyncio.create_task(work)
+        self._task.add_done_callback(self._on_done)
+        return self._task
+
+    @staticmethod
+    def _on_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Обновление избранного прервано: {task.exception()}")
+
+    def _load_state(self) -> RefreshJob:
+        if not os.path.exists(self.state_file):
+            return RefreshJob()
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                return RefreshJob.from_dict(json.load(f))
+        except (json.JSONDecodeError, AttributeError) as e:
+            logger.error(f"Повреждён файл состояния обновления избранного: {e}")
+            return RefreshJob()
+
+    def _save_state(self):
+        tmp_filename = f"{self.state_file}.tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            json.dump(self.job.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_filename, self.state_file)
+
+    def _clear_state(self):
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+    async def run(self, deadline: Optional[float] = None) -> Dict[str, int]:
+
+        """Проход от сохранённого курсора до конца или до deadline (time.monotonic())
+
+        Возвращает счётчики прохода; если он не закончен, курсор остаётся
+        на диске для следующего запуска.
+        """
+
+        async with self._lock:
+            self.job = job = await asyncio.to_thread(self._load_state)
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+            updates: List[Dict] = []
+            workers = [asyncio.create_task(self._worker(queue, updates)) for _ in range(self.workers)]
+            finished = False
+            try:
+                while deadline is None or time.monotonic() < deadline:
+                    chunk = await self.storage.get_favorite_songs_after(job.cursor, self.CHUNK_SIZE)
+                    if not chunk:
+                        finished = True
+                        break
+                    # has_song() в воркерах после этого читает только память
+                    await song_store.load_songs([song["id"] for song in chunk])
+                    for song in chunk:
+                        await queue.put(song)
+                    await queue.join()
+                    if updates:
+                        self.storage.update_favorite_songs(updates)
+                        job.counters["updated"] += len(updates)
+                        updates.clear()
+                    if self.genius.breaker.state != self.genius.breaker.CLOSED:
+                        # Пачка могла обработаться не полностью — повторим её в следующий раз
+                        logger.warning("Genius недоступен, обновление избранного приостановлено")
+                        break
+                    job.cursor = chunk[-1]["id"]
+                    await asyncio.to_thread(self._save_state)
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+            if finished:
+                await asyncio.to_thread(self._clear_state)
+                logger.info(f"Обновление избранного завершено: {job.counters}")
+            else:
+                logger.info(f"Обновление избранного остановлено на песне {job.cursor}: {job.counters}")
+            return dict(job.counters, finished=int(finished))
+
+    async def _worker(self, queue: asyncio.Queue, updates: List[Dict]):
+        while True:
+            snapshot = await queue.get()
+            try:
+                fresh = await self._refresh(snapshot)
+                if fresh is not None and fresh != snapshot:
+                    updates.append(fresh)
+            finally:
+                queue.task_done()
+
+    async def _refresh(self, snapshot: Dict) -> Optional[Dict]:
+        song_id = snapshot["id"]
+        self.job.counters["checked"] += 1
+        if not song_store.has_song(song_id):
+            # В сеть идём только за устаревшими песнями
+            await self.limiter.acquire()
+            self.job.counters["fetched"] += 1
+        try:
+            song = await self.genius.get_song(song_id)
+            return favorite_song_record(song)
+        except GeniusUnavailableError:
+            return None
+        except (GeniusAPIError, KeyError) as e:
+            self.job.counters["failed"] += 1
+            logger.warning(f"Не удалось обновить песню {song_id}: {e}")
+            return None
+
+    def start_scheduler(self, hours: str = config.FAVORITES_REFRESH_HOURS):
+
+        """Запуск проходов в окне часов hours (внутри работающего event loop)"""
+
+        window = parse_hours(hours)
+        if window is not None and self._scheduler is None:
+            self._scheduler = asyncio.create_task(self._schedule(window))
+
+    async def stop_scheduler(self):
+        for task in (self._scheduler, self._task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._scheduler = self._task = None
+
+    async def _schedule(self, window: Tuple[int, int]):
+        while True:
+            now = datetime.now()
+            if in_window(now.hour, window) and not self.running:
+                # Проход обрывается с концом окна и продолжится в следующем
+                seconds_left = seconds_until_end(now, window)
+                try:
+                    counters = await self.run(deadline=time.monotonic() + seconds_left)
+                except Exception as e:
+                    logger.error(f"Ошибка обновления избранного: {e}", exc_info=True)
+                else:
+                    if counters["finished"]:
+                        # Полный проход за окно — следующий только в следующем окне
+                        await asyncio.sleep(seconds_left)
+            await asyncio.sleep(self.SCHEDULE_CHECK_INTERVAL)
+
+
+_refresher: Optional[FavoritesRefresher] = None
+
+
+def get_favorites_refresher() -> FavoritesRefresher:
+    global _refresher
+    if _refresher is None:
+        _refresher = FavoritesRefresher(
+            storage,
+            config.FAVORITES_REFRESH_STATE_FILE,
+            config.FAVORITES_REFRESH_RATE,
+            config.FAVORITES_REFRESH_WORKERS
+        )
+    return _refresher
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from config import config
+
+
+class SqliteFSMStorage(BaseStorage):
+
+    """FSM-хранилище aiogram в SQLite
+
+    Состояние (например, SearchStates.waiting_for_song) переживает
+    перезапуск и доступно всем процессам-воркерам. Запросы выполняются
+    в отдельном потоке, чтобы не блокировать event loop.
+    """
+
+    def __init__(self, filename: str = "fsm.db"):
+        self.filename = filename
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-storage")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.destiny}"
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filename, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS fsm (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}'
+                )"""
+            )
+            self._conn.commit()
+        return self._conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _set_state(self, key: str, state: Optional[str]):
+        conn = self._get_conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO fsm (key, state) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+                (key, state)
+            )
+
+    def _get_column(self, key: str, column: str) -> Optional[str]:
+        row = self._get_conn().execute(f"SELECT {column} FROM fsm WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_data(self, key: str, data: str):
+        conn = self._get_conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO fsm (key, data) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+                (key, data)
+            )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._run(self._set_state, self._key(key), value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._run(self._get_column, self._key(key), "state")
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(self._set_data, self._key(key), json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = await self._run(self._get_column, self._key(key), "data")
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+
+def create_fsm_storage() -> BaseStorage:
+
+    """FSM-хранилище по config.FSM_STORAGE"""
+
+    if config.FSM_STORAGE == "memory":
+        return MemoryStorage()
+    return SqliteFSMStorage(config.FSM_DB_FILE)
@@ -1,105 +1,72 @@
 import logging
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import (
+    Message,
+    CallbackQuery,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InlineKeyboardMarkup,
+    InputTextMessageContent
+)
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from typing import Dict
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from services import get_genius
+from search_index import song_index
+from config import config
+from broadcast import get_broadcaster, BroadcastJob
 from storage import storage
+from user_model import favorite_song_record
+from favorites_refresh import get_favorites_refresher
+from analytics import analytics
+from metrics import metrics
+from profiler import get_profiler, format_report
+from sender import sender
+from supersede import superseder, inline_superseder, Superseded, callback_kind
+from middlewares.admin import AdminMiddleware
+from i18n import Locale, locales, get_locale, button_texts
 from keyboards import (
     get_main_keyboard,
     get_language_keyboard,
-    get_song_actions_keyboard
+    get_search_results_keyboard,
+    get_favorites_page_keyboard
 )
-import json
-import os
 
 
 # Инициализация логгера
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='bot.log'
-)
 logger = logging.getLogger(__name__)
 
 # Инициализация роутера
 router = Router()
 genius = get_genius()
+broadcaster = get_broadcaster()
 admin_router = Router()
-
-os.makedirs(os.path.join(os.path.dirname(__file__), "locales"), exist_ok=True)
-
-# Загрузка локализаций
-def load_locales() -> Dict[str, Dict[str, str]]:
-    locales = {
-        "ru": {
-            "start": "Привет! Я музыкальный бот.",
-            "help": "Доступные команды:\n\n🎵 Найти песню\n⭐ Избранное\n🌍 Язык\nℹ️ О проекте",
-            "search_song": "Введите название песни:",
-            "song_found": "Найдена песня: {title} - {artist}",
-            "no_favorites": "У вас пока нет избранного.",
-            "favorites": "Ваше избранное:\n\n🎵 Песни:\n{songs}",
-            "language_changed": "Язык изменен на русский.",
-            "error": "Ошибка, попробуйте позже.",
-            "added_to_favorites": "Добавлено в избранное!",
-            "lyrics": "Текст песни {title}:\n\n{lyrics}",
-            "choose_option": "Выберите действие:",
-            "no_results": "По вашему запросу ничего не найдено.",
-            "about": "Это музыкальный бот, который помогает находить тексты песен с помощью Genius API."
-        },
-        "en": {
-            "start": "Hello! I'm a music bot.",
-            "help": "Available commands:\n\n🎵 Find song\n⭐ Favorites\n🌍 Language\nℹ️ About",
-            "search_song": "Enter song title:",
-            "song_found": "Found song: {title} - {artist}",
-            "no_favorites": "You don't have favorites yet.",
-            "favorites": "Your favorites:\n\n🎵 Songs:\n{songs}",
-            "language_changed": "Language changed to English.",
-            "error": "Error, please try again.",
-            "added_to_favorites": "Added to favorites!",
-            "lyrics": "Lyrics for {title}:\n\n{lyrics}",
-            "choose_option": "Choose an option:",
-            "no_results": "No results found for your query.",
-            "about": "This is a music bot that helps you find song lyrics using Genius API."
-        }
-    }
-
-    locales_dir = os.path.join(os.path.dirname(__file__), "locales")
-    os.makedirs(locales_dir, exist_ok=True)
-
-    for lang, translations in locales.items():
-        with open(os.path.join(locales_dir, f"{lang}.json"), "w", encoding="utf-8") as f:
-            json.dump(translations, f, ensure_ascii=False, indent=2)
-
-    return locales
-
-# Инициализация локализаций
-locales = load_locales()
+admin_router.message.middleware(AdminMiddleware())
 
 
 class SearchStates(StatesGroup):
     waiting_for_song = State()
 
 
-def get_translation(user_id: int, key: str) -> str:
+def get_user_locale(user_id: int) -> Locale:
 
-    """Получение перевода по ключу для языка пользователя"""
+    """Язык пользователя (один поиск в хранилище на обработчик)"""
 
-    user = storage.get_user(user_id)
-    lang = user["language"]
-    return locales.get(lang, {}).get(key, key)
+    return get_locale(storage.get_language(user_id))
 
 
 async def show_main_menu(user_id: int, message: Message):
 
     """Показывает главное меню"""
 
-    lang = storage.get_user(user_id)["language"]
-    await message.answer(
-        text=get_translation(user_id, "choose_option"),  # Добавьте этот перевод в locales
-        reply_markup=get_main_keyboard(lang)
+    locale = get_user_locale(user_id)
+    await sender.answer(
+        message,
+        text=locale.text("choose_option"),
+        reply_markup=get_main_keyboard(locale.code)
     )
 
 
@@ -109,113 +76,236 @@ async def cmd_start(message: Message):
     """Обработчик команды /start"""
 
     user_id = message.from_user.id
+    storage.register_user(user_id)
+    locale = get_user_locale(user_id)
     try:
-        await message.answer(
-            text=get_translation(user_id, "start"),
-            reply_markup=get_main_keyboard(storage.get_user(user_id)["language"])
+        await sender.answer(
+            message,
+            text=locale.text("start"),
+            reply_markup=get_main_keyboard(locale.code)
         )
     except Exception as e:
         logger.error(f"Error in /start: {e}")
-        await message.answer(get_translation(user_id, "start"))
+        await sender.answer(message, locale.text("start"))
 
 @router.message(Command("help"))
 async def cmd_help(message: Message):
 
     """Обработчик команды /help"""
 
-    user_id = message.from_user.id
-    help_text = get_translation(user_id, "help")
-    await message.answer(help_text)
+    help_text = get_user_locale(message.from_user.id).text("help")
+    await sender.answer(message, help_text)
 
 
-@router.message(F.text.in_(["🎵 Найти песню", "🎵 Find song"]))
+@router.message(F.text.in_(button_texts("btn_find_song")))
 async def search_song_start(message: Message, state: FSMContext):
-    user_id = message.from_user.id
     await state.set_state(SearchStates.waiting_for_song)
-    await message.answer(get_translation(user_id, "search_song"))
+    await sender.answer(message, get_user_locale(message.from_user.id).text("search_song"))
 
 
 @router.message(SearchStates.waiting_for_song)
 async def search_song_result(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    lang = storage.get_user(user_id)["language"]
+    locale = get_user_locale(message.from_user.id)
 
+    analytics.record_query(message.text or "")
+    superseded = False
     try:
-        songs = await genius.search_songs(message.text)
+        songs = await superseder.run(message.from_user.id, "search", genius.find_songs(message.text))
         if not songs:
-            await message.answer(get_translation(user_id, "error"))
+            await sender.answer(message, locale.text("error"))
             return
 
-        for song in songs[:5]:
-            title = song["title"]
-            artist = song["primary_artist"]["name"]
-            text = get_translation(user_id, "song_found").format(title=title, artist=artist)
-            await message.answer(
-                text,
-                reply_markup=get_song_actions_keyboard(song["id"], lang)
-            )
+        # Все результаты одним сообщением с общей клавиатурой
+        songs = songs[:5]
+        lines = [
+            f"{i}. {song['title']} - {song['primary_artist']['name']}"
+            for i, song in enumerate(songs, start=1)
+        ]
+        text = locale.text("search_results", songs="\n".join(lines))
+        song_ids = [song["id"] for song in songs]
+        await sender.answer(
+            message,
+            text,
+            reply_markup=get_search_results_keyboard(song_ids, locale.code)
+        )
+        # «Текст» и «в избранное» по этим песням потом отвечают из кэша
+        await genius.prefetch_songs(song_ids)
+    except Superseded:
+        # Ответит более новый запрос, он же и сбросит состояние
+        superseded = True
     except Exception as e:
         logger.error(f"Error searching songs: {e}")
-        await message.answer(get_translation(user_id, "error"))
+        await sender.answer(message, locale.text("error"))
     finally:
-        await state.clear()
+        if not superseded:
+            await state.clear()
 
 
-@router.message(F.text.in_(["ℹ️ О проекте", "ℹ️ About"]))
+@router.message(F.text.in_(button_texts("btn_about")))
 async def show_about(message: Message):
-    user_id = message.from_user.id
-    await message.answer(get_translation(user_id, "about"))
+    await sender.answer(message, get_user_locale(message.from_user.id).text("about"))
 
 
-@router.message(F.text.in_(["⭐ Избранное", "⭐ Favorites"]))
+@router.message(F.text.in_(button_texts("btn_favorites")))
 async def show_favorites(message: Message):
     user_id = message.from_user.id
-    favorites = storage.get_favorites(user_id)
+    locale = get_user_locale(user_id)
+    page = render_favorites_page(user_id, 0, locale)
 
-    if not favorites["songs"]:
-        await message.answer(get_translation(user_id, "no_favorites"))
+    if page is None:
+        await sender.answer(message, locale.text("no_favorites"))
     else:
-        songs_text = "\n".join([f"- {s['title']} by {s['primary_artist']['name']}" for s in favorites["songs"]]) or "None"
-        text = get_translation(user_id, "favorites").format(songs=songs_text)
-        await message.answer(text)
+        text, keyboard = page
+        await sender.answer(message, text, reply_markup=keyboard)
+
 
+@router.callback_query(F.data.startswith("favs_page_"))
+async def turn_favorites_page(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    locale = get_user_locale(user_id)
+    page = render_favorites_page(user_id, int(callback.data.rsplit("_", 1)[1]), locale)
 
-@router.message(F.text.in_(["🌍 Язык", "🌍 Language"]))
+    if page is None:
+        await callback.answer(locale.text("no_favorites"))
+        return
+    text, keyboard = page
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        # «message is not modified» при повторном нажатии — не ошибка
+        logger.debug(f"Страница избранного не обновлена: {e}")
+    await callback.answer()
+
+
+# Отрисованные страницы избранного: (user_id, страница, язык) -> (версия, текст, клавиатура)
+_favorites_pages: "OrderedDict[Tuple[int, int, str], Tuple[int, str, InlineKeyboardMarkup]]" = OrderedDict()
+
+
+def render_favorites_page(user_id: int, page: int, locale: Locale) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+
+    """Текст и клавиатура страницы избранного, None — если избранное пусто
+
+    Страница берётся из кэша, пока версия избранного пользователя не
+    изменилась; любое добавление или удаление делает её устаревшей.
+    Номер страницы вне диапазона прижимается к ближайшей существующей.
+    """
+
+    version = storage.get_favorites_version(user_id)
+    key = (user_id, page, locale.code)
+    cached = _favorites_pages.get(key)
+    if cached is not None and cached[0] == version:
+        _favorites_pages.move_to_end(key)
+        return cached[1], cached[2]
+
+    size = config.FAVORITES_PAGE_SIZE
+    songs, total = storage.get_favorite_songs_page(user_id, max(page, 0) * size, size)
+    if not total:
+        return None
+    pages = (total + size - 1) // size
+    if not songs:
+        # Избранное сократилось, а кнопка осталась со старой страницы
+        page = pages - 1
+        songs, total = storage.get_favorite_songs_page(user_id, page * size, size)
+    page = max(page, 0)
+
+    start = page * size + 1
+    lines = [f"{i}. {s['title']} by {s['primary_artist']['name']}" for i, s in enumerate(songs, start=start)]
+    text = locale.text("favorites", songs="\n".join(lines))
+    if pages > 1:
+        text += "\n\n" + locale.text("favorites_page", page=page + 1, pages=pages)
+    keyboard = get_favorites_page_keyboard(page, pages, locale.code)
+
+    _favorites_pages[key] = (version, text, keyboard)
+    if len(_favorites_pages) > config.FAVORITES_PAGE_CACHE_SIZE:
+        _favorites_pages.popitem(last=False)
+    return text, keyboard
+
+
+@router.message(F.text.in_(button_texts("btn_language")))
 async def change_language(message: Message):
-    user_id = message.from_user.id
-    await message.answer(
-        get_translation(user_id, "language_changed"),
+    await sender.answer(
+        message,
+        get_user_locale(message.from_user.id).text("language_changed"),
         reply_markup=get_language_keyboard()
     )
 
 @router.callback_query(F.data.startswith("lang_"))
 async def set_language(callback: CallbackQuery):
     user_id = callback.from_user.id
-    lang = callback.data.split("_")[1]
+    lang = callback.data.split("_", 1)[1]
+    if lang not in locales:
+        await callback.answer()
+        return
     storage.set_language(user_id, lang)
-    await callback.answer(get_translation(user_id, "language_changed"))
+    await callback.answer(get_locale(lang).text("language_changed"))
     await show_main_menu(user_id, callback.message)
 
 
+async def _inline_songs(user_id: int, query: str) -> List[Dict]:
+
+    """Песни для inline-запроса: локальный индекс, при нехватке — Genius"""
+
+    songs = song_index.search(query, limit=10)
+    if len(songs) >= config.INLINE_MIN_LOCAL_HITS:
+        return songs
+
+    # Пока пользователь печатает, в Genius уходит только последний запрос
+    try:
+        remote = await inline_superseder.run(user_id, "inline", genius.search_songs(query))
+    except Superseded:
+        return songs
+
+    known = {song["id"] for song in songs}
+    return songs + [song for song in remote if song["id"] not in known][:10 - len(songs)]
+
+
+@router.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    user_id = inline_query.from_user.id
+    query = inline_query.query.strip()
+    if not query:
+        await inline_query.answer([], cache_time=config.INLINE_CACHE_TIME)
+        return
+
+    songs = await _inline_songs(user_id, query)
+    results = []
+    for song in songs:
+        artist = song["primary_artist"]["name"]
+        results.append(InlineQueryResultArticle(
+            id=str(song["id"]),
+            title=song["title"],
+            description=artist,
+            url=song.get("url") or None,
+            input_message_content=InputTextMessageContent(
+                message_text=f"🎵 {song['title']} - {artist}\n{song.get('url', '')}"
+            )
+        ))
+    await inline_query.answer(results, cache_time=config.INLINE_CACHE_TIME)
+
+
 @router.callback_query(F.data.startswith("lyrics_"))
 async def show_lyrics(callback: CallbackQuery):
-    user_id = callback.from_user.id
+    locale = get_user_locale(callback.from_user.id)
     song_id = int(callback.data.split("_")[1])
 
     try:
-        data = await genius._make_request(f"/songs/{song_id}")
-        song = data["response"]["song"]
+        kind, key = callback_kind(callback.data)
+        song = await superseder.run(callback.from_user.id, kind, genius.get_song(song_id), key)
         lyrics_url = song["url"]
         title = song["title"]
+        analytics.record_song(f"{title} - {song['primary_artist']['name']}")
 
-        text = get_translation(user_id, "lyrics").format(
+        text = locale.text(
+            "lyrics",
             title=title,
-            lyrics=f"Ссылка на текст песни: {lyrics_url}"
+            lyrics=locale.text("lyrics_link", url=lyrics_url)
         )
-        await callback.message.answer(text)
+        await sender.answer(callback.message, text)
+    except Superseded:
+        await callback.answer()
     except Exception as e:
         logger.error(f"Error getting lyrics: {e}")
-        await callback.answer(get_translation(user_id, "error"))
+        await callback.answer(locale.text("error"))
 
 
 @router.callback_query(F.data.startswith("fav_song_"))
@@ -224,22 +314,18 @@ async def add_song_to_favorites(callback: CallbackQuery):
     song_id = int(callback.data.split("_")[2])
 
     try:
-        data = await genius._make_request(f"/songs/{song_id}")
-        song = data["response"]["song"]
-
-        storage.add_favorite_song(user_id, {
-            "id": song["id"],
-            "title": song["title"],
-            "primary_artist": {
-                "name": song["primary_artist"]["name"],
-                "id": song["primary_artist"]["id"]
-            }
-        })
-
-        await callback.answer(get_translation(user_id, "added_to_favorites"))
+        kind, key = callback_kind(callback.data)
+        song = await superseder.run(user_id, kind, genius.get_song(song_id), key)
+
+        storage.add_favorite_song(user_id, favorite_song_record(song))
+
+        await callback.answer(get_user_locale(user_id).text("added_to_favorites"))
+    except Superseded:
+        # Повторное нажатие: ответит и добавит последнее
+        await callback.answer()
     except Exception as e:
         logger.error(f"Error adding song to favorites: {e}")
-        await callback.answer(get_translation(user_id, "error"))
+        await callback.answer(get_user_locale(user_id).text("error"))
 
 
 @admin_router.message(Command("stats"))
@@ -247,38 +333,149 @@ async def cmd_stats(message: Message):
 
     """Статистика бота"""
 
-    total_users = len(storage.data)
-    active_today = 1
+    total_users = await storage.count_users()
+    activity = analytics.summary()
+    send_stats = sender.stats()
 
-    await message.answer(
+    def top_lines(items) -> str:
+        return "\n".join(f"   {name} — {count}" for name, count in items) or "   —"
+
+    await sender.answer(
+        message,
         f"📊 Статистика:\n"
         f"• Пользователей: {total_users}\n"
-        f"• Активных сегодня: {active_today}"
+        f"• Активных сегодня / за 7 дней / за 30 дней: "
+        f"{activity['dau']} / {activity['wau']} / {activity['mau']}\n"
+        f"• Сообщений сегодня: {activity['messages_today']}\n"
+        f"• Команды сегодня:\n{top_lines(activity['commands_today'])}\n"
+        f"• Частые запросы за неделю:\n{top_lines(activity['top_queries'])}\n"
+        f"• Популярные песни за неделю:\n{top_lines(activity['top_songs'])}\n"
+        f"• Очередь отправки: {send_stats['queue_depth']}\n"
+        f"• Задержка отправки p95: {send_stats['latency_p95'] * 1000:.0f} мс"
     )
 
 
+@admin_router.message(Command("perf"))
+async def cmd_perf(message: Message):
+
+    """Задержки обработчиков, Genius, хранилищ и Telegram (p50/p95/p99)"""
+
+    lines = ["⏱ Производительность (мс, p50 / p95 / p99):"]
+    family = None
+    for name, labels, count, p50, p95, p99, inflight in metrics.summary():
+        if name != family:
+            family = name
+            lines.append(f"\n{name}:")
+        active = f", выполняется {inflight}" if inflight else ""
+        lines.append(f"• {labels}: {p50 * 1000:.0f} / {p95 * 1000:.0f} / {p99 * 1000:.0f} (n={count}{active})")
+
+    collected = metrics.collect()
+    lines.append(f"\nКэш Genius: {collected.get('bot_genius_cache_hit_ratio', 0) * 100:.0f}% попаданий")
+    errors = {name: value for name, value in metrics.counters().items() if "errors" in name}
+    if errors:
+        lines.append("Ошибки:")
+        lines.extend(f"• {name}: {value:g}" for name, value in errors.items())
+
+    await sender.answer(message, "\n".join(lines))
+
+
+@admin_router.message(Command("profile"))
+async def cmd_profile(message: Message):
+
+    """Профилирование процесса на N секунд: /profile <секунды>"""
+
+    parts = (message.text or "").split()
+    try:
+        seconds = float(parts[1]) if len(parts) > 1 else 10.0
+    except ValueError:
+        await sender.answer(message, "Использование: /profile <секунды>")
+        return
+    if not 0 < seconds <= config.PROFILE_MAX_SECONDS:
+        await sender.answer(message, f"Окно профилирования — от 0 до {config.PROFILE_MAX_SECONDS} секунд")
+        return
+
+    profiler = get_profiler()
+    if profiler.running:
+        await sender.answer(message, "⏳ Профилирование уже идёт")
+        return
+
+    # Обработчик не ждёт окончания окна, иначе задержал бы очередь чата.
+    # Задача заводится до ответа: повторная команда уже увидит running
+    profiler.start(_send_profile(message.bot, message.chat.id, seconds))
+    await sender.answer(message, f"🔬 Профилирую {seconds:g} с...")
+
+
+async def _send_profile(bot, chat_id: int, seconds: float):
+    try:
+        report = await get_profiler().run(seconds)
+        await sender.send_message(bot, chat_id, format_report(report))
+    except Exception as e:
+        logger.error(f"Ошибка профилирования: {e}", exc_info=True)
+        await sender.send_message(bot, chat_id, f"Ошибка профилирования: {e}")
+
+
 @admin_router.message(Command("broadcast"))
 async def cmd_broadcast(message: Message):
 
-    """Рассылка фиксированного сообщения"""
+    """Рассылка фиксированного сообщения (продолжает прерванную, если есть)"""
 
-    text = (
-        "Привет! Будем что-то искать?\n"
-        "Hello! Are we going to find something new?"
-    )
+    if broadcaster.running:
+        await sender.answer(message, "⏳ Рассылка уже идёт")
+        return
 
-    for user_id in storage.data:
-        if user_id != "banned":
-            try:
-                await message.bot.send_message(user_id, f"📢 Рассылка:\n{text}")
-            except Exception as e:
-                logger.error(f"Ошибка отправки для {user_id}: {e}")
+    job = broadcaster.load_unfinished()
+    if job is not None:
+        progress = await sender.answer(message, "♻️ Продолжаю прерванную рассылку...")
+    else:
+        text = (
+            "Привет! Будем что-то искать?\n"
+            "Hello! Are we going to find something new?"
+        )
+        job = BroadcastJob(text, message.chat.id)
+        progress = await sender.answer(message, "📤 Рассылка запущена...")
+
+    broadcaster.start(message.bot, job, progress.message_id)
+
+
+@admin_router.message(Command("refresh_favorites"))
+async def cmd_refresh_favorites(message: Message):
+
+    """Внеочередной проход обновления метаданных избранного"""
+
+    refresher = get_favorites_refresher()
+    if refresher.running:
+        await sender.answer(message, "⏳ Обновление избранного уже идёт")
+        return
 
-    await message.answer(f"✅ Рассылка завершена (отправлено {len(storage.data)} пользователям)")
+    # Задача заводится до ответа: повторная команда уже увидит running
+    refresher.start(_send_refresh_result(message.bot, message.chat.id))
+    await sender.answer(message, "🔄 Обновляю метаданные избранного...")
+
+
+async def _send_refresh_result(bot, chat_id: int):
+    try:
+        counters = await get_favorites_refresher().run()
+        status = "✅ Обновление избранного завершено" if counters["finished"] else "⏸ Обновление избранного приостановлено"
+        await sender.send_message(
+            bot,
+            chat_id,
+            f"{status}\n"
+            f"• Проверено песен: {counters['checked']}\n"
+            f"• Запрошено из Genius: {counters['fetched']}\n"
+            f"• Обновлено: {counters['updated']}\n"
+            f"• Ошибки: {counters['failed']}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка обновления избранного: {e}", exc_info=True)
+        await sender.send_message(bot, chat_id, f"Ошибка обновления избранного: {e}")
 
 
 @admin_router.message(F.text.startswith("/ban "))
 async def cmd_ban(message: Message):
-    user_id = int(message.text.split()[1])
-    # Здесь логика бана (добавьте в storage.py)
-    await message.answer(f"⛔ Пользователь {user_id} заблокирован")
\ No newline at end of file
+    try:
+        user_id = int(message.text.split()[1])
+    except ValueError:
+        await sender.answer(message, "Использование: /ban <id пользователя>")
+        return
+    storage.ban_user(user_id)
+    await sender.answer(message, f"⛔ Пользователь {user_id} заблокирован")
\ No newline at end of file
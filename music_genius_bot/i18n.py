@@ -0,0 +1,61 @@
+import json
+import os
+import logging
+from types import MappingProxyType
+from typing import Dict, List, Mapping
+from user_model import DEFAULT_LANGUAGE
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = os.path.join(os.path.dirname(__file__), "locales")
+
+
+class Locale:
+
+    """Неизменяемый набор строк одного языка
+
+    Отсутствующие ключи берутся из языка по умолчанию, а если нет и там —
+    возвращается сам ключ.
+    """
+
+    __slots__ = ("code", "messages")
+
+    def __init__(self, code: str, messages: Dict[str, str], fallback: Mapping[str, str]):
+        self.code = code
+        self.messages: Mapping[str, str] = MappingProxyType({**fallback, **messages})
+
+    def text(self, key: str, **kwargs) -> str:
+        template = self.messages.get(key, key)
+        return template.format(**kwargs) if kwargs else template
+
+
+def _load_locales() -> Dict[str, Locale]:
+
+    """Однократное чтение locales/*.json — файлы только читаются"""
+
+    raw: Dict[str, Dict[str, str]] = {}
+    for filename in sorted(os.listdir(LOCALES_DIR)):
+        if not filename.endswith(".json"):
+            continue
+        with open(os.path.join(LOCALES_DIR, filename), "r", encoding="utf-8") as f:
+            raw[filename[:-len(".json")]] = json.load(f)
+
+    fallback = raw.get(DEFAULT_LANGUAGE, {})
+    loaded = {code: Locale(code, messages, fallback) for code, messages in raw.items()}
+    logger.info(f"Загружены языки: {', '.join(loaded)}")
+    return loaded
+
+
+# Новый язык — это новый JSON-файл в locales/, код менять не нужно
+locales: Mapping[str, Locale] = MappingProxyType(_load_locales())
+
+
+def get_locale(lang: str) -> Locale:
+    return locales.get(lang) or locales[DEFAULT_LANGUAGE]
+
+
+def button_texts(key: str) -> List[str]:
+
+    """Текст кнопки на всех языках — для фильтров F.text.in_"""
+
+    return sorted({locale.text(key) for locale in locales.values()})
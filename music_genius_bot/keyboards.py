@@ -1,69 +1,94 @@
+from functools import lru_cache
+from typing import Dict, Tuple
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
+from i18n import locales, get_locale
 
+# Кнопки главного меню в порядке отображения
+MAIN_MENU_BUTTONS = ("btn_find_song", "btn_favorites", "btn_language", "btn_about")
 
-def get_main_keyboard(lang: str = 'ru') -> ReplyKeyboardMarkup:
+
+def _build_main_keyboard(lang: str) -> ReplyKeyboardMarkup:
+    locale = get_locale(lang)
     builder = ReplyKeyboardBuilder()
 
-    if lang == 'ru':
-        buttons = [
-            KeyboardButton(text="🎵 Найти песню"),
-            KeyboardButton(text="⭐ Избранное"),
-            KeyboardButton(text="🌍 Язык"),
-            KeyboardButton(text="ℹ️ О проекте")
-        ]
-    else:
-        buttons = [
-            KeyboardButton(text="🎵 Find song"),
-            KeyboardButton(text="⭐ Favorites"),
-            KeyboardButton(text="🌍 Language"),
-            KeyboardButton(text="ℹ️ About")
-        ]
-
-    for button in buttons:
-        builder.add(button)
+    for key in MAIN_MENU_BUTTONS:
+        builder.add(KeyboardButton(text=locale.text(key)))
 
     return builder.adjust(2).as_markup(resize_keyboard=True)
 
 
+def _build_language_keyboard() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for code, locale in locales.items():
+        builder.add(InlineKeyboardButton(text=locale.text("language_name"), callback_data=f"lang_{code}"))
+    return builder.as_markup()
+
+
+# Клавиатуры без параметров собираются один раз при импорте
+_main_keyboards: Dict[str, ReplyKeyboardMarkup] = {code: _build_main_keyboard(code) for code in locales}
+_language_keyboard = _build_language_keyboard()
+
+
+def get_main_keyboard(lang: str = 'ru') -> ReplyKeyboardMarkup:
+    return _main_keyboards.get(lang) or _main_keyboards[get_locale(lang).code]
+
+
 def get_language_keyboard() -> InlineKeyboardMarkup:
+    return _language_keyboard
+
+
+@lru_cache(maxsize=4096)
+def get_song_actions_keyboard(song_id: int, lang: str) -> InlineKeyboardMarkup:
+    locale = get_locale(lang)
     builder = InlineKeyboardBuilder()
     builder.add(
-        InlineKeyboardButton(text="🇷🇺 Русский", callback_data="lang_ru"),
-        InlineKeyboardButton(text="🇬🇧 English", callback_data="lang_en")
+        InlineKeyboardButton(text=locale.text("btn_lyrics"), callback_data=f"lyrics_{song_id}"),
+        InlineKeyboardButton(text=locale.text("btn_add_favorite"), callback_data=f"fav_song_{song_id}")
     )
     return builder.as_markup()
 
 
-def get_song_actions_keyboard(song_id: int, lang: str) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=4096)
+def _search_results_keyboard(song_ids: Tuple[int, ...], lang: str) -> InlineKeyboardMarkup:
+    locale = get_locale(lang)
     builder = InlineKeyboardBuilder()
+    lyrics_text, favorite_text = locale.text("btn_lyrics_short"), locale.text("btn_favorite_short")
 
-    if lang == 'ru':
-        builder.add(
-            InlineKeyboardButton(text="📝 Текст песни", callback_data=f"lyrics_{song_id}"),
-            InlineKeyboardButton(text="⭐ В избранное", callback_data=f"fav_song_{song_id}")
-        )
-    else:
-        builder.add(
-            InlineKeyboardButton(text="📝 Lyrics", callback_data=f"lyrics_{song_id}"),
-            InlineKeyboardButton(text="⭐ Add to favorites", callback_data=f"fav_song_{song_id}")
+    # Строка на каждый результат: номер совпадает с номером в тексте сообщения
+    for i, song_id in enumerate(song_ids, start=1):
+        builder.row(
+            InlineKeyboardButton(text=f"{i}. {lyrics_text}", callback_data=f"lyrics_{song_id}"),
+            InlineKeyboardButton(text=f"{i}. {favorite_text}", callback_data=f"fav_song_{song_id}")
         )
 
     return builder.as_markup()
 
 
-def get_artist_actions_keyboard(artist_id: int, lang: str) -> InlineKeyboardMarkup:
+def get_search_results_keyboard(song_ids: list[int], lang: str) -> InlineKeyboardMarkup:
+    return _search_results_keyboard(tuple(song_ids), lang)
+
+
+@lru_cache(maxsize=1024)
+def get_favorites_page_keyboard(page: int, pages: int, lang: str) -> InlineKeyboardMarkup:
+
+    """Кнопки «назад/вперёд» по страницам избранного (page с нуля)"""
+
+    locale = get_locale(lang)
     builder = InlineKeyboardBuilder()
+    if page > 0:
+        builder.add(InlineKeyboardButton(text=locale.text("btn_prev_page"), callback_data=f"favs_page_{page - 1}"))
+    if page + 1 < pages:
+        builder.add(InlineKeyboardButton(text=locale.text("btn_next_page"), callback_data=f"favs_page_{page + 1}"))
+    return builder.as_markup()
 
-    if lang == 'ru':
-        builder.add(
-            InlineKeyboardButton(text="🎵 Популярные песни", callback_data=f"songs_{artist_id}"),
-            InlineKeyboardButton(text="⭐ В избранное", callback_data=f"fav_artist_{artist_id}")
-        )
-    else:
-        builder.add(
-            InlineKeyboardButton(text="🎵 Popular songs", callback_data=f"songs_{artist_id}"),
-            InlineKeyboardButton(text="⭐ Add to favorites", callback_data=f"fav_artist_{artist_id}")
-        )
 
-    return builder.as_markup()
\ No newline at end of file
+@lru_cache(maxsize=1024)
+def get_artist_actions_keyboard(artist_id: int, lang: str) -> InlineKeyboardMarkup:
+    locale = get_locale(lang)
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        InlineKeyboardButton(text=locale.text("btn_popular_songs"), callback_data=f"songs_{artist_id}"),
+        InlineKeyboardButton(text=locale.text("btn_add_favorite"), callback_data=f"fav_artist_{artist_id}")
+    )
+    return builder.as_markup()
@@ -0,0 +1,163 @@
+import atexit
+import copy
+import json
+import queue
+import random
+import time
+import logging
+import logging.handlers
+from typing import Dict, Optional, Tuple
+from config import config
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+
+    """Одна JSON-строка на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+
+    """Пропускает долю rate записей логгера (и его потомков) уровня ниже WARNING"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = record.name
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return random.random() < rate
+            name = name.rpartition(".")[0]
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+
+    """Не больше limit предупреждений и ошибок за interval секунд с одного места в коде
+
+    Повторяющаяся ошибка API логируется первые limit раз, остальные
+    отбрасываются; число отброшенных дописывается к следующей записи.
+    Частые INFO-записи ограничиваются сэмплированием, а не здесь.
+    """
+
+    def __init__(self, limit: int, interval: float):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self._windows: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0 or record.levelno < logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window else 0
+            window = self._windows[key] = [now, 0, 0]
+            if suppressed:
+                record.msg = f"{record.msg} (ещё {suppressed} похожих записей подавлено)"
+        window[1] += 1
+        if window[1] > self.limit:
+            window[2] += 1
+            return False
+        return True
+
+
+class DeferredFormatQueueHandler(logging.handlers.QueueHandler):
+
+    """QueueHandler, который оставляет форматирование фоновому потоку
+
+    Стандартный prepare() форматирует запись вместе с трейсбеком в
+    вызывающем потоке, то есть в event loop. Здесь в очередь уходит
+    только подставленное сообщение, а трейсбек форматирует писатель.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _parse_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def _file_handler(filename: str) -> logging.Handler:
+    if config.LOG_ROTATION == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            filename, when=config.LOG_ROTATE_WHEN, backupCount=config.LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    return logging.handlers.RotatingFileHandler(
+        filename, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, encoding="utf-8"
+    )
+
+
+def setup_logging(filename: Optional[str] = None):
+
+    """Единая настройка логирования процесса
+
+    Обработчики пишут в файл и консоль из отдельного потока
+    (QueueListener), а event loop только кладёт запись в очередь.
+    Сэмплирование и ограничение частоты работают до постановки в очередь.
+    """
+
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter() if config.LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [_file_handler(filename or config.LOG_FILE), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = DeferredFormatQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(_parse_rates(config.LOG_SAMPLE_RATES)))
+    queue_handler.addFilter(RateLimitFilter(config.LOG_RATE_LIMIT, config.LOG_RATE_INTERVAL))
+
+    root = logging.getLogger()
+    # Убираем обработчики, добавленные logging.warning() до настройки
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config.LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+
+    """Дописывает очередь и останавливает поток записи"""
+
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
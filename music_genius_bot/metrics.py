@@ -0,0 +1,214 @@
+import time
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+
+    """Гистограмма длительностей с фиксированными логарифмическими корзинами
+
+    Корзины от 1 мс до ~1 минуты с шагом 25%, поэтому квантили, оценённые
+    по корзинам, отличаются от точных не больше чем на четверть.
+    """
+
+    BUCKETS = tuple(0.001 * 1.25 ** i for i in range(50))
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= target and bucket_count:
+                lower = self.BUCKETS[index - 1] if index > 0 else 0.0
+                upper = self.BUCKETS[index] if index < len(self.BUCKETS) else lower
+                return lower + (upper - lower) * (target - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.BUCKETS[-1]
+
+
+def _labels(labels: Dict[str, str]) -> LabelSet:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: LabelSet, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+
+    """Реестр метрик процесса: гистограммы, счётчики и gauge в памяти
+
+    Значения со стороны (статистика кэшей, очередей) не дублируются:
+    их отдают collectors в момент чтения. Имена монотонных значений
+    collectors оканчиваются на _total и отдаются как counter, остальные —
+    как gauge.
+    """
+
+    def __init__(self):
+        self._histograms: Dict[str, Dict[LabelSet, Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelSet, float]] = {}
+        self._inflight: Dict[str, Dict[LabelSet, int]] = {}
+        self._collectors: List[Callable[[], Dict[str, float]]] = []
+
+    def observe(self, name: str, seconds: float, **labels: str):
+        family = self._histograms.setdefault(name, {})
+        key = _labels(labels)
+        histogram = family.get(key)
+        if histogram is None:
+            histogram = family[key] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        family = self._counters.setdefault(name, {})
+        key = _labels(labels)
+        family[key] = family.get(key, 0) + value
+
+    @contextmanager
+    def track(self, name: str, **labels: str) -> Iterator[None]:
+
+        """Длительность, число выполняющихся и ошибки участка кода"""
+
+        key = _labels(labels)
+        inflight = self._inflight.setdefault(name, {})
+        inflight[key] = inflight.get(key, 0) + 1
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            # Отмена задачи ошибкой не считается
+            if isinstance(e, Exception):
+                self.inc(f"{name.removesuffix('_seconds')}_errors_total", **labels)
+            raise
+        finally:
+            inflight[key] -= 1
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def add_collector(self, collector: Callable[[], Dict[str, float]]):
+        self._collectors.append(collector)
+
+    def collect(self) -> Dict[str, float]:
+        values: Dict[str, float] = {}
+        for collector in self._collectors:
+            try:
+                values.update(collector())
+            except Exception as e:
+                logger.warning(f"Ошибка сбора метрик: {e}")
+        return values
+
+    def render(self) -> str:
+
+        """Текстовый формат Prometheus"""
+
+        lines: List[str] = []
+        for name, family in sorted(self._histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in family.items():
+                cumulative = 0
+                for bound, bucket_count in zip(Histogram.BUCKETS, histogram.counts):
+                    cumulative += bucket_count
+                    le = 'le="%.6g"' % bound
+                    lines.append(f"{name}_bucket{_format_labels(labels, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{name}_bucket{_format_labels(labels, le)} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for name, family in sorted(self._counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in family.items():
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for name, family in sorted(self._inflight.items()):
+            gauge = f"{name.removesuffix('_seconds')}_inflight"
+            lines.append(f"# TYPE {gauge} gauge")
+            for labels, value in family.items():
+                lines.append(f"{gauge}{_format_labels(labels)} {value}")
+        for name, value in sorted(self.collect().items()):
+            kind = "counter" if name.endswith("_total") else "gauge"
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> List[Tuple[str, str, int, float, float, float, int]]:
+
+        """(семейство, метки, число, p50, p95, p99, выполняется) для /perf"""
+
+        rows = []
+        for name, family in sorted(self._histograms.items()):
+            inflight = self._inflight.get(name, {})
+            for labels, histogram in sorted(family.items()):
+                rows.append((
+                    name,
+                    ",".join(value for _, value in labels),
+                    histogram.count,
+                    histogram.quantile(0.5),
+                    histogram.quantile(0.95),
+                    histogram.quantile(0.99),
+                    inflight.get(labels, 0),
+                ))
+        return rows
+
+    def counters(self) -> Dict[str, float]:
+        return {
+            f"{name}{_format_labels(labels)}": value
+            for name, family in sorted(self._counters.items())
+            for labels, value in family.items()
+        }
+
+
+class MetricsServer:
+
+    """Локальный HTTP-эндпоинт /metrics для Prometheus"""
+
+    def __init__(self, registry: Metrics, host: str, port: int):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+        except OSError as e:
+            logger.error(f"Не удалось открыть порт метрик {self.host}:{self.port}: {e}")
+            await self._runner.cleanup()
+            self._runner = None
+            return
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Метрики процесса
+metrics = Metrics()
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, InlineQuery, TelegramObject
+from config import config
+from storage import storage
+from broadcast import TokenBucket
+from metrics import metrics
+
+# Состояние FSM, в котором текст пользователя уходит в поиск Genius
+SEARCH_STATE = "SearchStates:waiting_for_song"
+
+
+def parse_limits(value: str) -> Dict[str, Tuple[float, int]]:
+
+    """'search=0.2/3,callback=1/5' -> {'search': (0.2, 3), 'callback': (1.0, 5)}"""
+
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, limit = item.partition("=")
+        rate, _, burst = limit.partition("/")
+        limits[name.strip()] = (float(rate), int(burst or 1))
+    return limits
+
+
+def handler_class(event: TelegramObject, data: Dict[str, Any]) -> str:
+
+    """Класс обработчика до фильтров: по типу апдейта и состоянию FSM"""
+
+    if isinstance(event, InlineQuery):
+        return "inline"
+    if isinstance(event, CallbackQuery):
+        return "callback"
+    if data.get("raw_state") == SEARCH_STATE:
+        return "search"
+    return "message"
+
+
+class AccessMiddleware:
+
+    """Ранний отказ до логирования, хранилища и запросов к Genius
+
+    Outer middleware: срабатывает раньше фильтров и inner middleware
+    (LoggingMiddleware), поэтому отброшенный апдейт ничего не стоит.
+    Заблокированные пользователи отсекаются поиском в множестве,
+    остальные проходят через token bucket на пару (пользователь, класс
+    обработчика). Inline-запросы не ограничиваются: отброшенным оказался
+    бы последний набранный символ, а частоту inline и так сглаживают
+    debounce и вытеснение (supersede.py). Отклонённый callback получает
+    пустой ответ, чтобы у кнопки не крутился индикатор. Бакеты хранятся в порядке последнего обращения, и при
+    переполнении вытесняется самый давний — за O(1) на апдейт.
+    Администраторы не ограничиваются. Пропущенный
+    пользователь подгружается из хранилища вне event loop, чтобы
+    синхронные вызовы storage в обработчиках читали только память.
+    """
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self, limits: str = config.THROTTLE_LIMITS):
+        self.limits = parse_limits(limits)
+        self._buckets: "OrderedDict[Tuple[int, str], TokenBucket]" = OrderedDict()
+        self._admins = frozenset(config.ADMIN_IDS)
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        user = getattr(event, "from_user", None)
+        if user is None:
+            return await handler(event, data)
+        kind = handler_class(event, data)
+        if storage.is_banned(user.id):
+            metrics.inc("bot_rejected_total", reason="banned", kind=kind)
+            return
+        if user.id not in self._admins and kind != "inline":
+            limit = self.limits.get(kind)
+            if limit is not None and not self._bucket(user.id, kind, limit).try_acquire():
+                metrics.inc("bot_rejected_total", reason="throttled", kind=kind)
+                if isinstance(event, CallbackQuery):
+                    try:
+                        await event.answer()
+                    except TelegramBadRequest:
+                        # Запрос уже устарел — индикатор Telegram снял сам
+                        pass
+                return
+        await storage.load_user(user.id)
+        return await handler(event, data)
+
+    def _bucket(self, user_id: int, kind: str, limit: Tuple[float, int]) -> TokenBucket:
+        key = (user_id, kind)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_BUCKETS:
+                # Самый давний бакет почти наверняка уже восстановился
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[key] = TokenBucket(*limit)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
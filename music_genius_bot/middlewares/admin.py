@@ -1,14 +1,23 @@
+from typing import Any, Awaitable, Callable, Dict
+from aiogram.types import Message
 from config import config
-import logging
 
 
 class AdminMiddleware:
-    async def __call__(self, handler, event, data):
-        if not config.ADMIN_IDS:
-            logging.error("Список ADMIN_IDS пуст! Проверьте .env")
-            return await handler(event, data)
 
+    """Пропускает к обработчикам роутера только ADMIN_IDS
+
+    Вешается на admin_router, поэтому остальные пользователи видят отказ
+    только на админских командах, а не на всём диспетчере.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+            event: Message,
+            data: Dict[str, Any]
+    ) -> Any:
         if event.from_user.id not in config.ADMIN_IDS:
-            await event.answer("🔒 Доступ запрещён!")
+            await event.answer("🚫 Доступ запрещён!")
             return
-        return await handler(event, data)
\ No newline at end of file
+        return await handler(event, data)
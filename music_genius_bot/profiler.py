@@ -0,0 +1,203 @@
+import asyncio
+import cProfile
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import logging
+from collections import Counter
+from typing import Coroutine, Dict, List, Optional, Tuple
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class _SlowCallbackCollector(logging.Handler):
+
+    """Перехватывает предупреждения asyncio «Executing ... took N seconds»"""
+
+    TOOK_RE = re.compile(r"^Executing (.*) took ([\d.]+) seconds$", re.DOTALL)
+    CORO_RE = re.compile(r"coro=<(.+?) running at (\S+?:\d+)>")
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records: List[Tuple[float, str]] = []
+
+    def emit(self, record: logging.LogRecord):
+        match = self.TOOK_RE.match(record.getMessage())
+        if match is None or len(self.records) >= 1000:
+            return
+        callback, duration = match.group(1), float(match.group(2))
+        coro = self.CORO_RE.search(callback)
+        label = f"{coro.group(1)} at {coro.group(2)}" if coro else callback[:150]
+        self.records.append((duration, label))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class StackSampler(threading.Thread):
+
+    """Снимки стека потока event loop каждые interval секунд
+
+    Стеки сворачиваются в формат «a;b;c N» (folded stacks), который
+    понимают flamegraph.pl, speedscope и inferno.
+    """
+
+    def __init__(self, target_thread_id: int, interval: float):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Profiler:
+
+    """Профилирование процесса по запросу на заданное окно времени
+
+    За окно одновременно работают cProfile (по всем коллбэкам потока
+    event loop), сэмплер стеков и отладочный режим asyncio, который
+    сообщает о коллбэках дольше slow_callback секунд.
+    """
+
+    def __init__(self, output_dir: str = "profiles", sample_interval: float = 0.005, slow_callback: float = 0.1):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.slow_callback = slow_callback
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked() or (self._task is not None and not self._task.done())
+
+    def start(self, work: Coroutine) -> asyncio.Task:
+
+        """Запуск work (run() и отправка отчёта) фоновой задачей
+
+        Задача запоминается сразу, поэтому running верен ещё до её старта.
+        """
+
+        self._task = asyncio.create_task(work)
+        self._task.add_done_callback(self._on_done)
+        return self._task
+
+    @staticmethod
+    def _on_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Профилирование прервано: {task.exception()}")
+
+    async def run(self, seconds: float, top: int = 10) -> Dict:
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            collector = _SlowCallbackCollector()
+            asyncio_logger = logging.getLogger("asyncio")
+            previous_debug, previous_slow = loop.get_debug(), loop.slow_callback_duration
+
+            profile = cProfile.Profile()
+            asyncio_logger.addHandler(collector)
+            loop.slow_callback_duration = self.slow_callback
+            loop.set_debug(True)
+            sampler.start()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+                sampler.stop()
+                loop.set_debug(previous_debug)
+                loop.slow_callback_duration = previous_slow
+                asyncio_logger.removeHandler(collector)
+
+            # Запись файлов и разбор статистики — не в event loop
+            return await asyncio.to_thread(self._report, profile, sampler, collector.records, seconds, top)
+
+    def _report(self, profile: cProfile.Profile, sampler: StackSampler,
+                slow_callbacks: List[Tuple[float, str]], seconds: float, top: int) -> Dict:
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.output_dir, f"profile-{stamp}-{os.getpid()}")
+
+        folded_file = f"{base}.folded"
+        with open(folded_file, "w", encoding="utf-8") as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        prof_file = f"{base}.prof"
+        profile.dump_stats(prof_file)
+
+        stats = pstats.Stats(profile)
+        functions: List[Tuple[str, float, float, int]] = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            functions.append((f"{os.path.basename(filename)}:{line}:{name}", tottime, cumtime, calls))
+        functions.sort(key=lambda item: -item[1])
+
+        leaves: Counter = Counter()
+        for stack, count in sampler.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+
+        return {
+            "seconds": seconds,
+            "pid": os.getpid(),
+            "samples": sampler.samples,
+            "folded_file": folded_file,
+            "prof_file": prof_file,
+            "top_functions": functions[:top],
+            "top_leaves": leaves.most_common(top),
+            "slow_callbacks": sorted(slow_callbacks, reverse=True)[:top],
+            "slow_callbacks_total": len(slow_callbacks),
+        }
+
+
+def format_report(report: Dict, limit: int = 3500) -> str:
+
+    """Короткая сводка для чата (с запасом до лимита Telegram в 4096 символов)"""
+
+    lines = [
+        f"🔬 Профиль за {report['seconds']:g} с (pid {report['pid']}, {report['samples']} снимков стека)",
+        "",
+        "Больше всего собственного времени (tottime / cumtime, вызовов):",
+    ]
+    lines += [
+        f"• {name}: {tottime * 1000:.0f} / {cumtime * 1000:.0f} мс, {calls}"
+        for name, tottime, cumtime, calls in report["top_functions"]
+    ]
+    if report["top_leaves"] and report["samples"]:
+        lines += ["", "Чаще всего на вершине стека:"]
+        lines += [f"• {name}: {count * 100 / report['samples']:.0f}%" for name, count in report["top_leaves"]]
+    lines += ["", f"Медленных коллбэков: {report['slow_callbacks_total']}"]
+    lines += [f"• {duration * 1000:.0f} мс — {label}" for duration, label in report["slow_callbacks"]]
+    lines += ["", f"Flamegraph: {report['folded_file']}", f"cProfile: {report['prof_file']}"]
+    text = "\n".join(lines)
+    return text if len(text) <= limit else text[:limit] + "\n…"
+
+
+_profiler: Optional[Profiler] = None
+
+
+def get_profiler() -> Profiler:
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(config.PROFILE_DIR, config.PROFILE_SAMPLE_INTERVAL, config.PROFILE_SLOW_CALLBACK)
+    return _profiler
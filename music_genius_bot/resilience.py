@@ -0,0 +1,84 @@
+import random
+import time
+import logging
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+
+    """Автомат-предохранитель для внешнего API
+
+    closed — запросы идут как обычно; после failure_threshold ошибок подряд
+    переходит в open и reset_timeout секунд отклоняет запросы сразу;
+    затем half_open пропускает один пробный запрос, по итогам которого
+    возвращается в closed или снова в open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"Предохранитель {self.name} закрыт")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self):
+
+        """Пробный запрос отменён без результата — следующий может стать пробным"""
+
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+                logger.warning(f"Предохранитель {self.name} открыт после {self.failures} ошибок")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+def backoff_delay(attempt: int, base: float = 0.2, cap: float = 5.0) -> float:
+
+    """Экспоненциальная задержка с полным джиттером"""
+
+    return random.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,288 @@
+import heapq
+import json
+import os
+import re
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from config import config
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Упрощённая транслитерация, чтобы «кукла» и «kukla» давали одни триграммы
+TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "zh", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch",
+    "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+})
+
+
+def tokenize(text: str) -> List[str]:
+
+    """Слова строки в нижнем регистре без пунктуации"""
+
+    return TOKEN_RE.findall(text.casefold())
+
+
+def compact_song(song: Dict) -> Dict:
+
+    """Только поля, нужные для выдачи, без полного ответа Genius"""
+
+    artist = song.get("primary_artist") or {}
+    return {
+        "id": song["id"],
+        "title": song.get("title", ""),
+        "url": song.get("url", ""),
+        "primary_artist": {
+            "id": artist.get("id"),
+            "name": artist.get("name", "")
+        }
+    }
+
+
+class PrefixIndex:
+
+    """Индекс префиксов слов из названий песен и имён исполнителей
+
+    Для каждого слова хранятся его префиксы длиной до max_prefix, поэтому
+    поиск по мере набора («lun», «billie ei») — это пересечение нескольких
+    множеств. Число песен ограничено max_songs, старые вытесняются.
+    """
+
+    def __init__(self, max_songs: int = 50000, max_prefix: int = 12):
+        self.max_songs = max_songs
+        self.max_prefix = max_prefix
+        self._songs: "OrderedDict[int, Dict]" = OrderedDict()
+        self._prefixes: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._songs)
+
+    def _song_prefixes(self, song: Dict) -> Set[str]:
+        artist = (song.get("primary_artist") or {}).get("name", "")
+        prefixes = set()
+        for token in tokenize(f"{song.get('title', '')} {artist}"):
+            for length in range(1, min(len(token), self.max_prefix) + 1):
+                prefixes.add(token[:length])
+        return prefixes
+
+    def add_song(self, song: Dict):
+        song_id = song["id"]
+        if song_id in self._songs:
+            self._remove(song_id)
+        self._songs[song_id] = compact_song(song)
+        for prefix in self._song_prefixes(song):
+            self._prefixes.setdefault(prefix, set()).add(song_id)
+        while len(self._songs) > self.max_songs:
+            self._remove(next(iter(self._songs)))
+
+    def add_songs(self, songs: Iterable[Dict]):
+        for song in songs:
+            self.add_song(song)
+
+    def _remove(self, song_id: int):
+        song = self._songs.pop(song_id)
+        for prefix in self._song_prefixes(song):
+            ids = self._prefixes.get(prefix)
+            if ids is not None:
+                ids.discard(song_id)
+                if not ids:
+                    del self._prefixes[prefix]
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+
+        """Песни, у которых каждое слово запроса — префикс какого-то слова"""
+
+        tokens = [token[:self.max_prefix] for token in tokenize(query)]
+        if not tokens:
+            return []
+        candidate_sets = []
+        for token in tokens:
+            ids = self._prefixes.get(token)
+            if not ids:
+                return []
+            candidate_sets.append(ids)
+        candidate_sets.sort(key=len)
+        matches = set(candidate_sets[0]).intersection(*candidate_sets[1:])
+
+        normalized = " ".join(tokens)
+
+        def rank(song_id: int):
+            song = self._songs[song_id]
+            title = " ".join(tokenize(song["title"]))
+            # Сначала совпадения с начала названия, затем более короткие
+            return (not title.startswith(normalized), len(title))
+
+        return [self._songs[song_id] for song_id in heapq.nsmallest(limit, matches, key=rank)]
+
+
+def normalize(text: str) -> str:
+
+    """Нижний регистр, латиница вместо кириллицы, слова через пробел"""
+
+    return " ".join(tokenize(text.casefold().translate(TRANSLIT)))
+
+
+def trigrams(text: str) -> Set[str]:
+    grams = set()
+    for token in text.split():
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+
+    """Нечёткий поиск по триграммам названия и исполнителя
+
+    Оценка совпадения — в основном доля триграмм запроса, найденных в
+    песне, плюс коэффициент Жаккара (штраф за лишнее) и небольшой бонус
+    за популярность. Песни добавляются по мере
+    поступления результатов Genius, число песен ограничено max_songs
+    (вытесняются давно не встречавшиеся). Состояние сохраняется в снимок
+    и загружается при старте.
+    """
+
+    def __init__(self, max_songs: int = 50000):
+        self.max_songs = max_songs
+        self._songs: "OrderedDict[int, Dict]" = OrderedDict()
+        self._grams: Dict[int, int] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._popularity: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self._songs)
+
+    @staticmethod
+    def _song_text(song: Dict) -> str:
+        artist = (song.get("primary_artist") or {}).get("name", "")
+        return normalize(f"{song.get('title', '')} {artist}")
+
+    def add_song(self, song: Dict):
+        song_id = song["id"]
+        if song_id in self._songs:
+            if self._song_text(self._songs[song_id]) == self._song_text(song):
+                self._songs.move_to_end(song_id)
+                self._songs[song_id] = compact_song(song)
+                return
+            # Название или исполнитель изменились — старые триграммы убираем
+            popularity = self._popularity[song_id]
+            self._remove(song_id)
+            if popularity:
+                self._popularity[song_id] = popularity
+        grams = trigrams(self._song_text(song))
+        self._songs[song_id] = compact_song(song)
+        self._grams[song_id] = len(grams)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(song_id)
+        while len(self._songs) > self.max_songs:
+            self._remove(next(iter(self._songs)))
+
+    def add_songs(self, songs: Iterable[Dict]):
+        for song in songs:
+            self.add_song(song)
+
+    def _remove(self, song_id: int):
+        song = self._songs.pop(song_id)
+        del self._grams[song_id]
+        self._popularity.pop(song_id, None)
+        for gram in trigrams(self._song_text(song)):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(song_id)
+                if not ids:
+                    del self._postings[gram]
+
+    def record_hit(self, song_id: int):
+
+        """Песня была показана или выбрана — поднимаем её в выдаче"""
+
+        if song_id in self._songs:
+            self._popularity[song_id] += 1
+            self._songs.move_to_end(song_id)
+
+    def _scored(self, query: str, limit: int) -> List[Tuple[float, float, int]]:
+
+        """Лучшие совпадения как (оценка, коэффициент Жаккара, id песни)"""
+
+        query_grams = trigrams(normalize(query))
+        if not query_grams:
+            return []
+        shared: Counter = Counter()
+        for gram in query_grams:
+            for song_id in self._postings.get(gram, ()):
+                shared[song_id] += 1
+
+        def jaccard(song_id: int) -> float:
+            common = shared[song_id]
+            return common / (len(query_grams) + self._grams[song_id] - common)
+
+        def score(song_id: int) -> float:
+            containment = shared[song_id] / len(query_grams)
+            return 0.8 * containment + 0.2 * jaccard(song_id) + min(self._popularity[song_id], 100) / 10000
+
+        best = heapq.nlargest(limit, shared, key=score)
+        return [(min(score(song_id), 1.0), jaccard(song_id), song_id) for song_id in best]
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[float, Dict]]:
+
+        """Лучшие совпадения как (оценка 0..1, песня)"""
+
+        return [(score, self._songs[song_id]) for score, _, song_id in self._scored(query, limit)]
+
+    def confident_matches(self, query: str, limit: int, min_score: float) -> Optional[List[Dict]]:
+
+        """Песни из индекса, если их хватает для ответа без Genius, иначе None
+
+        Высокая оценка значит лишь, что запрос входит в песню: «Billie
+        Eilish» целиком входит в «Lunch Billie Eilish», но локальный индекс
+        знает не все её песни. Поэтому ответ без сети даётся, только когда
+        запрос почти целиком описывает песню (коэффициент Жаккара не ниже
+        min_score) или сильных совпадений набирается на всю выдачу.
+        """
+
+        scored = self._scored(query, limit)
+        if not scored:
+            return None
+        if scored[0][1] >= min_score:
+            threshold = min_score / 2
+            return [self._songs[song_id] for score, _, song_id in scored if score >= threshold]
+        strong = [song_id for score, _, song_id in scored if score >= min_score]
+        if len(strong) >= limit:
+            return [self._songs[song_id] for song_id in strong]
+        return None
+
+    def save_snapshot(self, filename: str):
+
+        """Атомарное сохранение песен и популярности в JSON"""
+
+        payload = json.dumps({
+            "songs": list(self._songs.values()),
+            "popularity": list(self._popularity.items()),
+        }, ensure_ascii=False)
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_filename, filename)
+
+    def load_snapshot(self, filename: str) -> int:
+        if not os.path.exists(filename):
+            return 0
+        with open(filename, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                return 0
+        self.add_songs(data.get("songs", []))
+        for song_id, hits in data.get("popularity", []):
+            if song_id in self._songs:
+                self._popularity[song_id] = hits
+        return len(self._songs)
+
+
+# Индекс уже встречавшихся песен для inline-режима
+song_index = PrefixIndex(max_songs=config.SEARCH_INDEX_MAX_SONGS)
+
+# Нечёткий индекс для обычного поиска
+fuzzy_index = TrigramIndex(max_songs=config.SEARCH_INDEX_MAX_SONGS)
@@ -0,0 +1,147 @@
+import asyncio
+import time
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Message
+from config import config
+from broadcast import TokenBucket, global_send_limiter
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundSender:
+
+    """Центральная очередь исходящих сообщений
+
+    У каждого чата своя FIFO-очередь и свой token bucket, поверх них общий
+    лимит на бота, который делится с рассылкой. Очередь чата разбирает отдельная задача, которая
+    завершается, когда очередь пуста, поэтому порядок сообщений внутри
+    чата сохраняется.
+    """
+
+    LATENCY_SAMPLES = 1000
+    MAX_IDLE_LIMITERS = 10000
+
+    def __init__(self, global_limiter: TokenBucket, chat_rate: float, chat_burst: int, max_retries: int = 3):
+        self.global_limiter = global_limiter
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._queues: Dict[int, Deque[tuple]] = {}
+        self._limiters: Dict[int, TokenBucket] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._latencies: Deque[float] = deque(maxlen=self.LATENCY_SAMPLES)
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+
+    async def send_message(self, bot: Bot, chat_id: int, text: str, **kwargs: Any) -> Message:
+
+        """Постановка сообщения в очередь чата и ожидание отправки"""
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(chat_id, deque())
+        queue.append((bot, text, kwargs, future, time.monotonic()))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return await future
+
+    async def answer(self, message: Message, text: str, **kwargs: Any) -> Message:
+        return await self.send_message(message.bot, message.chat.id, text, **kwargs)
+
+    def _chat_limiter(self, chat_id: int) -> TokenBucket:
+        limiter = self._limiters.get(chat_id)
+        if limiter is None:
+            limiter = self._limiters[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return limiter
+
+    async def _drain(self, chat_id: int):
+        queue = self._queues[chat_id]
+        limiter = self._chat_limiter(chat_id)
+        try:
+            while queue:
+                bot, text, kwargs, future, enqueued_at = queue.popleft()
+                if future.cancelled():
+                    continue
+                try:
+                    result = await self._send(bot, chat_id, text, kwargs, limiter)
+                except Exception as e:
+                    self.failed += 1
+                    if not future.cancelled():
+                        future.set_exception(e)
+                    continue
+                self.sent += 1
+                self._latencies.append(time.monotonic() - enqueued_at)
+                if not future.cancelled():
+                    future.set_result(result)
+        finally:
+            del self._workers[chat_id]
+            del self._queues[chat_id]
+            if limiter.is_idle():
+                self._limiters.pop(chat_id, None)
+            elif len(self._limiters) > self.MAX_IDLE_LIMITERS:
+                self._prune_limiters()
+
+    def _prune_limiters(self):
+
+        """Удаление лимитеров чатов без очереди, которые уже восстановились"""
+
+        for chat_id in [c for c, l in self._limiters.items() if c not in self._workers and l.is_idle()]:
+            del self._limiters[chat_id]
+
+    async def _send(self, bot: Bot, chat_id: int, text: str, kwargs: Dict, limiter: TokenBucket) -> Message:
+        for attempt in range(self.max_retries):
+            await limiter.acquire()
+            await self.global_limiter.acquire()
+            try:
+                with metrics.track("bot_telegram_seconds", method="send_message"):
+                    return await bot.send_message(chat_id, text, **kwargs)
+            except TelegramRetryAfter as e:
+                self.flood_waits += 1
+                logger.warning(f"Флуд-контроль для чата {chat_id}, ждём {e.retry_after} с")
+                limiter.pause(e.retry_after)
+                if attempt == self.max_retries - 1:
+                    raise
+
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> Dict[str, float]:
+
+        """Глубина очередей и задержка отправки (от постановки до ответа Telegram)"""
+
+        latencies: List[float] = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "queue_depth": self.queue_depth(),
+            "active_chats": len(self._workers),
+            "sent": self.sent,
+            "failed": self.failed,
+            "flood_waits": self.flood_waits,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+
+# Общий планировщик исходящих сообщений
+sender = OutboundSender(
+    global_send_limiter,
+    config.SEND_CHAT_RATE,
+    config.SEND_CHAT_BURST
+)
+metrics.add_collector(lambda: {
+    "bot_send_queue_depth": sender.queue_depth(),
+    "bot_send_sent_total": sender.sent,
+    "bot_send_failed_total": sender.failed,
+    "bot_send_flood_waits_total": sender.flood_waits,
+})
@@ -1,93 +1,440 @@
 import aiohttp
 import asyncio
-from typing import Dict, Any, Optional, List
+import json
+import re
+import time
+from typing import Dict, Any, Optional, List, Tuple
 from config import config
+from cache import TTLCache
+from song_store import song_store
+from search_index import song_index, fuzzy_index
+from resilience import CircuitBreaker, backoff_delay
+from metrics import metrics
 import logging
 import ssl
 import certifi
 
 ssl_context = ssl.create_default_context(cafile=certifi.where())
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='bot.log'
-)
 logger = logging.getLogger(__name__)
 
+
+class GeniusAPIError(Exception):
+
+    """Ошибка запроса к Genius; retryable — имеет ли смысл повтор"""
+
+    def __init__(self, message: str, status: Optional[int] = None,
+                 retryable: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class GeniusUnavailableError(GeniusAPIError):
+
+    """Предохранитель открыт, запрос отклонён без обращения к сети"""
+
+
 class GeniusAPI:
-    BASE_URL = "https://api.genius.com"
+    BASE_URL = config.GENIUS_BASE_URL
+    # TTL ответов по префиксу эндпоинта, секунды
+    CACHE_TTLS = (
+        ("/search", 10 * 60),
+        ("/songs/", 24 * 60 * 60),
+        ("/albums/", 60 * 60),
+    )
+    DEFAULT_CACHE_TTL = 5 * 60
+    # Общий бюджет времени на запрос вместе с повторами, секунды
+    LATENCY_BUDGETS = (
+        ("/search", 6),
+        ("/songs/", 5),
+    )
+    DEFAULT_LATENCY_BUDGET = 8
+    # /songs/123 -> /songs/{id}, чтобы метки метрик не плодились
+    ENDPOINT_ID_RE = re.compile(r"/\d+")
+    REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10)
 
     def __init__(self):
         self.token = config.GENIUS_TOKEN
         self.session = None
-        self.cache: Dict[str, Any] = {}
+        self.connector: Optional[aiohttp.TCPConnector] = None
+        self.headers = {
+            "Authorization": f"Bearer {self.token}",
+            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            "Accept": "application/json",
+        }
+        self.songs = song_store
+        self.cache = TTLCache(
+            max_entries=config.GENIUS_CACHE_MAX_ENTRIES,
+            max_bytes=config.GENIUS_CACHE_MAX_BYTES,
+            stale_ttl=config.GENIUS_CACHE_STALE_TTL
+        )
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        # Single-flight: один запрос на ключ, остальные ждут его результат
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.cancelled_requests = 0
+        self._upstream_limit = asyncio.Semaphore(config.GENIUS_MAX_CONCURRENCY)
+        self.coalesced_requests = 0
+        self.breaker = CircuitBreaker(
+            "genius",
+            failure_threshold=config.GENIUS_BREAKER_THRESHOLD,
+            reset_timeout=config.GENIUS_BREAKER_RESET
+        )
+        self.retries = 0
+        self.failed_requests = 0
+        self.local_searches = 0
+        # Фоновый прогрев /songs/{id} для показанных результатов поиска
+        self._prefetching: Dict[int, asyncio.Task] = {}
+        self._prefetch_limit = asyncio.Semaphore(config.GENIUS_PREFETCH_CONCURRENCY)
+        self.prefetched = 0
+        self.prefetch_skipped = 0
+        metrics.add_collector(self._collect_metrics)
+
+    def _collect_metrics(self) -> Dict[str, float]:
+        cache = self.cache_stats()
+        lookups = cache["hits"] + cache["stale_hits"] + cache["misses"]
+        pool = self.pool_stats()
+        return {
+            "bot_genius_cache_hits_total": cache["hits"],
+            "bot_genius_cache_stale_hits_total": cache["stale_hits"],
+            "bot_genius_cache_misses_total": cache["misses"],
+            "bot_genius_cache_hit_ratio": (cache["hits"] + cache["stale_hits"]) / lookups if lookups else 0.0,
+            "bot_genius_coalesced_total": cache["coalesced"],
+            "bot_genius_cancelled_requests_total": self.cancelled_requests,
+            "bot_genius_retries_total": self.retries,
+            "bot_genius_failed_requests_total": self.failed_requests,
+            "bot_genius_local_searches_total": self.local_searches,
+            "bot_genius_breaker_open": 0 if self.breaker.state == self.breaker.CLOSED else 1,
+            "bot_genius_pool_acquired": pool["acquired"],
+            "bot_genius_prefetched_total": self.prefetched,
+            "bot_genius_prefetch_skipped_total": self.prefetch_skipped,
+            "bot_genius_prefetch_pending": len(self._prefetching),
+        }
 
 
     async def initialize(self):
         if self.session is None or self.session.closed:
+            self.connector = aiohttp.TCPConnector(
+                ssl=ssl_context,
+                limit=config.GENIUS_POOL_LIMIT,
+                limit_per_host=config.GENIUS_POOL_LIMIT,
+                keepalive_timeout=config.GENIUS_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=config.GENIUS_DNS_CACHE_TTL
+            )
             self.session = aiohttp.ClientSession(
-                connector=aiohttp.TCPConnector(ssl=ssl_context)
+                connector=self.connector,
+                headers=self.headers,
+                timeout=self.REQUEST_TIMEOUT
             )
 
     async def close(self):
+        # Фоновые предзагрузки и обновления кэша ходят через сессию —
+        # дожидаемся их отмены до её закрытия
+        tasks = [*self._prefetching.values(), *self._refreshing.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
         if self.session:
             await self.session.close()
             self.session = None
+            self.connector = None
+
+    def pool_stats(self) -> Dict[str, int]:
+
+        """Состояние пула соединений: занятые и простаивающие keep-alive"""
+
+        if self.connector is None or self.connector.closed:
+            return {"limit": config.GENIUS_POOL_LIMIT, "acquired": 0, "idle": 0}
+        idle = sum(len(conns) for conns in getattr(self.connector, "_conns", {}).values())
+        return {
+            "limit": self.connector.limit,
+            "acquired": len(getattr(self.connector, "_acquired", ())),
+            "idle": idle,
+        }
+
 
+    @staticmethod
+    def _cache_key(endpoint: str, params: Optional[Dict] = None) -> str:
+
+        """Нормализованный ключ кэша: эндпоинт + отсортированные параметры"""
+
+        key = endpoint.rstrip("/").lower()
+        if params:
+            normalized = sorted(
+                (str(name), " ".join(str(value).split()).casefold())
+                for name, value in params.items()
+            )
+            key += "?" + "&".join(f"{name}={value}" for name, value in normalized)
+        return key
+
+    def _cache_ttl(self, endpoint: str) -> float:
+        for prefix, ttl in self.CACHE_TTLS:
+            if endpoint.startswith(prefix):
+                return ttl
+        return self.DEFAULT_CACHE_TTL
 
     async def _make_request(self, endpoint: str, params: Optional[Dict] = None) -> Dict:
+        key = self._cache_key(endpoint, params)
+        cached, stale = self.cache.get(key)
+        if cached is not None:
+            if stale:
+                self._schedule_refresh(key, endpoint, params)
+            return cached
+        return await self._fetch_and_cache(key, endpoint, params)
+
+    async def _fetch_and_cache(self, key: str, endpoint: str, params: Optional[Dict]) -> Dict:
+
+        """Запрос с объединением одновременных одинаковых вызовов
+
+        Ошибка тоже достаётся всем ожидающим, но не кэшируется: следующий
+        вызов после неё снова пойдёт в сеть. Когда отменены все ожидающие
+        (например, запрос вытеснен более новым), отменяется и сам HTTP-запрос.
+        """
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_leader(key, endpoint, params))
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._on_inflight_done(key, t))
+        else:
+            self.coalesced_requests += 1
+        self._waiters[key] += 1
+        try:
+            # shield: отмена одного ожидающего не должна отменять общий запрос
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._inflight.get(key) is task and self._waiters[key] == 1:
+                # Сразу убираем из общих запросов, чтобы новый вызов не попал на отменённый
+                del self._inflight[key]
+                del self._waiters[key]
+                task.cancel()
+                self.cancelled_requests += 1
+            raise
+        finally:
+            if self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _on_inflight_done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._waiters.pop(key, None)
+
+    async def _fetch_leader(self, key: str, endpoint: str, params: Optional[Dict]) -> Dict:
+        async with self._upstream_limit:
+            data, size = await self._fetch_with_retry(endpoint, params)
+        self.cache.set(key, data, self._cache_ttl(endpoint), size)
+        return data
+
+    def _schedule_refresh(self, key: str, endpoint: str, params: Optional[Dict]):
+
+        """Фоновое обновление устаревшей записи, не больше одного на ключ"""
+
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._fetch_and_cache(key, endpoint, params))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda t: self._on_refresh_done(key, t))
+
+    def _on_refresh_done(self, key: str, task: asyncio.Task):
+        self._refreshing.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Не удалось обновить кэш {key}: {task.exception()}")
+
+    def cache_stats(self) -> Dict[str, int]:
+        stats = self.cache.stats()
+        stats["inflight"] = len(self._inflight)
+        stats["coalesced"] = self.coalesced_requests
+        return stats
+
+    def _latency_budget(self, endpoint: str) -> float:
+        for prefix, budget in self.LATENCY_BUDGETS:
+            if endpoint.startswith(prefix):
+                return budget
+        return self.DEFAULT_LATENCY_BUDGET
+
+    async def _fetch_with_retry(self, endpoint: str, params: Optional[Dict] = None) -> Tuple[Dict, int]:
+
+        """GET с повторами, учётом Retry-After и предохранителем
+
+        Повторяются только временные ошибки (таймауты, сеть, 5xx, 429) и
+        только пока укладываемся в бюджет времени эндпоинта. При открытом
+        предохранителе запрос сразу завершается GeniusUnavailableError.
+        """
+
+        deadline = time.monotonic() + self._latency_budget(endpoint)
+        attempt = 0
+        while True:
+            if not self.breaker.allow_request():
+                self.failed_requests += 1
+                raise GeniusUnavailableError("Genius API временно недоступен")
+            try:
+                with metrics.track("bot_genius_seconds", endpoint=self.ENDPOINT_ID_RE.sub("/{id}", endpoint)):
+                    result = await self._fetch(endpoint, params, timeout=deadline - time.monotonic())
+            except asyncio.CancelledError:
+                # Вытесненный запрос не должен навсегда занять слот пробного запроса
+                self.breaker.release_probe()
+                raise
+            except GeniusAPIError as e:
+                if e.retryable:
+                    self.breaker.record_failure()
+                else:
+                    # Сервер ответил осмысленной ошибкой (404 и т.п.), он жив
+                    self.breaker.record_success()
+                attempt += 1
+                delay = e.retry_after if e.retry_after is not None else backoff_delay(attempt)
+                if (not e.retryable or attempt > config.GENIUS_MAX_RETRIES
+                        or time.monotonic() + delay >= deadline):
+                    self.failed_requests += 1
+                    raise
+                self.retries += 1
+                logger.warning(f"Повтор {attempt} запроса {endpoint} через {delay:.2f} с: {e}")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def resilience_stats(self) -> Dict[str, Any]:
+
+        """Состояние предохранителя и счётчики повторов для алертов"""
+
+        return {
+            "breaker": self.breaker.stats(),
+            "retries": self.retries,
+            "failed_requests": self.failed_requests,
+        }
+
+    async def _fetch(self, endpoint: str, params: Optional[Dict] = None,
+                     timeout: Optional[float] = None) -> Tuple[Dict, int]:
+
+        """HTTP-запрос к Genius, возвращает (json, размер ответа)"""
+
         if not self.session or self.session.closed:
             await self.initialize()
 
         url = f"{self.BASE_URL}{endpoint}"
-        if params != None:
-            url += "?"
-            for key, value in params.items():
-                url += f"{key}={value}&"
-            url = url[:-1]
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "application/json",
-        }
+        request_timeout = self.REQUEST_TIMEOUT if timeout is None else aiohttp.ClientTimeout(total=max(timeout, 0.1))
 
         try:
-            async with self.session.get(
-                    url,
-                    headers=headers,
-                    timeout=aiohttp.ClientTimeout(total=10),
-                    ssl=ssl_context
-            ) as response:
+            async with self.session.get(url, params=params, timeout=request_timeout) as response:
 
                 if response.status != 200:
                     error_text = await response.text()
-                    logger.error(f"Ошибка API: {response.status} | {error_text}")
-                    raise Exception(f"API Error: {response.status}")
+                    logger.error(f"Ошибка API: {response.status} | {error_text[:200]}")
+                    retry_after = None
+                    if response.status == 429:
+                        try:
+                            retry_after = float(response.headers.get("Retry-After", ""))
+                        except ValueError:
+                            pass
+                    raise GeniusAPIError(
+                        f"API Error: {response.status}",
+                        status=response.status,
+                        retryable=response.status == 429 or response.status >= 500,
+                        retry_after=retry_after
+                    )
 
-                return await response.json()
+                text = await response.text()
+                return json.loads(text), len(text)
 
+        except GeniusAPIError:
+            raise
         except asyncio.TimeoutError:
             logger.error("Таймаут запроса к Genius API")
-            raise Exception("Сервер не ответил вовремя")
+            raise GeniusAPIError("Сервер не ответил вовремя", retryable=True)
+        except aiohttp.ClientError as e:
+            logger.error(f"Сетевая ошибка Genius API: {e}")
+            raise GeniusAPIError(f"Ошибка API: {e}", retryable=True)
         except Exception as e:
-            logger.error(f"Ошибка в _make_request: {e}", exc_info=True)
-            raise Exception(f"Ошибка API: {e}")
+            logger.error(f"Ошибка в _fetch: {e}", exc_info=True)
+            raise GeniusAPIError(f"Ошибка API: {e}")
 
 
     async def search_songs(self, query: str) -> list:
         """Поиск песен по запросу"""
         try:
             response = await self._make_request("/search", params={"q": query})
-            return response["response"]["hits"]
+            songs = [hit["result"] for hit in response["response"]["hits"] if hit.get("type") == "song"]
+            self.songs.put_songs(songs)
+            song_index.add_songs(songs)
+            fuzzy_index.add_songs(songs)
+            return songs
         except Exception as e:
-            logging.error(f"Error searching songs: {e}")
+            logger.error(f"Error searching songs: {e}")
             return []
 
+    async def find_songs(self, query: str, limit: int = 5) -> list:
+
+        """Поиск с локальным нечётким индексом, Genius — только при промахе"""
+
+        songs = fuzzy_index.confident_matches(query, limit, config.SEARCH_LOCAL_MIN_SCORE)
+        if songs is not None:
+            for song in songs:
+                fuzzy_index.record_hit(song["id"])
+            self.local_searches += 1
+            return songs
+        songs = (await self.search_songs(query))[:limit]
+        for song in songs:
+            fuzzy_index.record_hit(song["id"])
+        return songs
+
+    async def get_song(self, song_id: int) -> Dict:
+
+        """Метаданные песни: сначала постоянный кэш, затем /songs/{id}"""
+
+        song = self.songs.get_song(song_id)
+        if song is not None:
+            return song
+        data = await self._make_request(f"/songs/{song_id}")
+        song = data["response"]["song"]
+        self.songs.put_song(song)
+        song_index.add_song(song)
+        return song
+
+    async def prefetch_songs(self, song_ids: List[int]):
+
+        """Фоновый прогрев песен, которых нет в постоянном кэше
+
+        Следующее действие после результатов поиска почти всегда «текст»
+        или «в избранное» по одной из показанных песен. Песни из ответа
+        /search уже сохранены, поэтому сюда попадают только найденные в
+        локальном индексе и устаревшие записи. Прогрев идёт не больше чем
+        в GENIUS_PREFETCH_CONCURRENCY запросов и уступает пользовательским
+        запросам: при занятом лимите Genius или открытом предохранителе
+        он пропускается, лишние песни сверх очереди отбрасываются.
+        """
+
+        # Проверки ниже читают только память
+        await self.songs.load_songs(song_ids)
+        for song_id in song_ids:
+            if song_id in self._prefetching or self.songs.has_song(song_id):
+                continue
+            if len(self._prefetching) >= config.GENIUS_PREFETCH_MAX_PENDING:
+                self.prefetch_skipped += 1
+                continue
+            task = asyncio.create_task(self._prefetch_song(song_id))
+            self._prefetching[song_id] = task
+            task.add_done_callback(lambda t, song_id=song_id: self._prefetching.pop(song_id, None))
+
+    async def _prefetch_song(self, song_id: int):
+        async with self._prefetch_limit:
+            # Пока ждали очереди, песню мог запросить сам пользователь
+            if self.songs.has_song(song_id):
+                return
+            if self._upstream_limit.locked() or self.breaker.state != self.breaker.CLOSED:
+                self.prefetch_skipped += 1
+                return
+            try:
+                await self.get_song(song_id)
+                self.prefetched += 1
+            except Exception as e:
+                logger.debug(f"Прогрев песни {song_id} не удался: {e}")
+
     async def get_song_lyrics(self, song_id: int) -> Optional[str]:
         try:
-            data = await self._make_request(f"/songs/{song_id}")
-            song = data["response"]["song"]
+            song = await self.get_song(song_id)
             return f"Текст песни {song['title']}:\n\nURL: {song['url']}\n\nПримечание: Для получения полного текста посетите страницу песни на Genius."
         except Exception as e:
             logger.error(f"Error getting song lyrics: {e}")
@@ -104,5 +451,46 @@ class GeniusAPI:
             logger.error(f"Error getting new releases: {e}")
             return []
 
+# Один клиент (и пул соединений) на процесс
+_genius: Optional[GeniusAPI] = None
+
+
 def get_genius() -> GeniusAPI:
-    return GeniusAPI()
\ No newline at end of file
+    global _genius
+    if _genius is None:
+        _genius = GeniusAPI()
+    return _genius
+
+
+async def on_startup(search_snapshot_file: str = config.SEARCH_SNAPSHOT_FILE):
+
+    """Открытие пула соединений Genius при старте диспетчера"""
+
+    await get_genius().initialize()
+    await warm_song_index(search_snapshot_file)
+
+
+async def warm_song_index(snapshot_file: str = config.SEARCH_SNAPSHOT_FILE, chunk_size: int = 1000):
+
+    """Заполнение индексов песнями из постоянного кэша без долгой блокировки loop"""
+
+    songs = await asyncio.to_thread(song_store.load_recent, song_index.max_songs)
+    for start in range(0, len(songs), chunk_size):
+        song_index.add_songs(songs[start:start + chunk_size])
+        fuzzy_index.add_songs(songs[start:start + chunk_size])
+        await asyncio.sleep(0)
+    # Снимок добавляет популярность песен и то, чего нет в кэше
+    fuzzy_index.load_snapshot(snapshot_file)
+    logger.info(f"Индексы песен прогреты: {len(song_index)} / {len(fuzzy_index)} песен")
+
+
+async def on_shutdown(search_snapshot_file: str = config.SEARCH_SNAPSHOT_FILE):
+
+    """Закрытие пула соединений Genius при остановке диспетчера"""
+
+    await get_genius().close()
+    logger.info("Сессия Genius API закрыта")
+    try:
+        fuzzy_index.save_snapshot(search_snapshot_file)
+    except OSError as e:
+        logger.error(f"Не удалось сохранить снимок поискового индекса: {e}")
\ No newline at end of file
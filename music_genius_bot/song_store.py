@@ -0,0 +1,265 @@
+import asyncio
+import sqlite3
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+from config import config
+from storage import WriteBehindMixin
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SongStore(WriteBehindMixin):
+
+    """Постоянный кэш метаданных песен (id, title, url, primary_artist)
+
+    База открывается лениво при первом обращении. Записи старше max_age
+    или записанные другой версией формата считаются промахом. Новые
+    песни пишутся пачками через WriteBehindMixin. В памяти держатся
+    последние использованные записи (LRU), а также промахи — на MISS_TTL
+    секунд, чтобы повторная проверка той же песни не ходила в базу.
+    Пачку песен можно подгрузить заранее через load_songs() в потоке записи.
+    """
+
+    # Увеличивать при изменении формата записи
+    VERSION = 1
+    # Другой процесс мог сохранить песню, поэтому промах помним недолго
+    MISS_TTL = 60.0
+
+    def __init__(
+            self,
+            filename: str = "songs.db",
+            max_age: float = 7 * 24 * 60 * 60,
+            memory_limit: int = 10000,
+            flush_interval: float = 5.0,
+            flush_threshold: int = 100
+    ):
+        self.filename = filename
+        self.max_age = max_age
+        self.memory_limit = memory_limit
+        self._conn: Optional[sqlite3.Connection] = None
+        # id -> (песня или None для промаха, время записи или проверки)
+        self._memory: "OrderedDict[int, tuple]" = OrderedDict()
+        self._pending: Dict[int, tuple] = {}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="song-store-writer")
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self._init_write_behind(flush_interval, flush_threshold)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.filename, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._connect()
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+                # Кэш можно просто пересоздать
+                self._conn.execute("DROP TABLE IF EXISTS songs")
+                self._conn.execute(f"PRAGMA user_version = {self.VERSION}")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS songs (
+                    id INTEGER PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    artist_id INTEGER,
+                    artist_name TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _to_row(song: Dict) -> tuple:
+        artist = song.get("primary_artist") or {}
+        return (
+            song["id"],
+            song.get("title", ""),
+            song.get("url", ""),
+            artist.get("id"),
+            artist.get("name", ""),
+            time.time()
+        )
+
+    @staticmethod
+    def _from_row(row: tuple) -> Dict:
+        return {
+            "id": row[0],
+            "title": row[1],
+            "url": row[2],
+            "primary_artist": {"id": row[3], "name": row[4]}
+        }
+
+    def _remember(self, song_id: int, song: Optional[Dict], updated_at: float):
+        self._memory[song_id] = (song, updated_at)
+        self._memory.move_to_end(song_id)
+        if len(self._memory) > self.memory_limit:
+            self._memory.popitem(last=False)
+
+    def get_song(self, song_id: int) -> Optional[Dict]:
+
+        """Песня из кэша или None, если её нет или она устарела"""
+
+        song = self._lookup(song_id)
+        if song is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return song
+
+    def has_song(self, song_id: int) -> bool:
+
+        """Есть ли свежая запись (без учёта в статистике попаданий)"""
+
+        return self._lookup(song_id) is not None
+
+    def _lookup(self, song_id: int) -> Optional[Dict]:
+        now = time.time()
+        cached = self._memory.get(song_id)
+        if cached is not None and cached[0] is None and now - cached[1] > self.MISS_TTL:
+            cached = None
+        if cached is None:
+            row = self._pending.get(song_id)
+            if row is None:
+                with metrics.track("bot_storage_seconds", op="SongStore.get_song"):
+                    row = self._get_conn().execute(
+                        "SELECT id, title, url, artist_id, artist_name, updated_at FROM songs WHERE id = ?",
+                        (song_id,)
+                    ).fetchone()
+            cached = (self._from_row(row), row[5]) if row is not None else (None, now)
+            self._remember(song_id, *cached)
+        else:
+            self._memory.move_to_end(song_id)
+
+        if cached[0] is None or now - cached[1] > self.max_age:
+            return None
+        return cached[0]
+
+    async def load_songs(self, song_ids: Iterable[int]):
+
+        """Подгрузка в память песен, которых там нет, одним запросом в потоке записи"""
+
+        now = time.time()
+        missing = [
+            song_id for song_id in song_ids
+            if song_id not in self._pending and (
+                song_id not in self._memory
+                or (self._memory[song_id][0] is None and now - self._memory[song_id][1] > self.MISS_TTL)
+            )
+        ]
+        if not missing:
+            return
+        self._get_conn()
+
+        def select() -> List[tuple]:
+            placeholders = ",".join("?" * len(missing))
+            return self._writer_connection().execute(
+                "SELECT id, title, url, artist_id, artist_name, updated_at FROM songs "
+                f"WHERE id IN ({placeholders})",
+                missing
+            ).fetchall()
+
+        with metrics.track("bot_storage_seconds", op="SongStore.load_songs"):
+            rows = await asyncio.get_running_loop().run_in_executor(self._writer, select)
+        found = {row[0]: row for row in rows}
+        for song_id in missing:
+            # Пока шло чтение, песню могли сохранить
+            if song_id in self._pending:
+                continue
+            row = found.get(song_id)
+            self._remember(song_id, *((self._from_row(row), row[5]) if row is not None else (None, now)))
+
+    def put_song(self, song: Dict):
+
+        """Сохранение метаданных песни из ответа Genius"""
+
+        row = self._to_row(song)
+        self._remember(row[0], self._from_row(row), row[5])
+        self._pending[row[0]] = row
+        self._mark_dirty()
+
+    def put_songs(self, songs: Iterable[Dict]):
+        for song in songs:
+            self.put_song(song)
+
+    def _writer_connection(self) -> sqlite3.Connection:
+        if self._writer_conn is None:
+            self._writer_conn = self._connect()
+        return self._writer_conn
+
+    def _execute_batch(self, rows: List[tuple]):
+        with self._writer_connection():
+            self._writer_conn.executemany(
+                "INSERT OR REPLACE INTO songs (id, title, url, artist_id, artist_name, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    async def _flush_batch(self):
+        self._get_conn()
+        rows = list(self._pending.values())
+        self._pending = {}
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._writer, self._execute_batch, rows)
+        except Exception:
+            for row in rows:
+                self._pending.setdefault(row[0], row)
+            raise
+
+    def load_recent(self, limit: int) -> List[Dict]:
+
+        """Последние limit сохранённых песен (для прогрева индексов)"""
+
+        rows = self._get_conn().execute(
+            "SELECT id, title, url, artist_id, artist_name, updated_at FROM songs "
+            "ORDER BY updated_at DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [self._from_row(row) for row in reversed(rows)]
+
+    def stats(self) -> Dict[str, int]:
+        return {"memory": len(self._memory), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+
+        """Сбрасывает отложенные записи и закрывает соединения"""
+
+        if self._pending:
+            self._get_conn()
+            rows = list(self._pending.values())
+            self._pending = {}
+            self._writer.submit(self._execute_batch, rows).result()
+            self._dirty_count = 0
+        self._writer.shutdown(wait=True)
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+        if self._conn is not None:
+            self._conn.close()
+
+
+# Общий кэш метаданных песен
+song_store = SongStore(
+    config.SONG_STORE_FILE,
+    config.SONG_STORE_MAX_AGE,
+    flush_interval=config.STORAGE_FLUSH_INTERVAL,
+    flush_threshold=config.STORAGE_FLUSH_THRESHOLD
+)
+
+
+def _collect_metrics() -> Dict[str, float]:
+    stats = song_store.stats()
+    return {
+        "bot_song_store_memory": stats["memory"],
+        "bot_song_store_hits_total": stats["hits"],
+        "bot_song_store_misses_total": stats["misses"],
+    }
+
+
+metrics.add_collector(_collect_metrics)
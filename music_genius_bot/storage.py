@@ -1,63 +1,202 @@
+import abc
+import asyncio
 import json
 import os
-from typing import Dict, List, Optional
-
-
-class Storage:
+import sqlite3
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from config import config
+from metrics import metrics
+from user_model import DEFAULT_LANGUAGE, UserTable
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindMixin(abc.ABC):
+
+    """Отложенная пакетная запись изменений
+
+    Мутации только помечают данные грязными, а фоновая задача сбрасывает
+    их пачкой раз в flush_interval секунд или по достижении flush_threshold
+    изменений. Наследник реализует _flush_batch().
+    """
+
+    def _init_write_behind(self, flush_interval: float, flush_threshold: int):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._dirty_count = 0
+        self._flush_event: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    def _mark_dirty(self):
+        self._dirty_count += 1
+        if self._flush_event is not None and self._dirty_count >= self.flush_threshold:
+            self._flush_event.set()
+
+    def start_flusher(self):
+
+        """Запуск фоновой задачи сброса (внутри работающего event loop)"""
+
+        if self._flush_task is None:
+            self._flush_event = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка фонового сохранения: {e}")
+
+    async def flush(self):
+
+        """Сброс накопленных изменений"""
+
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._dirty_count:
+                return
+            dirty_count, self._dirty_count = self._dirty_count, 0
+            try:
+                with metrics.track("bot_storage_seconds", op=f"{type(self).__name__}.flush"):
+                    await self._flush_batch()
+            except Exception:
+                self._dirty_count += dirty_count
+                raise
+
+    async def stop_flusher(self):
+
+        """Остановка фоновой задачи и финальный сброс"""
+
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    @abc.abstractmethod
+    async def _flush_batch(self):
+
+        """Запись накопленных изменений в хранилище"""
+
+
+class Storage(WriteBehindMixin):
 
     """Класс для хранения данных пользователей"""
 
-    def __init__(self, filename: str = "user_data.json"):
+    def __init__(
+            self,
+            filename: str = "user_data.json",
+            flush_interval: float = 5.0,
+            flush_threshold: int = 100
+    ):
         self.filename = filename
-        self.data: Dict[int, Dict] = self._load_data()
+        self.users = UserTable()
+        self.banned: Set[int] = set()
+        self._load_data()
+        self._init_write_behind(flush_interval, flush_threshold)
+
+    def _load_data(self):
+
+        """Загрузка данных из файла (ключи JSON-строки приводятся к int)"""
+
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                return
+        for key, user in data.items():
+            if key == "banned":
+                self.banned.update(int(user_id) for user_id in user)
+                continue
+            self.users.load_user(
+                int(key),
+                user.get("language", DEFAULT_LANGUAGE),
+                user.get("favorite_songs", []),
+                user.get("favorite_artists", [])
+            )
+
+    def _serialize(self) -> str:
+        data = {str(user_id): self.users.to_dict(user_id) for user_id in self.users}
+        data["banned"] = sorted(self.banned)
+        return json.dumps(data, ensure_ascii=False)
+
+    def _save_data(self):
 
-    def _load_data(self) -> Dict[int, Dict]:
+        """Сохранение данных в файл"""
 
-        """Загрузка данных из файла"""
+        self._write_snapshot(self._serialize())
 
-        if os.path.exists(self.filename):
-            with open(self.filename, "r", encoding="utf-8") as f:
-                try:
-                    return json.load(f)
-                except json.JSONDecodeError:
-                    return {}
-        return {}
+    def _write_snapshot(self, payload: str):
 
-    def _save_data(self):
+        """Атомарная запись снимка: временный файл + rename"""
 
-        """Сохранение данных в файл"""
+        tmp_filename = f"{self.filename}.tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
+
+    async def _flush_batch(self):
+        # Снимок сериализуется в event loop, чтобы поток не видел
+        # данные посреди изменения; на диск пишет уже поток
+        payload = self._serialize()
+        await asyncio.to_thread(self._write_snapshot, payload)
 
-        with open(self.filename, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+    def get_language(self, user_id: int) -> str:
+
+        """Язык пользователя; для неизвестного — язык по умолчанию, без создания записи"""
+
+        return self.users.get_language(user_id)
+
+    async def load_user(self, user_id: int):
+
+        """Все пользователи и так в памяти"""
 
     def get_user(self, user_id: int) -> Dict:
 
-        """Получение данных пользователя"""
+        """Данные пользователя в виде словаря (копия, изменения не сохраняются)"""
+
+        return self.users.to_dict(user_id)
+
+    def register_user(self, user_id: int):
+
+        """Заводит запись пользователя, если её ещё нет"""
 
-        if user_id not in self.data:
-            self.data[user_id] = {
-                "language": "ru",
-                "favorite_songs": [],
-                "favorite_artists": []
-            }
-        return self.data[user_id]
+        if user_id not in self.users:
+            self.users.ensure(user_id)
+            self._mark_dirty()
 
     def set_language(self, user_id: int, language: str):
 
         """Установка языка пользователя"""
 
-        user = self.get_user(user_id)
-        user["language"] = language
-        self._save_data()
+        self.users.set_language(user_id, language)
+        self._mark_dirty()
 
     def add_favorite_song(self, user_id: int, song: Dict):
 
         """Добавление песни в избранное"""
 
-        user = self.get_user(user_id)
-        if not any(s["id"] == song["id"] for s in user["favorite_songs"]):
-            user["favorite_songs"].append(song)
-            self._save_data()
+        if self.users.add_song(user_id, song):
+            self._mark_dirty()
             return True
         return False
 
@@ -65,54 +204,617 @@ class Storage:
 
         """Добавление исполнителя в избранное"""
 
-        user = self.get_user(user_id)
-        if artist["id"] not in [a["id"] for a in user["favorite_artists"]]:
-            user["favorite_artists"].append(artist)
-            self._save_data()
+        if self.users.add_artist(user_id, artist):
+            self._mark_dirty()
 
     def remove_favorite_song(self, user_id: int, song_id: int):
 
         """Удаление песни из избранного"""
 
-        user = self.get_user(user_id)
-        user["favorite_songs"] = [s for s in user["favorite_songs"] if s["id"] != song_id]
-        self._save_data()
+        if self.users.remove_song(user_id, song_id):
+            self._mark_dirty()
 
     def remove_favorite_artist(self, user_id: int, artist_id: int):
 
         """Удаление исполнителя из избранного"""
 
-        user = self.get_user(user_id)
-        user["favorite_artists"] = [a for a in user["favorite_artists"] if a["id"] != artist_id]
-        self._save_data()
+        if self.users.remove_artist(user_id, artist_id):
+            self._mark_dirty()
 
     def get_favorites(self, user_id: int) -> Dict[str, List]:
 
         """Получение избранного пользователя"""
 
-        user = self.get_user(user_id)
         return {
-            "songs": user["favorite_songs"],
-            "artists": user["favorite_artists"]
+            "songs": self.users.favorite_songs(user_id),
+            "artists": self.users.favorite_artists(user_id)
         }
 
+    def get_favorite_songs_page(self, user_id: int, offset: int, limit: int) -> Tuple[List[Dict], int]:
+
+        """Страница избранных песен и их общее число"""
+
+        return self.users.favorite_songs_page(user_id, offset, limit)
+
+    def get_favorites_version(self, user_id: int) -> int:
+
+        """Счётчик изменений избранного (для кэша отрисованных страниц)"""
+
+        return self.users.favorites_version(user_id)
+
+    async def get_favorite_songs_after(self, after: Optional[int], limit: int) -> List[Dict]:
+
+        """Пачка уникальных (по всем пользователям) песен из избранного по возрастанию id"""
+
+        return self.users.favorite_songs_after(after, limit)
+
+    def update_favorite_songs(self, songs: List[Dict]):
+
+        """Обновление снимков песен в избранном у всех пользователей разом"""
+
+        if self.users.update_songs(songs):
+            self._mark_dirty()
+
     def ban_user(self, user_id: int):
 
         """Добавить пользователя в чёрный список"""
 
-        if "banned" not in self.data:
-            self.data["banned"] = []
-        if user_id not in self.data["banned"]:
-            self.data["banned"].append(user_id)
-            self._save_data()
+        if user_id not in self.banned:
+            self.banned.add(user_id)
+            self._mark_dirty()
 
     def unban_user(self, user_id: int):
 
         """Разбанить пользователя"""
 
-        if "banned" in self.data:
-            self.data["banned"] = [id for id in self.data["banned"] if id != user_id]
+        if user_id in self.banned:
+            self.banned.discard(user_id)
+            self._mark_dirty()
+
+    def is_banned(self, user_id: int) -> bool:
+
+        """Проверка, находится ли пользователь в чёрном списке"""
+
+        return user_id in self.banned
+
+    def get_banned_ids(self) -> Set[int]:
+
+        """Множество id заблокированных пользователей"""
+
+        return set(self.banned)
+
+    async def count_users(self) -> int:
+
+        """Количество пользователей"""
+
+        return len(self.users)
+
+    async def get_user_ids(self) -> List[int]:
+
+        """id всех пользователей по возрастанию"""
+
+        return sorted(self.users)
+
+    def close(self):
+
+        """Синхронный сброс несохранённых изменений"""
+
+        if self._dirty_count:
             self._save_data()
+            self._dirty_count = 0
+
+
+class SqliteStorage(WriteBehindMixin):
+
+    """Хранилище данных пользователей в SQLite (WAL)
+
+    API совпадает с Storage. Прочитанные пользователи держатся в памяти
+    в компактном виде (UserTable), а каждая мутация ставит в очередь запись только затронутой строки;
+    очередь сбрасывается одной транзакцией в отдельном потоке, чтобы
+    не блокировать event loop.
+
+    Когда базу делят несколько процессов, задаётся cache_ttl: пользователь
+    старше cache_ttl перечитывается из базы, а список банов перечитывается
+    после сброса. Пользователи с ещё не записанными изменениями не
+    перечитываются, чтобы не потерять эти изменения.
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            language TEXT NOT NULL DEFAULT 'ru'
+        )""",
+        """CREATE TABLE IF NOT EXISTS favorite_songs (
+            user_id INTEGER NOT NULL,
+            song_id INTEGER NOT NULL,
+            data TEXT NOT NULL
+        )""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_favorite_songs_user_song
+            ON favorite_songs (user_id, song_id)""",
+        """CREATE INDEX IF NOT EXISTS idx_favorite_songs_song
+            ON favorite_songs (song_id)""",
+        """CREATE TABLE IF NOT EXISTS favorite_artists (
+            user_id INTEGER NOT NULL,
+            artist_id INTEGER NOT NULL,
+            data TEXT NOT NULL
+        )""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_favorite_artists_user_artist
+            ON favorite_artists (user_id, artist_id)""",
+        """CREATE TABLE IF NOT EXISTS bans (
+            user_id INTEGER PRIMARY KEY
+        )""",
+    )
+    USER_COUNT_TTL = 60.0
+    MAX_ABSENT_USERS = 100000
+
+    def __init__(
+            self,
+            filename: str = "user_data.db",
+            flush_interval: float = 5.0,
+            flush_threshold: int = 100,
+            cache_ttl: Optional[float] = None
+    ):
+        self.filename = filename
+        self.cache_ttl = cache_ttl
+        self._conn = self._connect()
+        self._conn.executescript(";\n".join(self.SCHEMA))
+        self.users = UserTable()
+        self._loaded_at: Dict[int, float] = {}
+        # Кого нет в базе: id -> время проверки (незарегистрированные пишут тоже)
+        self._absent: "OrderedDict[int, float]" = OrderedDict()
+        self._banned = self._read_bans(self._conn)
+        self._banned_at = time.monotonic()
+        # Все записи идут через один поток со своим соединением
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage-writer")
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._pending: List[tuple] = []
+        # Пользователи, чьи изменения ещё не записаны в базу
+        self._pending_users: Set[int] = set()
+        self._user_count: Optional[int] = None
+        self._user_count_at = 0.0
+        self._init_write_behind(flush_interval, flush_threshold)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.filename, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _write(self, sql: str, params: tuple = (), user_id: Optional[int] = None):
+
+        """Постановка записи в очередь отложенного сброса"""
+
+        self._pending.append((sql, params))
+        if user_id is not None:
+            self._pending_users.add(user_id)
+        self._mark_dirty()
+
+    def _writer_connection(self) -> sqlite3.Connection:
+
+        """Соединение потока записи; через него же идут чтения из event loop"""
+
+        if self._writer_conn is None:
+            self._writer_conn = self._connect()
+        return self._writer_conn
+
+    async def _in_writer(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._writer, func, *args)
+
+    def _execute_batch(self, batch: List[tuple]):
+        conn = self._writer_connection()
+        with conn:
+            for sql, params in batch:
+                conn.execute(sql, params)
+
+    async def _flush_batch(self):
+        batch, self._pending = self._pending, []
+        users, self._pending_users = self._pending_users, set()
+        try:
+            await self._in_writer(self._execute_batch, batch)
+        except Exception:
+            # Транзакция откатилась целиком, вернём пачку в начало очереди
+            self._pending = batch + self._pending
+            self._pending_users |= users
+            raise
+
+    async def flush(self):
+        await super().flush()
+        if self.cache_ttl is not None and time.monotonic() - self._banned_at > self.cache_ttl:
+            await self._reload_bans()
+
+    @staticmethod
+    def _read_bans(conn: sqlite3.Connection) -> Set[int]:
+        return {row[0] for row in conn.execute("SELECT user_id FROM bans")}
+
+    async def _reload_bans(self):
+
+        """Перечитывание банов, сделанных другими процессами
+
+        Читает поток записи, уже после сброса, поэтому свои баны в базе
+        есть; бан или разбан, поставленный в очередь за время чтения,
+        остаётся в силе.
+        """
+
+        self._banned_at = time.monotonic()
+        with metrics.track("bot_storage_seconds", op="SqliteStorage.reload_bans"):
+            banned = await self._in_writer(lambda: self._read_bans(self._writer_connection()))
+        pending = self._pending_users
+        self._banned = {user_id for user_id in banned if user_id not in pending} | (self._banned & pending)
+
+    def _is_fresh(self, user_id: int) -> bool:
+
+        """Можно ли отвечать пользователем из памяти, не перечитывая базу"""
+
+        if user_id not in self.users:
+            return False
+        if self.cache_ttl is None or user_id in self._pending_users:
+            return True
+        return time.monotonic() - self._loaded_at.get(user_id, 0.0) < self.cache_ttl
+
+    def _known_absent(self, user_id: int) -> bool:
+
+        """Пользователя недавно не нашли в базе, и с тех пор он не появился"""
+
+        checked_at = self._absent.get(user_id)
+        if checked_at is None or user_id in self.users:
+            return False
+        return self.cache_ttl is None or time.monotonic() - checked_at < self.cache_ttl
+
+    def _mark_absent(self, user_id: int):
+        self._absent[user_id] = time.monotonic()
+        self._absent.move_to_end(user_id)
+        if len(self._absent) > self.MAX_ABSENT_USERS:
+            self._absent.popitem(last=False)
+
+    @staticmethod
+    def _select_user(conn: sqlite3.Connection, user_id: int) -> Optional[tuple]:
+
+        """(язык, песни, исполнители) одного пользователя по индексам; None, если его нет"""
+
+        row = conn.execute("SELECT language FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        songs = conn.execute(
+            "SELECT data FROM favorite_songs WHERE user_id = ? ORDER BY rowid", (user_id,)
+        ).fetchall()
+        artists = conn.execute(
+            "SELECT data FROM favorite_artists WHERE user_id = ? ORDER BY rowid", (user_id,)
+        ).fetchall()
+        return row[0], songs, artists
+
+    def _store_user(self, user_id: int, selected: Optional[tuple]) -> bool:
+        if selected is None:
+            return user_id in self.users
+        language, songs, artists = selected
+        self.users.load_user(
+            user_id,
+            language,
+            (json.loads(s[0]) for s in songs),
+            (json.loads(a[0]) for a in artists)
+        )
+        if self.cache_ttl is not None:
+            self._loaded_at[user_id] = time.monotonic()
+        return True
+
+    async def load_user(self, user_id: int):
+
+        """Подгрузка пользователя в память в потоке записи, до обработчиков
+
+        Синхронные методы ниже после неё читают только память. Отсутствие
+        пользователя в базе тоже запоминается (на cache_ttl), чтобы апдейты
+        незарегистрированных не ходили в базу каждый раз.
+        """
+
+        if self._is_fresh(user_id) or self._known_absent(user_id):
+            return
+        with metrics.track("bot_storage_seconds", op="SqliteStorage.load_user"):
+            selected = await self._in_writer(lambda: self._select_user(self._writer_connection(), user_id))
+        # Пока шло чтение, пользователь мог измениться в памяти
+        if self._is_fresh(user_id):
+            return
+        if selected is None and user_id not in self.users:
+            self._mark_absent(user_id)
+        else:
+            self._absent.pop(user_id, None)
+            self._store_user(user_id, selected)
+
+    def _load_user(self, user_id: int) -> bool:
+
+        """Пользователь в памяти; False, если его нет в базе
+
+        Перечитывание устаревших записей — дело load_user(), здесь
+        отвечаем из памяти. В базу из event loop идём только за
+        пользователем, которого load_user() ещё ни разу не видел.
+        """
+
+        if user_id in self.users:
+            return True
+        if user_id in self._absent:
+            return False
+        with metrics.track("bot_storage_seconds", op="SqliteStorage.load_user_sync"):
+            selected = self._select_user(self._conn, user_id)
+        if selected is None:
+            self._mark_absent(user_id)
+        return self._store_user(user_id, selected)
+
+    def _ensure_user(self, user_id: int):
+        if not self._load_user(user_id):
+            self.users.ensure(user_id)
+            self._write("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,), user_id)
+
+    def get_language(self, user_id: int) -> str:
+
+        """Язык пользователя; для неизвестного — язык по умолчанию, без создания записи"""
+
+        if self._load_user(user_id):
+            return self.users.get_language(user_id)
+        return DEFAULT_LANGUAGE
+
+    def get_user(self, user_id: int) -> Dict:
+
+        """Данные пользователя в виде словаря (копия, изменения не сохраняются)"""
+
+        self._load_user(user_id)
+        return self.users.to_dict(user_id)
+
+    def register_user(self, user_id: int):
+
+        """Заводит запись пользователя, если её ещё нет"""
+
+        self._ensure_user(user_id)
+
+    def set_language(self, user_id: int, language: str):
+
+        """Установка языка пользователя"""
+
+        self._load_user(user_id)
+        self.users.set_language(user_id, language)
+        self._write(
+            "INSERT INTO users (user_id, language) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET language = excluded.language",
+            (user_id, language),
+            user_id
+        )
+
+    def add_favorite_song(self, user_id: int, song: Dict):
+
+        """Добавление песни в избранное"""
+
+        self._ensure_user(user_id)
+        if self.users.add_song(user_id, song):
+            self._write(
+                "INSERT OR IGNORE INTO favorite_songs (user_id, song_id, data) VALUES (?, ?, ?)",
+                (user_id, song["id"], json.dumps(song, ensure_ascii=False)),
+                user_id
+            )
+            return True
+        return False
+
+    def add_favorite_artist(self, user_id: int, artist: Dict):
+
+        """Добавление исполнителя в избранное"""
+
+        self._ensure_user(user_id)
+        if self.users.add_artist(user_id, artist):
+            self._write(
+                "INSERT OR IGNORE INTO favorite_artists (user_id, artist_id, data) VALUES (?, ?, ?)",
+                (user_id, artist["id"], json.dumps(artist, ensure_ascii=False)),
+                user_id
+            )
+
+    def remove_favorite_song(self, user_id: int, song_id: int):
+
+        """Удаление песни из избранного"""
+
+        self._load_user(user_id)
+        if self.users.remove_song(user_id, song_id):
+            self._write(
+                "DELETE FROM favorite_songs WHERE user_id = ? AND song_id = ?", (user_id, song_id), user_id
+            )
+
+    def remove_favorite_artist(self, user_id: int, artist_id: int):
+
+        """Удаление исполнителя из избранного"""
+
+        self._load_user(user_id)
+        if self.users.remove_artist(user_id, artist_id):
+            self._write(
+                "DELETE FROM favorite_artists WHERE user_id = ? AND artist_id = ?", (user_id, artist_id), user_id
+            )
+
+    def get_favorites(self, user_id: int) -> Dict[str, List]:
+
+        """Получение избранного пользователя"""
+
+        self._load_user(user_id)
+        return {
+            "songs": self.users.favorite_songs(user_id),
+            "artists": self.users.favorite_artists(user_id)
+        }
+
+    def get_favorite_songs_page(self, user_id: int, offset: int, limit: int) -> Tuple[List[Dict], int]:
+
+        """Страница избранных песен и их общее число"""
+
+        self._load_user(user_id)
+        return self.users.favorite_songs_page(user_id, offset, limit)
+
+    def get_favorites_version(self, user_id: int) -> int:
+
+        """Счётчик изменений избранного (для кэша отрисованных страниц)"""
+
+        self._load_user(user_id)
+        return self.users.favorites_version(user_id)
+
+    async def get_favorite_songs_after(self, after: Optional[int], limit: int) -> List[Dict]:
+
+        """Пачка уникальных (по всем пользователям) песен из избранного по возрастанию id"""
+
+        def select() -> List[tuple]:
+            return self._writer_connection().execute(
+                "SELECT song_id, MIN(data) FROM favorite_songs WHERE song_id > ? "
+                "GROUP BY song_id ORDER BY song_id LIMIT ?",
+                (-1 if after is None else after, limit)
+            ).fetchall()
+
+        with metrics.track("bot_storage_seconds", op="SqliteStorage.favorite_songs_after"):
+            rows = await self._in_writer(select)
+        return [json.loads(row[1]) for row in rows]
+
+    def update_favorite_songs(self, songs: List[Dict]):
+
+        """Обновление снимков песен в избранном у всех пользователей разом
+
+        Одна строка UPDATE на песню; все попадают в одну транзакцию сброса.
+        """
+
+        self.users.update_songs(songs)
+        for song in songs:
+            self._write(
+                "UPDATE favorite_songs SET data = ? WHERE song_id = ?",
+                (json.dumps(song, ensure_ascii=False), song["id"])
+            )
+
+    def ban_user(self, user_id: int):
+
+        """Добавить пользователя в чёрный список"""
+
+        if user_id not in self._banned:
+            self._banned.add(user_id)
+            self._write("INSERT OR IGNORE INTO bans (user_id) VALUES (?)", (user_id,), user_id)
+
+    def unban_user(self, user_id: int):
+
+        """Разбанить пользователя"""
+
+        if user_id in self._banned:
+            self._banned.discard(user_id)
+            self._write("DELETE FROM bans WHERE user_id = ?", (user_id,), user_id)
+
+    def is_banned(self, user_id: int) -> bool:
+
+        """Проверка, находится ли пользователь в чёрном списке"""
+
+        return user_id in self._banned
+
+    def get_banned_ids(self) -> Set[int]:
+
+        """Множество id заблокированных пользователей"""
+
+        return set(self._banned)
+
+    async def count_users(self) -> int:
+
+        """Количество пользователей (COUNT(*) не чаще раза в USER_COUNT_TTL секунд)"""
+
+        now = time.monotonic()
+        if self._user_count is None or now - self._user_count_at > self.USER_COUNT_TTL:
+            with metrics.track("bot_storage_seconds", op="SqliteStorage.count_users"):
+                self._user_count = await self._in_writer(
+                    lambda: self._writer_connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+                )
+            self._user_count_at = now
+        return self._user_count
+
+    async def get_user_ids(self) -> List[int]:
+
+        """id всех пользователей по возрастанию"""
+
+        rows = await self._in_writer(
+            lambda: self._writer_connection().execute("SELECT user_id FROM users ORDER BY user_id").fetchall()
+        )
+        return [row[0] for row in rows]
+
+    def close(self):
+
+        """Сбрасывает отложенные записи и закрывает соединения"""
+
+        if self._pending:
+            batch, self._pending = self._pending, []
+            self._pending_users.clear()
+            self._writer.submit(self._execute_batch, batch).result()
+            self._dirty_count = 0
+        self._writer.shutdown(wait=True)
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+        self._conn.close()
+
+
+def migrate_json_to_sqlite(json_filename: str, db_filename: str) -> int:
+
+    """Однократный перенос user_data.json в SQLite, возвращает число пользователей
+
+    База собирается во временном файле и переименовывается только после
+    коммита: прерванный перенос не оставит полупустую базу, которую
+    следующий запуск принял бы за готовую.
+    """
+
+    with open(json_filename, "r", encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError:
+            data = {}
+
+    tmp_filename = f"{db_filename}.tmp"
+    if os.path.exists(tmp_filename):
+        os.remove(tmp_filename)
+    # Без WAL: после закрытия вся база в одном файле, его и переименовываем
+    conn = sqlite3.connect(tmp_filename)
+    conn.executescript(";\n".join(SqliteStorage.SCHEMA))
+    migrated = 0
+    try:
+        with conn:
+            for key, user in data.items():
+                if key == "banned":
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO bans (user_id) VALUES (?)",
+                        [(int(user_id),) for user_id in user]
+                    )
+                    continue
+                user_id = int(key)
+                conn.execute(
+                    "INSERT OR REPLACE INTO users (user_id, language) VALUES (?, ?)",
+                    (user_id, user.get("language", DEFAULT_LANGUAGE))
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO favorite_songs (user_id, song_id, data) VALUES (?, ?, ?)",
+                    [(user_id, s["id"], json.dumps(s, ensure_ascii=False)) for s in user.get("favorite_songs", [])]
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO favorite_artists (user_id, artist_id, data) VALUES (?, ?, ?)",
+                    [(user_id, a["id"], json.dumps(a, ensure_ascii=False)) for a in user.get("favorite_artists", [])]
+                )
+                migrated += 1
+    finally:
+        conn.close()
+    os.replace(tmp_filename, db_filename)
+    return migrated
+
+
+def create_storage():
+
+    """Создание хранилища по config.STORAGE_BACKEND"""
+
+    if config.STORAGE_BACKEND == "json":
+        return Storage(
+            config.STORAGE_JSON_FILE,
+            config.STORAGE_FLUSH_INTERVAL,
+            config.STORAGE_FLUSH_THRESHOLD
+        )
+    if config.STORAGE_BACKEND != "sqlite":
+        raise ValueError(f"Неизвестный STORAGE_BACKEND: {config.STORAGE_BACKEND}")
+
+    if not os.path.exists(config.STORAGE_DB_FILE) and os.path.exists(config.STORAGE_JSON_FILE):
+        migrated = migrate_json_to_sqlite(config.STORAGE_JSON_FILE, config.STORAGE_DB_FILE)
+        logger.info(f"Перенесено {migrated} пользователей из {config.STORAGE_JSON_FILE} в SQLite")
+    return SqliteStorage(
+        config.STORAGE_DB_FILE,
+        config.STORAGE_FLUSH_INTERVAL,
+        config.STORAGE_FLUSH_THRESHOLD,
+        # Один процесс — единственный писатель, его кэш всегда актуален
+        config.STORAGE_CACHE_TTL if config.WORKERS > 1 else None
+    )
+
 
 # Инициализация хранилища
-storage = Storage()
+storage = create_storage()
@@ -0,0 +1,111 @@
+import asyncio
+from typing import Awaitable, Dict, Optional, Tuple, TypeVar
+from aiogram.types import Update
+from config import config
+from i18n import button_texts
+from keyboards import MAIN_MENU_BUTTONS
+from metrics import metrics
+
+T = TypeVar("T")
+
+# Кнопки меню — не новый поисковый запрос, а переход в другой раздел
+MENU_TEXTS = frozenset(text for key in MAIN_MENU_BUTTONS for text in button_texts(key))
+
+
+class Superseded(Exception):
+
+    """Запрос вытеснен более новым запросом того же пользователя"""
+
+
+class Superseder:
+
+    """Последний запрос пользователя отменяет его предыдущий запрос того же вида
+
+    run() выполняет работу обработчика (запросы к Genius) отдельной
+    задачей. Новый run() с тем же (пользователь, вид) отменяет
+    незавершённую задачу вместе с её HTTP-запросом, а вытесненный
+    обработчик получает Superseded и ничего не отвечает. Вид запроса (kind)
+    идёт в метрики, поэтому их набор фиксирован; если вытеснять нужно
+    точнее вида, передаётся key (например, данные кнопки). С окном debounce
+    работа начинается только после паузы, поэтому быстрые повторы
+    схлопываются в один запрос.
+    """
+
+    def __init__(self, debounce: float = 0.0):
+        self.debounce = debounce
+        self._tasks: Dict[Tuple[int, str], asyncio.Task] = {}
+        self.superseded = 0
+
+    async def run(self, user_id: int, kind: str, work: Awaitable[T], key: Optional[str] = None) -> T:
+        self.supersede(user_id, kind, key)
+        key = (user_id, key or kind)
+        task = asyncio.ensure_future(self._delayed(work))
+        self._tasks[key] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # Если задачу отменили до старта, корутина так и не запускалась
+            getattr(work, "close", lambda: None)()
+            if task.cancelled() and self._tasks.get(key) is not task:
+                raise Superseded(kind) from None
+            # Отменили сам обработчик — отменяем и работу
+            task.cancel()
+            raise
+        finally:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    async def _delayed(self, work: Awaitable[T]) -> T:
+        if self.debounce:
+            await asyncio.sleep(self.debounce)
+        return await work
+
+    def supersede(self, user_id: int, kind: str, key: Optional[str] = None) -> bool:
+
+        """Отмена незавершённого запроса (user_id, key или kind), если он есть"""
+
+        task = self._tasks.pop((user_id, key or kind), None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        self.superseded += 1
+        metrics.inc("bot_superseded_total", kind=kind)
+        return True
+
+
+def callback_kind(data: str) -> Optional[Tuple[str, str]]:
+
+    """(вид, ключ) запроса для callback: текст — последний выигрывает, избранное — по песне"""
+
+    if data.startswith("lyrics_"):
+        return "lyrics", "lyrics"
+    if data.startswith("fav_song_"):
+        # Другую песню в избранное не отменяем, только повторное нажатие
+        return "fav_song", data
+    return None
+
+
+superseder = Superseder(config.SUPERSEDE_DEBOUNCE)
+# Inline-запросы приходят на каждую букву, для них своё окно
+inline_superseder = Superseder(config.INLINE_DEBOUNCE)
+
+
+def supersede_update(update: Update):
+
+    """Отмена при приёме апдейта, до очереди чата
+
+    В webhook и многопроцессном режиме апдейты чата обрабатываются по
+    одному, и новый запрос дошёл бы до run() только после старого.
+    Команды и кнопки меню поиск не отменяют.
+    """
+
+    if update.message is not None and update.message.from_user is not None:
+        text = update.message.text or ""
+        if text and not text.startswith("/") and text not in MENU_TEXTS:
+            superseder.supersede(update.message.from_user.id, "search")
+    elif update.callback_query is not None:
+        kind = callback_kind(update.callback_query.data or "")
+        if kind is not None:
+            superseder.supersede(update.callback_query.from_user.id, *kind)
+    elif update.inline_query is not None:
+        inline_superseder.supersede(update.inline_query.from_user.id, "inline")
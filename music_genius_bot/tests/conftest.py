@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+
+# config проверяет токены при импорте
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("GENIUS_TOKEN", "test")
+
+# Модули-одиночки открывают свои файлы при импорте — не в рабочем каталоге
+_data_dir = tempfile.mkdtemp(prefix="music-genius-bot-tests-")
+for name, filename in (
+        ("STORAGE_DB_FILE", "user_data.db"),
+        ("STORAGE_JSON_FILE", "user_data.json"),
+        ("SONG_STORE_FILE", "songs.db"),
+        ("ANALYTICS_DB_FILE", "analytics.db"),
+        ("FSM_DB_FILE", "fsm.db"),
+        ("SEARCH_SNAPSHOT_FILE", "search_index.json"),
+        ("BROADCAST_STATE_FILE", "broadcast_state.json"),
+        ("FAVORITES_REFRESH_STATE_FILE", "favorites_refresh_state.json"),
+        ("LOG_FILE", "bot.log"),
+):
+    os.environ.setdefault(name, os.path.join(_data_dir, filename))
+
+# Модули бота импортируются плоско (from config import config)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+import asyncio
+
+from aiogram.types import CallbackQuery, InlineQuery
+
+from middlewares.access import AccessMiddleware, parse_limits
+
+USER = {"id": 10, "is_bot": False, "first_name": "Test"}
+
+
+class FakeBot:
+
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, method, request_timeout=None):
+        self.calls.append(type(method).__name__)
+        return True
+
+
+def callback(bot: FakeBot) -> CallbackQuery:
+    event = CallbackQuery(id="1", from_user=USER, chat_instance="c", data="lyrics_1")
+    return event.as_(bot)
+
+
+def run_updates(middleware: AccessMiddleware, events) -> list:
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event)
+
+    async def scenario():
+        for event in events:
+            await middleware(handler, event, {})
+
+    asyncio.run(scenario())
+    return handled
+
+
+def test_parse_limits():
+    assert parse_limits("search=0.2/3, callback=1") == {"search": (0.2, 3), "callback": (1.0, 1)}
+
+
+def test_throttled_callback_is_answered():
+    bot = FakeBot()
+    middleware = AccessMiddleware("callback=0.001/2")
+    handled = run_updates(middleware, [callback(bot) for _ in range(3)])
+    assert len(handled) == 2
+    assert bot.calls == ["AnswerCallbackQuery"]
+
+
+def test_inline_queries_are_not_throttled():
+    middleware = AccessMiddleware("inline=0.001/1")
+    events = [InlineQuery(id=str(i), from_user=USER, query="lov"[:i + 1], offset="") for i in range(3)]
+    assert len(run_updates(middleware, events)) == 3
+
+
+def test_least_recently_used_bucket_is_evicted():
+    middleware = AccessMiddleware("callback=0.001/1")
+    middleware.MAX_BUCKETS = 2
+    for user_id in (1, 2, 1, 3):
+        middleware._bucket(user_id, "callback", (0.001, 1))
+    assert list(middleware._buckets) == [(1, "callback"), (3, "callback")]
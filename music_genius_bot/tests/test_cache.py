@@ -0,0 +1,71 @@
+import asyncio
+
+from cache import TTLCache
+from services import GeniusAPI
+
+
+def test_fresh_then_stale_then_expired():
+    cache = TTLCache(stale_ttl=3600)
+    cache.set("fresh", 1, ttl=60)
+    cache.set("stale", 2, ttl=0)
+    assert cache.get("fresh") == (1, False)
+    assert cache.get("stale") == (2, True)
+
+    cache.stale_ttl = 0
+    assert cache.get("stale") == (None, False)
+    assert "stale" not in cache._entries
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a")
+    cache.set("c", 3, ttl=60)
+    assert cache.get("b") == (None, False)
+    assert cache.get("a") == (1, False)
+    assert cache.get("c") == (3, False)
+    assert cache.evictions == 1
+
+
+def test_byte_limit_evicts_and_skips_oversized_values():
+    cache = TTLCache(max_bytes=10)
+    cache.set("a", 1, ttl=60, size=6)
+    cache.set("b", 2, ttl=60, size=6)
+    assert len(cache) == 1 and cache.get("b") == (2, False)
+    cache.set("huge", 3, ttl=60, size=11)
+    assert cache.get("huge") == (None, False)
+    assert cache.stats()["bytes"] == 6
+
+
+def test_stale_entry_is_served_while_one_refresh_runs():
+    async def scenario():
+        genius = GeniusAPI()
+        release = asyncio.Event()
+        started = asyncio.Event()
+        calls = []
+
+        async def fetch(endpoint, params=None, timeout=None):
+            calls.append(endpoint)
+            started.set()
+            await release.wait()
+            return {"response": "new"}, 10
+
+        genius._fetch = fetch
+        key = genius._cache_key("/songs/1")
+        genius.cache.set(key, {"response": "old"}, ttl=0)
+
+        first = await genius._make_request("/songs/1")
+        second = await genius._make_request("/songs/1")
+        assert first == second == {"response": "old"}
+        await started.wait()
+        await genius._make_request("/songs/1")
+        assert calls == ["/songs/1"]
+
+        release.set()
+        await asyncio.gather(*genius._refreshing.values())
+        assert genius.cache.get(key) == ({"response": "new"}, False)
+        assert not genius._refreshing
+
+    asyncio.run(scenario())
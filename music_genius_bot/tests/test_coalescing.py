@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from services import GeniusAPI, GeniusAPIError
+from song_store import SongStore
+
+
+def make_genius(tmp_path, fetch) -> GeniusAPI:
+    genius = GeniusAPI()
+    genius.songs = SongStore(str(tmp_path / "songs.db"))
+    genius._fetch = fetch
+    return genius
+
+
+def test_concurrent_get_song_makes_one_request(tmp_path):
+    calls = []
+
+    async def fetch(endpoint, params=None, timeout=None):
+        calls.append(endpoint)
+        await asyncio.sleep(0.01)
+        song = {"id": 7, "title": "Song", "url": "", "primary_artist": {"id": 1, "name": "Artist"}}
+        return {"response": {"song": song}}, 100
+
+    async def scenario():
+        genius = make_genius(tmp_path, fetch)
+        first, second = await asyncio.gather(genius.get_song(7), genius.get_song(7))
+        assert first["id"] == second["id"] == 7
+        assert genius.coalesced_requests == 1
+        assert not genius._inflight
+
+    asyncio.run(scenario())
+    assert calls == ["/songs/7"]
+
+
+def test_error_is_shared_but_not_cached(tmp_path):
+    calls = []
+
+    async def fetch(endpoint, params=None, timeout=None):
+        calls.append(endpoint)
+        await asyncio.sleep(0.01)
+        raise GeniusAPIError("API Error: 404", status=404)
+
+    async def scenario():
+        genius = make_genius(tmp_path, fetch)
+        results = await asyncio.gather(
+            genius._make_request("/albums/new"), genius._make_request("/albums/new"),
+            return_exceptions=True
+        )
+        assert [type(result) for result in results] == [GeniusAPIError, GeniusAPIError]
+        assert len(calls) == 1
+        with pytest.raises(GeniusAPIError):
+            await genius._make_request("/albums/new")
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_the_last_waiter_cancels_the_request(tmp_path):
+    cancelled = []
+
+    async def fetch(endpoint, params=None, timeout=None):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(endpoint)
+            raise
+
+    async def scenario():
+        genius = make_genius(tmp_path, fetch)
+        first = asyncio.create_task(genius._make_request("/songs/1"))
+        second = asyncio.create_task(genius._make_request("/songs/1"))
+        await asyncio.sleep(0.01)
+
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled and "/songs/1" in genius._inflight
+
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled == ["/songs/1"]
+        assert not genius._inflight
+        assert genius.cancelled_requests == 1
+
+    asyncio.run(scenario())
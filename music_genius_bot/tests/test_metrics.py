@@ -0,0 +1,21 @@
+from metrics import Metrics
+
+
+def test_collector_totals_are_rendered_as_counters():
+    registry = Metrics()
+    registry.add_collector(lambda: {"bot_queue_depth": 3, "bot_sent_total": 10})
+    lines = registry.render().splitlines()
+    assert "# TYPE bot_queue_depth gauge" in lines
+    assert "# TYPE bot_sent_total counter" in lines
+    assert "bot_sent_total 10" in lines
+
+
+def test_tracked_errors_are_counted():
+    registry = Metrics()
+    try:
+        with registry.track("bot_op_seconds", op="x"):
+            raise ValueError
+    except ValueError:
+        pass
+    assert registry.counters() == {'bot_op_errors_total{op="x"}': 1}
+    assert 'bot_op_inflight{op="x"} 0' in registry.render()
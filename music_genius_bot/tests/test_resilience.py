@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+
+import services
+from resilience import CircuitBreaker, backoff_delay
+from services import GeniusAPI, GeniusAPIError, GeniusUnavailableError
+
+
+def test_breaker_opens_at_threshold():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.state == breaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    breaker.opened_at = time.monotonic() - 61
+
+    assert breaker.allow_request()
+    assert breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+    assert breaker.allow_request() and breaker.allow_request()
+
+
+def test_failed_probe_reopens_and_released_probe_frees_the_slot():
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=60)
+    breaker.state = breaker.OPEN
+    breaker.opened_at = time.monotonic() - 61
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow_request()
+
+    breaker.opened_at = time.monotonic() - 61
+    assert breaker.allow_request()
+    breaker.release_probe()
+    assert breaker.allow_request()
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, base=0.2, cap=1.0) <= 1.0
+
+
+def make_genius(monkeypatch, errors) -> GeniusAPI:
+    monkeypatch.setattr(services, "backoff_delay", lambda attempt: 0)
+    monkeypatch.setattr(services.config, "GENIUS_MAX_RETRIES", 2)
+    genius = GeniusAPI()
+    genius.calls = 0
+
+    async def fetch(endpoint, params=None, timeout=None):
+        genius.calls += 1
+        if errors:
+            raise errors.pop(0)
+        return {"response": {}}, 2
+
+    genius._fetch = fetch
+    return genius
+
+
+def test_retryable_error_is_retried(monkeypatch):
+    genius = make_genius(monkeypatch, [GeniusAPIError("API Error: 503", status=503, retryable=True)])
+    assert asyncio.run(genius._fetch_with_retry("/search")) == ({"response": {}}, 2)
+    assert genius.calls == 2
+    assert genius.retries == 1
+
+
+def test_non_retryable_error_is_not_retried(monkeypatch):
+    genius = make_genius(monkeypatch, [GeniusAPIError("API Error: 404", status=404)])
+    with pytest.raises(GeniusAPIError):
+        asyncio.run(genius._fetch_with_retry("/songs/1"))
+    assert genius.calls == 1
+    assert genius.breaker.failures == 0
+
+
+def test_open_breaker_rejects_without_a_request(monkeypatch):
+    genius = make_genius(monkeypatch, [])
+    genius.breaker.state = genius.breaker.OPEN
+    genius.breaker.opened_at = time.monotonic()
+    with pytest.raises(GeniusUnavailableError):
+        asyncio.run(genius._fetch_with_retry("/search"))
+    assert genius.calls == 0
@@ -0,0 +1,70 @@
+from search_index import TrigramIndex
+
+MIN_SCORE = 0.75
+
+
+def song(song_id: int, title: str, artist: str) -> dict:
+    return {"id": song_id, "title": title, "url": "", "primary_artist": {"id": song_id, "name": artist}}
+
+
+def make_index(*songs: dict) -> TrigramIndex:
+    index = TrigramIndex(max_songs=100)
+    index.add_songs(songs)
+    return index
+
+
+def test_artist_query_falls_back_to_genius():
+    index = make_index(song(1, "Lunch", "Billie Eilish"))
+    assert index.search("Billie Eilish")[0][0] >= MIN_SCORE
+    assert index.confident_matches("Billie Eilish", 5, MIN_SCORE) is None
+
+
+def test_short_word_query_falls_back_to_genius():
+    index = make_index(song(1, "Love Story", "Taylor Swift"))
+    assert index.confident_matches("love", 5, MIN_SCORE) is None
+
+
+def test_full_song_query_is_answered_locally():
+    index = make_index(song(1, "Love Story", "Taylor Swift"), song(2, "Lunch", "Billie Eilish"))
+    songs = index.confident_matches("taylor swift love story", 5, MIN_SCORE)
+    assert songs and songs[0]["id"] == 1
+
+
+def test_typo_in_full_song_query_is_answered_locally():
+    index = make_index(song(1, "Love Story", "Taylor Swift"))
+    songs = index.confident_matches("love storry taylor swift", 5, MIN_SCORE)
+    assert songs and songs[0]["id"] == 1
+
+
+def test_enough_strong_hits_are_answered_locally():
+    index = make_index(*(song(i, f"Track {i}", "Billie Eilish") for i in range(1, 6)))
+    songs = index.confident_matches("Billie Eilish", 5, MIN_SCORE)
+    assert songs is not None and len(songs) == 5
+
+
+def test_unknown_query_falls_back_to_genius():
+    index = make_index(song(1, "Lunch", "Billie Eilish"))
+    assert index.confident_matches("metallica", 5, MIN_SCORE) is None
+
+
+def test_readding_changed_song_reindexes_it():
+    index = make_index(song(1, "Old Title", "Artist"))
+    index.add_song(song(1, "New Title", "Artist"))
+    assert index.search("new title artist")[0][1]["title"] == "New Title"
+    assert index.search("old") == []
+
+
+def test_evicting_readded_song_leaves_no_stale_postings():
+    index = TrigramIndex(max_songs=1)
+    index.add_song(song(1, "Old Title", "Artist"))
+    index.add_song(song(1, "New Title", "Artist"))
+    index.add_song(song(2, "Other", "Band"))
+    assert [found["id"] for _, found in index.search("old title")] == [2]
+    assert all(ids == {2} for ids in index._postings.values())
+    assert index.search("other band")[0][1]["id"] == 2
+
+
+def test_index_keeps_only_displayed_fields():
+    full = dict(song(1, "Title", "Artist"), lyrics_state="complete", description={"dom": {}})
+    index = make_index(full)
+    assert index.search("title artist")[0][1] == song(1, "Title", "Artist")
@@ -0,0 +1,65 @@
+import asyncio
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from broadcast import TokenBucket
+from sender import OutboundSender
+
+
+class FakeBot:
+
+    """Записывает отправленные сообщения; медленные чаты отвечают с задержкой"""
+
+    def __init__(self, slow_chats=(), flood_waits=0):
+        self.sent = []
+        self.slow_chats = set(slow_chats)
+        self.flood_waits = flood_waits
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.flood_waits:
+            self.flood_waits -= 1
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Flood control", retry_after=0)
+        if chat_id in self.slow_chats:
+            await asyncio.sleep(0.05)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def make_sender() -> OutboundSender:
+    return OutboundSender(TokenBucket(1000, 1000), chat_rate=1000, chat_burst=1000)
+
+
+def test_messages_in_a_chat_keep_their_order():
+    bot = FakeBot(slow_chats={1})
+
+    async def scenario():
+        sender = make_sender()
+        results = await asyncio.gather(*(sender.send_message(bot, 1, str(i)) for i in range(5)))
+        assert results == ["0", "1", "2", "3", "4"]
+        assert not sender._workers and not sender._queues
+
+    asyncio.run(scenario())
+    assert [text for _, text in bot.sent] == ["0", "1", "2", "3", "4"]
+
+
+def test_slow_chat_does_not_delay_other_chats():
+    bot = FakeBot(slow_chats={1})
+
+    async def scenario():
+        sender = make_sender()
+        await asyncio.gather(sender.send_message(bot, 1, "slow"), sender.send_message(bot, 2, "fast"))
+
+    asyncio.run(scenario())
+    assert bot.sent == [(2, "fast"), (1, "slow")]
+
+
+def test_flood_wait_is_retried():
+    bot = FakeBot(flood_waits=1)
+
+    async def scenario():
+        sender = make_sender()
+        assert await sender.send_message(bot, 1, "hi") == "hi"
+        assert sender.flood_waits == 1 and sender.sent == 1
+
+    asyncio.run(scenario())
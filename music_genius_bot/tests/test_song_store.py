@@ -0,0 +1,48 @@
+import asyncio
+
+from song_store import SongStore
+
+
+def song(song_id: int) -> dict:
+    return {"id": song_id, "title": f"Song {song_id}", "url": "", "primary_artist": {"id": 1, "name": "Artist"}}
+
+
+def count_selects(store: SongStore) -> list:
+    statements = []
+    store._get_conn().set_trace_callback(statements.append)
+    return statements
+
+
+def test_miss_is_remembered(tmp_path):
+    store = SongStore(str(tmp_path / "songs.db"))
+    statements = count_selects(store)
+    assert not store.has_song(1)
+    assert not store.has_song(1)
+    assert len([sql for sql in statements if sql.startswith("SELECT")]) == 1
+    store.put_song(song(1))
+    assert store.has_song(1)
+    store.close()
+
+
+def test_memory_evicts_least_recently_used(tmp_path):
+    store = SongStore(str(tmp_path / "songs.db"), memory_limit=2)
+    store.put_song(song(1))
+    store.put_song(song(2))
+    assert store.get_song(1) is not None
+    store.put_song(song(3))
+    assert list(store._memory) == [1, 3]
+    store.close()
+
+
+def test_load_songs_reads_batch_off_the_loop(tmp_path):
+    filename = str(tmp_path / "songs.db")
+    writer = SongStore(filename)
+    writer.put_songs([song(1), song(2)])
+    writer.close()
+
+    store = SongStore(filename)
+    asyncio.run(store.load_songs([1, 2, 3]))
+    statements = count_selects(store)
+    assert store.has_song(1) and store.has_song(2) and not store.has_song(3)
+    assert statements == []
+    store.close()
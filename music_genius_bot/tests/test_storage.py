@@ -0,0 +1,51 @@
+import asyncio
+
+from storage import SqliteStorage
+
+
+def make_storage(tmp_path, **kwargs) -> SqliteStorage:
+    return SqliteStorage(str(tmp_path / "users.db"), **kwargs)
+
+
+def test_absent_user_is_read_from_database_once(tmp_path):
+    storage = make_storage(tmp_path, cache_ttl=60)
+    reads = []
+    select = storage._select_user
+    storage._select_user = lambda conn, user_id: reads.append(user_id) or select(conn, user_id)
+
+    async def scenario():
+        await storage.load_user(42)
+        await storage.load_user(42)
+
+    asyncio.run(scenario())
+    assert storage.get_language(42) == "ru"
+    assert storage.get_favorite_songs_page(42, 0, 5) == ([], 0)
+    assert storage.get_favorites_version(42) == 0
+    assert reads == [42]
+    storage.close()
+
+
+def test_registered_user_is_no_longer_absent(tmp_path):
+    storage = make_storage(tmp_path, cache_ttl=60)
+    asyncio.run(storage.load_user(42))
+    storage.set_language(42, "en")
+    assert storage.get_language(42) == "en"
+    storage.close()
+
+    reopened = make_storage(tmp_path, cache_ttl=60)
+    asyncio.run(reopened.load_user(42))
+    assert reopened.get_language(42) == "en"
+    reopened.close()
+
+
+def test_write_behind_flushes_pending_writes(tmp_path):
+    storage = make_storage(tmp_path, flush_threshold=1000)
+    storage.add_favorite_song(1, {"id": 5, "title": "Song", "primary_artist": {"id": 1, "name": "Artist"}})
+    assert storage._pending
+    asyncio.run(storage.flush())
+    assert not storage._pending
+
+    other = make_storage(tmp_path)
+    assert [song["id"] for song in other.get_favorites(1)["songs"]] == [5]
+    other.close()
+    storage.close()
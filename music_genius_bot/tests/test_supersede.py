@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+from metrics import metrics
+from supersede import Superseded, Superseder, callback_kind
+
+
+def test_favorite_callbacks_share_one_metric_label():
+    assert callback_kind("fav_song_1") == ("fav_song", "fav_song_1")
+    assert callback_kind("fav_song_2")[0] == callback_kind("fav_song_1")[0]
+    assert callback_kind("lyrics_1") == callback_kind("lyrics_2")
+
+
+def test_repeated_tap_supersedes_only_the_same_key():
+    superseder = Superseder()
+
+    async def scenario():
+        first = asyncio.create_task(superseder.run(1, "fav_song", asyncio.sleep(1, "a"), "fav_song_1"))
+        other = asyncio.create_task(superseder.run(1, "fav_song", asyncio.sleep(0.01, "b"), "fav_song_2"))
+        await asyncio.sleep(0)
+        repeat = asyncio.create_task(superseder.run(1, "fav_song", asyncio.sleep(0.01, "c"), "fav_song_1"))
+        with pytest.raises(Superseded):
+            await first
+        return await other, await repeat
+
+    assert asyncio.run(scenario()) == ("b", "c")
+    assert superseder.superseded == 1
+    assert 'bot_superseded_total{kind="fav_song"}' in metrics.render()
@@ -0,0 +1,52 @@
+from user_model import UserTable
+
+
+def song(song_id: int) -> dict:
+    return {"id": song_id, "title": f"Song {song_id}", "primary_artist": {"id": 1, "name": "Artist"}}
+
+
+def test_favorite_songs_after_pages_unique_songs_in_id_order():
+    table = UserTable()
+    for user_id, song_ids in ((1, (30, 10, 20)), (2, (20, 40))):
+        for song_id in song_ids:
+            table.add_song(user_id, song(song_id))
+    assert [s["id"] for s in table.favorite_songs_after(None, 2)] == [10, 20]
+    assert [s["id"] for s in table.favorite_songs_after(20, 2)] == [30, 40]
+    assert table.favorite_songs_after(40, 2) == []
+
+
+def test_song_is_dropped_when_last_user_removes_it():
+    table = UserTable()
+    table.add_song(1, song(5))
+    table.add_song(2, song(5))
+    table.remove_song(1, 5)
+    assert 5 in table.songs
+    table.remove_song(2, 5)
+    assert 5 not in table.songs
+    assert table.favorite_songs_after(None, 10) == []
+
+
+def test_reloaded_user_releases_old_songs():
+    table = UserTable()
+    table.load_user(1, "en", [song(5)], [])
+    version = table.favorites_version(1)
+    table.load_user(1, "en", [song(6)], [])
+    assert [s["id"] for s in table.favorite_songs_after(None, 10)] == [6]
+    assert table.favorites_version(1) > version
+
+
+def test_artist_is_dropped_when_last_user_removes_it():
+    table = UserTable()
+    table.add_artist(1, {"id": 7, "name": "Artist"})
+    table.add_artist(2, {"id": 7, "name": "Artist"})
+    table.remove_artist(1, 7)
+    assert 7 in table.artists
+    table.remove_artist(2, 7)
+    assert 7 not in table.artists
+
+
+def test_reloaded_user_releases_old_artists():
+    table = UserTable()
+    table.load_user(1, "en", [], [{"id": 7, "name": "Old"}])
+    table.load_user(1, "en", [], [{"id": 8, "name": "New"}])
+    assert list(table.artists) == [8]
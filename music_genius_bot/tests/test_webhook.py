@@ -0,0 +1,80 @@
+import asyncio
+
+from aiogram.types import Update
+
+import supersede
+from webhook import UpdateProcessor, WebhookServer
+
+
+def message_update(update_id: int, chat_id: int, text: str = "/start") -> Update:
+    user = {"id": chat_id, "is_bot": False, "first_name": "Test"}
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"},
+                    "from": user, "text": text},
+    })
+
+
+class FakeRequest:
+
+    def __init__(self, update: Update):
+        self.headers = {}
+        self._payload = update.model_dump(exclude_none=True)
+
+    async def json(self):
+        return self._payload
+
+
+class RecordingDispatcher:
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.done = []
+
+    async def feed_update(self, bot, update: Update):
+        await asyncio.sleep(self.delays.get(update.message.chat.id, 0))
+        self.done.append(update.update_id)
+
+
+def test_slow_chat_does_not_block_other_chats_and_keeps_its_order():
+    dp = RecordingDispatcher({1: 0.05})
+    processor = UpdateProcessor(dp, None, max_in_flight=10)
+
+    async def scenario():
+        for update_id, chat_id in enumerate([1, 2, 1, 3]):
+            await processor.acquire()
+            processor.submit(message_update(update_id, chat_id))
+        await processor.drain()
+
+    asyncio.run(scenario())
+    assert dp.done == [1, 3, 0, 2]
+
+
+def test_in_flight_updates_are_bounded():
+    dp = RecordingDispatcher({chat_id: 0.01 for chat_id in range(10)})
+    processor = UpdateProcessor(dp, None, max_in_flight=2)
+
+    async def scenario():
+        for update_id in range(10):
+            await processor.acquire()
+            processor.submit(message_update(update_id, update_id))
+            assert len(processor._chains) <= 2
+        await processor.drain()
+
+    asyncio.run(scenario())
+    assert sorted(dp.done) == list(range(10))
+
+
+def test_rejected_update_does_not_supersede_running_search(monkeypatch):
+    superseded = []
+    monkeypatch.setattr(supersede.superseder, "supersede", lambda *args: superseded.append(args))
+    server = WebhookServer(RecordingDispatcher(), None, "", queue_size=1, workers=1,
+                           max_in_flight=1, enqueue_timeout=0.01)
+
+    async def scenario():
+        first = await server.handle(FakeRequest(message_update(1, 7, "first song")))
+        second = await server.handle(FakeRequest(message_update(2, 7, "second song")))
+        return first.status, second.status
+
+    assert asyncio.run(scenario()) == (200, 503)
+    assert superseded == []
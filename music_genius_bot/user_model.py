@@ -0,0 +1,254 @@
+import bisect
+import sys
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_LANGUAGE = "ru"
+
+# Общий пустой набор id: у большинства пользователей избранного нет
+EMPTY_IDS = ()
+
+
+def intern_language(language: str) -> str:
+
+    """Один объект строки на код языка для всех пользователей"""
+
+    return sys.intern(language)
+
+
+def favorite_song_record(song: Dict) -> Dict:
+
+    """Снимок песни для избранного из ответа Genius"""
+
+    return {
+        "id": song["id"],
+        "title": song["title"],
+        "primary_artist": {
+            "name": song["primary_artist"]["name"],
+            "id": song["primary_artist"]["id"]
+        }
+    }
+
+
+class UserRecord:
+
+    """Компактная запись пользователя
+
+    Вместо словаря со списками словарей — слоты: интернированный код языка
+    и id избранного. Избранное хранится словарём id -> None: проверка,
+    добавление и удаление за O(1) с сохранением порядка добавления. Сами
+    песни и исполнители лежат в общих таблицах UserTable, по одному
+    объекту на id. version растёт при каждом изменении избранного, по ней
+    сбрасываются закэшированные страницы.
+    """
+
+    __slots__ = ("language", "song_ids", "artist_ids", "version")
+
+    def __init__(self, language: str = DEFAULT_LANGUAGE, song_ids=EMPTY_IDS, artist_ids=EMPTY_IDS):
+        self.language = language
+        self.song_ids = song_ids
+        self.artist_ids = artist_ids
+        self.version = 0
+
+
+class UserTable:
+
+    """Пользователи с ключами-int и общие таблицы песен и исполнителей
+
+    Чтение неизвестного пользователя ничего не создаёт: get_language()
+    возвращает язык по умолчанию. Запись появляется только при изменении.
+    Для песен и исполнителей ведётся число ссылающихся пользователей:
+    запись, которую никто не хранит, удаляется из таблицы. Для песен есть
+    ещё отсортированный список id, проход по избранному берёт пачку
+    бинарным поиском.
+    """
+
+    def __init__(self):
+        self.users: Dict[int, UserRecord] = {}
+        self.songs: Dict[int, Dict] = {}
+        self._song_refs: Dict[int, int] = {}
+        self._song_ids: List[int] = []
+        self.artists: Dict[int, Dict] = {}
+        self._artist_refs: Dict[int, int] = {}
+        # Растёт при обновлении метаданных песен, общих для всех пользователей
+        self.metadata_version = 0
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.users
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.users)
+
+    def get(self, user_id: int) -> Optional[UserRecord]:
+        return self.users.get(user_id)
+
+    def get_language(self, user_id: int) -> str:
+        record = self.users.get(user_id)
+        return record.language if record is not None else DEFAULT_LANGUAGE
+
+    def ensure(self, user_id: int) -> UserRecord:
+        record = self.users.get(user_id)
+        if record is None:
+            record = self.users[user_id] = UserRecord()
+        return record
+
+    def set_language(self, user_id: int, language: str):
+        self.ensure(user_id).language = intern_language(language)
+
+    def add_song(self, user_id: int, song: Dict) -> bool:
+        record = self.ensure(user_id)
+        song_id = int(song["id"])
+        if song_id in record.song_ids:
+            return False
+        if record.song_ids is EMPTY_IDS:
+            record.song_ids = {}
+        record.song_ids[song_id] = None
+        record.version += 1
+        self.songs[song_id] = song
+        refs = self._song_refs.get(song_id, 0)
+        if not refs:
+            bisect.insort(self._song_ids, song_id)
+        self._song_refs[song_id] = refs + 1
+        return True
+
+    def remove_song(self, user_id: int, song_id: int) -> bool:
+        record = self.users.get(user_id)
+        if record is None or song_id not in record.song_ids:
+            return False
+        del record.song_ids[song_id]
+        record.version += 1
+        self._release_song(song_id)
+        return True
+
+    def _release_song(self, song_id: int):
+        refs = self._song_refs[song_id] - 1
+        if refs:
+            self._song_refs[song_id] = refs
+            return
+        del self._song_refs[song_id]
+        del self.songs[song_id]
+        del self._song_ids[bisect.bisect_left(self._song_ids, song_id)]
+
+    def add_artist(self, user_id: int, artist: Dict) -> bool:
+        record = self.ensure(user_id)
+        artist_id = int(artist["id"])
+        if artist_id in record.artist_ids:
+            return False
+        if record.artist_ids is EMPTY_IDS:
+            record.artist_ids = {}
+        record.artist_ids[artist_id] = None
+        record.version += 1
+        self.artists[artist_id] = artist
+        self._artist_refs[artist_id] = self._artist_refs.get(artist_id, 0) + 1
+        return True
+
+    def remove_artist(self, user_id: int, artist_id: int) -> bool:
+        record = self.users.get(user_id)
+        if record is None or artist_id not in record.artist_ids:
+            return False
+        del record.artist_ids[artist_id]
+        record.version += 1
+        self._release_artist(artist_id)
+        return True
+
+    def _release_artist(self, artist_id: int):
+        refs = self._artist_refs[artist_id] - 1
+        if refs:
+            self._artist_refs[artist_id] = refs
+            return
+        del self._artist_refs[artist_id]
+        del self.artists[artist_id]
+
+    def favorite_songs(self, user_id: int) -> List[Dict]:
+        record = self.users.get(user_id)
+        if record is None:
+            return []
+        return [self.songs[song_id] for song_id in record.song_ids]
+
+    def favorite_songs_page(self, user_id: int, offset: int, limit: int) -> Tuple[List[Dict], int]:
+
+        """Срез избранных песен в порядке добавления и их общее число
+
+        Это пагинация по смещению, а не курсор: словарь id не умеет
+        переходить к позиции, поэтому islice пропускает offset элементов
+        и страница стоит O(offset + limit). Постоянна только первая
+        страница; дальние страницы длинного избранного дороже, их
+        повторный показ закрывает кэш отрисованных страниц в handlers.
+        """
+
+        record = self.users.get(user_id)
+        if record is None:
+            return [], 0
+        ids = islice(record.song_ids, offset, offset + limit)
+        return [self.songs[song_id] for song_id in ids], len(record.song_ids)
+
+    def favorites_version(self, user_id: int) -> int:
+
+        """Меняется и при изменении избранного, и при обновлении метаданных песен"""
+
+        record = self.users.get(user_id)
+        return (record.version if record is not None else 0) + self.metadata_version
+
+    def favorite_songs_after(self, after: Optional[int], limit: int) -> List[Dict]:
+
+        """Уникальные песни из избранного с id больше after, по возрастанию id"""
+
+        start = 0 if after is None else bisect.bisect_right(self._song_ids, after)
+        return [self.songs[song_id] for song_id in self._song_ids[start:start + limit]]
+
+    def update_songs(self, songs: Iterable[Dict]) -> int:
+
+        """Замена снимков уже известных песен; возвращает число заменённых"""
+
+        updated = 0
+        for song in songs:
+            song_id = int(song["id"])
+            if song_id in self.songs:
+                self.songs[song_id] = song
+                updated += 1
+        if updated:
+            self.metadata_version += 1
+        return updated
+
+    def favorite_artists(self, user_id: int) -> List[Dict]:
+        record = self.users.get(user_id)
+        if record is None:
+            return []
+        return [self.artists[artist_id] for artist_id in record.artist_ids]
+
+    def load_user(self, user_id: int, language: str, songs: Iterable[Dict], artists: Iterable[Dict]):
+
+        """Заполнение записи из внешнего представления (JSON или SQLite)
+
+        Уже загруженная запись заменяется целиком, а её версия только
+        растёт, чтобы не совпасть со страницами, отрисованными до перечитывания.
+        """
+
+        old = self.users.pop(user_id, None)
+        if old is not None:
+            for song_id in old.song_ids:
+                self._release_song(song_id)
+            for artist_id in old.artist_ids:
+                self._release_artist(artist_id)
+        record = self.ensure(user_id)
+        record.language = intern_language(language)
+        for song in songs:
+            self.add_song(user_id, song)
+        for artist in artists:
+            self.add_artist(user_id, artist)
+        if old is not None:
+            record.version += old.version + 1
+
+    def to_dict(self, user_id: int) -> Dict:
+
+        """Запись в прежнем формате user_data.json"""
+
+        record = self.users.get(user_id) or UserRecord()
+        return {
+            "language": record.language,
+            "favorite_songs": [self.songs[song_id] for song_id in record.song_ids],
+            "favorite_artists": [self.artists[artist_id] for artist_id in record.artist_ids]
+        }
@@ -0,0 +1,212 @@
+import asyncio
+import hmac
+import signal
+import logging
+from typing import Dict, List, Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from config import config
+from supersede import supersede_update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def partition_key(update: Update) -> int:
+
+    """Ключ очереди для апдейта: id чата или пользователя, иначе update_id"""
+
+    event = update.event
+    chat = getattr(event, "chat", None)
+    if chat is None and getattr(event, "message", None) is not None:
+        chat = event.message.chat
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    return update.update_id
+
+
+class UpdateProcessor:
+
+    """Обработка апдейтов с сохранением порядка внутри чата
+
+    Апдейты разных чатов обрабатываются конкурентно, а апдейт чата ждёт
+    завершения предыдущего апдейта того же чата. Одновременно в работе не
+    больше max_in_flight апдейтов: слот занимается через acquire() до
+    передачи апдейта, поэтому при перегрузке апдейты копятся во входной
+    очереди (webhook или процесса-воркера), размер которой ограничен.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, max_in_flight: int):
+        self.dp = dp
+        self.bot = bot
+        self._chains: Dict[int, asyncio.Task] = {}
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    async def acquire(self):
+
+        """Ожидание свободного слота перед чтением следующего апдейта"""
+
+        await self._slots.acquire()
+
+    def release(self):
+
+        """Возврат слота, если апдейт так и не был передан в submit"""
+
+        self._slots.release()
+
+    def submit(self, update: Update):
+
+        """Запуск обработки апдейта в слоте, занятом через acquire()"""
+
+        # Новый запрос пользователя отменяет старый, не дожидаясь своей очереди
+        supersede_update(update)
+        key = partition_key(update)
+        previous = self._chains.get(key)
+        task = asyncio.create_task(self._process(previous, update))
+        self._chains[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+
+    def _done(self, key: int, task: asyncio.Task):
+        if self._chains.get(key) is task:
+            del self._chains[key]
+        self._slots.release()
+
+    async def _process(self, previous: Optional[asyncio.Task], update: Update):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+
+    async def drain(self):
+        while self._chains:
+            await asyncio.gather(*self._chains.values(), return_exceptions=True)
+
+
+class WebhookServer:
+
+    """Приём апдейтов через webhook вместо long polling
+
+    Обработчик HTTP только проверяет секрет, кладёт апдейт в очередь и
+    сразу отвечает 200, чтобы Telegram не повторял доставку. Апдейты
+    одного чата всегда попадают в одну очередь, а из неё — в цепочку
+    своего чата в UpdateProcessor: медленный апдейт задерживает только
+    свой чат, а не всю очередь. Одновременно обрабатывается не больше
+    max_in_flight апдейтов; когда слотов нет, очереди копятся, и если
+    очередь заполнена дольше enqueue_timeout, отвечаем 503 — Telegram
+    повторит доставку позже (backpressure).
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str, queue_size: int, workers: int,
+                 max_in_flight: int, enqueue_timeout: float = 1.0, drain_timeout: float = 30.0):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.enqueue_timeout = enqueue_timeout
+        self.drain_timeout = drain_timeout
+        per_worker = max(1, queue_size // workers)
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=per_worker) for _ in range(workers)]
+        self._workers: List[asyncio.Task] = []
+        self._processor = UpdateProcessor(dp, bot, max_in_flight)
+        self.rejected = 0
+
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logger.warning(f"Некорректный апдейт в webhook: {e}")
+            # Повтор не поможет, подтверждаем
+            return web.Response()
+
+        # Старый запрос пользователя отменит submit(): апдейт, которому
+        # ответили 503, ничего отменять не должен
+        queue = self._queues[partition_key(update) % len(self._queues)]
+        try:
+            await asyncio.wait_for(queue.put(update), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning("Очередь апдейтов переполнена, отвечаем 503")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self._processor.acquire()
+                self._processor.submit(update)
+            finally:
+                queue.task_done()
+
+    async def _drain(self):
+
+        """Дожидается обработки уже принятых апдейтов"""
+
+        async def drain():
+            await asyncio.gather(*(queue.join() for queue in self._queues))
+            await self._processor.drain()
+
+        try:
+            await asyncio.wait_for(drain(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не успели обработать {self.queue_depth()} апдейтов при остановке")
+
+    async def run(self, url: str, path: str, host: str, port: int):
+        app = web.Application()
+        app.router.add_post(path, self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+        workflow_data = {"dispatcher": self.dp, "bots": [self.bot], **self.dp.workflow_data}
+        await self.dp.emit_startup(bot=self.bot, **workflow_data)
+        self._workers = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+        try:
+            await site.start()
+            await self.bot.set_webhook(
+                f"{url.rstrip('/')}{path}",
+                secret_token=self.secret or None,
+                allowed_updates=self.dp.resolve_used_update_types()
+            )
+            logger.info(f"Webhook слушает {host}:{port}{path}")
+            await stop_event.wait()
+        finally:
+            logger.info("Остановка webhook: перестаём принимать апдейты")
+            await site.stop()
+            await self._drain()
+            for task in self._workers:
+                task.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            await runner.cleanup()
+            await self.dp.emit_shutdown(bot=self.bot, **workflow_data)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    server = WebhookServer(
+        dp,
+        bot,
+        config.WEBHOOK_SECRET,
+        config.WEBHOOK_QUEUE_SIZE,
+        config.WEBHOOK_WORKERS,
+        config.WEBHOOK_MAX_IN_FLIGHT
+    )
+    await server.run(config.WEBHOOK_URL, config.WEBHOOK_PATH, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
@@ -0,0 +1,182 @@
+import asyncio
+import multiprocessing
+import os
+import queue as queue_module
+import signal
+import logging
+from typing import List, Optional
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from config import config
+from webhook import partition_key, UpdateProcessor
+from logging_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Сигнал воркеру завершиться после разбора очереди
+STOP = None
+
+
+def worker_filename(filename: str, index: int) -> str:
+
+    """bot.log -> bot.worker-0.log: свой файл на каждый процесс-воркер"""
+
+    base, ext = os.path.splitext(filename)
+    return f"{base}.worker-{index}{ext}"
+
+
+class WorkerSupervisor:
+
+    """Приём апдейтов и раздача их процессам-воркерам
+
+    Процесс-супервизор сам опрашивает getUpdates и кладёт апдейт в очередь
+    воркера partition_key(update) % N, поэтому апдейты одного чата всегда
+    обрабатывает один процесс в исходном порядке. Упавший воркер
+    перезапускается с той же очередью. Общее состояние (пользователи, FSM,
+    метаданные песен) лежит в SQLite, кэши в памяти у каждого процесса свои:
+    пользователи и баны перечитываются не реже STORAGE_CACHE_TTL секунд.
+    """
+
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, bot: Bot, workers: int, queue_size: int):
+        self.bot = bot
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._stopping = False
+        self.restarts = 0
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=worker_main,
+            args=(index, self._queues[index]),
+            name=f"bot-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info(f"Воркер {index} запущен (pid {process.pid})")
+
+    async def _monitor(self):
+        while not self._stopping:
+            await asyncio.sleep(self.CHECK_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process is not None and not process.is_alive() and not self._stopping:
+                    logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапуск")
+                    self.restarts += 1
+                    self._start_worker(index)
+
+    async def _poll(self, allowed_updates: List[str], stop_event: asyncio.Event):
+        offset: Optional[int] = None
+        while not stop_event.is_set():
+            try:
+                updates = await self.bot.get_updates(offset=offset, timeout=25, allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.error(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                index = partition_key(update) % self.workers
+                # put блокируется, если воркер не успевает: это и есть backpressure
+                await asyncio.to_thread(self._queues[index].put, update.model_dump_json(exclude_none=True))
+
+    async def run(self, allowed_updates: List[str]):
+        for index in range(self.workers):
+            self._start_worker(index)
+
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+        monitor = asyncio.create_task(self._monitor())
+        poller = asyncio.create_task(self._poll(allowed_updates, stop_event))
+        try:
+            await self.bot.delete_webhook(drop_pending_updates=True)
+            logger.info(f"Бот начал поллинг с {self.workers} воркерами...")
+            await stop_event.wait()
+        finally:
+            self._stopping = True
+            poller.cancel()
+            monitor.cancel()
+            await asyncio.gather(poller, monitor, return_exceptions=True)
+            await asyncio.to_thread(self._stop_workers)
+
+    def _stop_workers(self, timeout: float = 30.0):
+        for worker_queue in self._queues:
+            try:
+                worker_queue.put(STOP, True, timeout)
+            except queue_module.Full:
+                pass
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Воркер {index} не остановился, завершаем принудительно")
+                process.terminate()
+
+
+async def _worker_loop(index: int, worker_queue: multiprocessing.Queue):
+    # Импорт здесь: bot импортирует этот модуль
+    from bot import create_dispatcher, start_stores, close_stores
+
+    bot = Bot(token=config.BOT_TOKEN)
+    # У каждого воркера свой порт метрик (METRICS_PORT + 1 + index) и свой снимок
+    # поискового индекса: одновременная запись в один файл портила бы его
+    dp = create_dispatcher(
+        config.METRICS_PORT + 1 + index if config.METRICS_PORT else 0,
+        worker_filename(config.SEARCH_SNAPSHOT_FILE, index)
+    )
+    processor = UpdateProcessor(dp, bot, config.WORKER_MAX_IN_FLIGHT)
+    stop_event = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
+
+    start_stores()
+    if index == 0:
+        # Обновление избранного общее для всех процессов — ведёт только первый
+        from favorites_refresh import get_favorites_refresher
+        get_favorites_refresher().start_scheduler()
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    try:
+        while not stop_event.is_set():
+            await processor.acquire()
+            try:
+                raw = await asyncio.to_thread(worker_queue.get, True, 1.0)
+            except queue_module.Empty:
+                processor.release()
+                continue
+            if raw is STOP:
+                processor.release()
+                break
+            processor.submit(Update.model_validate_json(raw, context={"bot": bot}))
+    finally:
+        await processor.drain()
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+        await dp.storage.close()
+        await bot.session.close()
+        await close_stores()
+        logger.info(f"Воркер {index} остановлен")
+
+
+def worker_main(index: int, worker_queue: multiprocessing.Queue):
+
+    """Точка входа процесса-воркера"""
+
+    # Ctrl+C получает вся группа процессов; воркер останавливает супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Ротация одного файла из нескольких процессов небезопасна
+    setup_logging(worker_filename(config.LOG_FILE, index))
+    asyncio.run(_worker_loop(index, worker_queue))
+
+
+async def run_supervisor(bot: Bot, dp: Dispatcher, workers: int):
+    supervisor = WorkerSupervisor(bot, workers, config.WORKER_QUEUE_SIZE)
+    await supervisor.run(dp.resolve_used_update_types())